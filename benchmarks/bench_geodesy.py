@@ -0,0 +1,77 @@
+"""
+Micro-benchmark: NumPy nearest-neighbour voyage ordering vs. the original scalar haversine loop.
+Usage: python -m benchmarks.bench_geodesy [--sizes 10 100 1000] [--voyages 200] [--repeat 5]
+"""
+import argparse
+import math
+import random
+import time
+from geodesy import nearest_neighbor_order, nearest_neighbor_orders
+
+
+def legacy_order(start, points):
+    """sorting_dynamic_voyages' original ordering loop, kept here as the baseline."""
+    def haversine(coord1, coord2):
+        lat1, lon1 = coord1
+        lat2, lon2 = coord2
+        R = 6371
+        phi1 = math.radians(lat1)
+        phi2 = math.radians(lat2)
+        dphi = math.radians(lat2 - lat1)
+        dlambda = math.radians(lon2 - lon1)
+        a = math.sin(dphi/2)**2 + math.cos(phi1)*math.cos(phi2)*math.sin(dlambda/2)**2
+        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
+        return R * c
+    order = []
+    current = start
+    pool = list(enumerate(points))
+    while pool:
+        next_idx, (index, point) = min(enumerate(pool), key=lambda x: haversine(current, x[1][1]))
+        order.append(index)
+        current = point
+        pool.pop(next_idx)
+    return order
+
+
+def random_points(rng, n):
+    return [[rng.uniform(-60, 70), rng.uniform(-180, 180)] for _ in range(n)]
+
+
+def time_call(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--voyages', type=int, default=200, help='voyages in the batch comparison')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    print(f"{'points':>8} {'legacy ms':>12} {'numpy ms':>12} {'speedup':>8}")
+    for n in args.sizes:
+        rng = random.Random(n)
+        start, points = random_points(rng, 1)[0], random_points(rng, n)
+        assert legacy_order(start, points) == nearest_neighbor_order(start, points)
+        legacy = time_call(lambda: legacy_order(start, points), args.repeat)
+        vectorized = time_call(lambda: nearest_neighbor_order(start, points), args.repeat)
+        print(f"{n:>8} {legacy * 1000:>12.3f} {vectorized * 1000:>12.3f} {legacy / vectorized:>7.1f}x")
+
+    rng = random.Random(0)
+    starts = random_points(rng, args.voyages)
+    point_sets = [random_points(rng, rng.randint(1, 8)) for _ in range(args.voyages)]
+    assert [legacy_order(s, p) for s, p in zip(starts, point_sets)] == nearest_neighbor_orders(starts, point_sets)
+    legacy = time_call(lambda: [legacy_order(s, p) for s, p in zip(starts, point_sets)], args.repeat)
+    one_by_one = time_call(lambda: [nearest_neighbor_order(s, p) for s, p in zip(starts, point_sets)], args.repeat)
+    batched = time_call(lambda: nearest_neighbor_orders(starts, point_sets), args.repeat)
+    print(f"\n{args.voyages} voyages of 1-8 points: legacy {legacy * 1000:.3f} ms, "
+          f"numpy per voyage {one_by_one * 1000:.3f} ms, numpy batch {batched * 1000:.3f} ms "
+          f"({legacy / batched:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
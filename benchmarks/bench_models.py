@@ -0,0 +1,153 @@
+"""
+Memory benchmark: per-voyage footprint of a full voyage load, before and after slotted models.
+"Before" runs the original get_voyages (dict-based classes, list coordinates, fresh
+Port/Vessel/ShippingRoute objects per row, legs decoded up front); "after" is
+VesselTrackingService.get_voyages. Both load the same synthetic database.
+Usage: python -m benchmarks.bench_models [--voyages 100000] [--ports 200] [--vessels 2000]
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import tempfile
+import tracemalloc
+import db
+from benchmarks.synthetic import PORT_NAMES
+from geocoding import normalize_place_name
+from migrations import ensure_schema
+from service import VesselTrackingService
+
+
+class LegacyVessel:
+    def __init__(self, name, current_location, status='on_time'):
+        self.name = name
+        self.current_location = current_location
+        self.status = status
+
+class LegacyPort:
+    def __init__(self, name, location, status='normal'):
+        self.name = name
+        self.location = location
+        self.status = status
+
+class LegacyShippingRoute:
+    def __init__(self, name, color, origin_port, destination_port):
+        self.name = name
+        self.color = color
+        self.origin_port = origin_port
+        self.destination_port = destination_port
+
+class LegacyVoyage:
+    def __init__(self, route, vessel, departure_date, arrival_date, status='scheduled', transshipment_ports=None):
+        self.route = route
+        self.vessel = vessel
+        self.departure_date = departure_date
+        self.arrival_date = arrival_date
+        self.status = status
+        self.transshipment_ports = transshipment_ports if transshipment_ports is not None else []
+
+
+LEGACY_QUERY = '''
+    SELECT v.id, v.departure_date, v.arrival_date, v.status, v.legs,
+           r.name, r.color,
+           op.name, op.latitude, op.longitude, op.status,
+           dp.name, dp.latitude, dp.longitude, dp.status,
+           ve.name, ve.current_latitude, ve.current_longitude, ve.status
+    FROM voyages v
+    JOIN routes r ON v.route_id = r.id
+    JOIN ports op ON r.origin_port_id = op.id
+    JOIN ports dp ON r.destination_port_id = dp.id
+    JOIN vessels ve ON v.vessel_id = ve.id
+'''
+
+
+def legacy_build(row):
+    """The original get_voyages loop body: new objects for every row, legs decoded eagerly."""
+    origin_port = LegacyPort(row[7], [row[8], row[9]], row[10])
+    destination_port = LegacyPort(row[11], [row[12], row[13]], row[14])
+    route = LegacyShippingRoute(name=row[5], color=row[6], origin_port=origin_port, destination_port=destination_port)
+    vessel = LegacyVessel(row[15], [row[16], row[17]], row[18])
+    legs = json.loads(row[4]) if row[4] else []
+    return LegacyVoyage(route=route, vessel=vessel, departure_date=row[1], arrival_date=row[2], status=row[3],
+                        transshipment_ports=legs[1:-1] if len(legs) > 2 else [])
+
+
+def make_database(path, n_voyages, n_ports, n_vessels, seed=0):
+    """A migrated database at path filled with synthetic ports, vessels, routes and voyages."""
+    rng = random.Random(seed)
+    ensure_schema(path)
+    conn = db.connect(path)
+    ports = [(f'{PORT_NAMES[i % len(PORT_NAMES)]} {i}', rng.uniform(-60, 70), rng.uniform(-180, 180))
+             for i in range(n_ports)]
+    conn.executemany('INSERT INTO ports (name, name_key, latitude, longitude) VALUES (?, ?, ?, ?)',
+                     [(name, normalize_place_name(name), lat, lon) for name, lat, lon in ports])
+    conn.executemany('INSERT INTO vessels (name, name_key, current_latitude, current_longitude) VALUES (?, ?, ?, ?)',
+                     [(f'VESSEL {i}', f'vessel {i}', rng.uniform(-60, 70), rng.uniform(-180, 180))
+                      for i in range(n_vessels)])
+    routes = {}
+    voyages = []
+    for _ in range(n_voyages):
+        origin, destination = rng.sample(range(n_ports), 2)
+        if (origin, destination) not in routes:
+            routes[(origin, destination)] = len(routes) + 1
+            conn.execute('INSERT INTO routes (id, name, color, origin_port_id, destination_port_id) VALUES (?, ?, ?, ?, ?)',
+                         (routes[(origin, destination)], f'{ports[origin][0]}-{ports[destination][0]} Route',
+                          '#498e83', origin + 1, destination + 1))
+        legs = [ports[i][0] for i in (origin, *rng.sample(range(n_ports), 2), destination)]
+        voyages.append((routes[(origin, destination)], rng.randrange(n_vessels) + 1, '2025-01-01T00:00:00Z',
+                        '2025-02-01T00:00:00Z', 'in_transit', json.dumps(legs)))
+    conn.executemany('INSERT INTO voyages (route_id, vessel_id, departure_date, arrival_date, status, legs) '
+                     'VALUES (?, ?, ?, ?, ?, ?)', voyages)
+    conn.commit()
+    conn.close()
+
+
+def measure(load):
+    """Bytes still allocated by the voyages load() returns, i.e. the resident size of one full load."""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    voyages = load()
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return after - before, voyages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--voyages', type=int, default=100000)
+    parser.add_argument('--ports', type=int, default=200)
+    parser.add_argument('--vessels', type=int, default=2000)
+    args = parser.parse_args()
+    path = os.path.join(tempfile.mkdtemp(), 'bench_models.db')
+    make_database(path, args.voyages, args.ports, args.vessels)
+    service = VesselTrackingService(path)
+
+    def legacy_load():
+        return [legacy_build(row) for row in db.get_connection(path).execute(LEGACY_QUERY).fetchall()]
+
+    def current_load(read_legs=False):
+        voyages = service.get_voyages()
+        if read_legs:
+            for voyage in voyages:
+                voyage.transshipment_ports
+        return voyages
+
+    legacy_bytes, legacy = measure(legacy_load)
+    del legacy
+    lazy_bytes, current = measure(current_load)
+    ports = len({id(v.route.origin_port) for v in current} | {id(v.route.destination_port) for v in current})
+    del current
+    # The legacy load always decoded the legs, so also measure after every voyage's legs were read
+    decoded_bytes, _ = measure(lambda: current_load(read_legs=True))
+    print(f"{args.voyages} voyages, {ports} distinct Port objects after interning")
+    print(f"{'':>29} {'total MB':>10} {'bytes/voyage':>14} {'saved':>7}")
+    for label, total in (('legacy', legacy_bytes), ('slotted + interned', lazy_bytes),
+                         ('slotted + interned, legs read', decoded_bytes)):
+        print(f"{label:>29} {total / 1e6:>10.1f} {total / args.voyages:>14.0f} {1 - total / legacy_bytes:>7.0%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Micro-benchmark: indexed payload parser vs. the original multi-scan handler logic.
+Usage: python -m benchmarks.bench_payload_parser [--sizes 10 100 1000] [--repeat 20]
+"""
+import argparse
+import time
+from payload_parser import parse_shipment_payload
+from benchmarks.synthetic import make_shipment_payload
+
+
+def legacy_parse(payload):
+    """The webhook handler's original parsing, kept here as the baseline."""
+    included = payload.get('included', [])
+    shipment = next(item for item in included if item['type'] == 'shipment')
+    attrs = shipment['attributes']
+    origin_name = attrs.get('port_of_lading_name')
+    dest_name = attrs.get('port_of_discharge_name')
+    vessel_name = attrs.get('pod_vessel_name')
+    port_lookup = {p['id']: p['attributes']['name'] for p in included if p['type'] == 'port' and 'attributes' in p and 'name' in p['attributes']}
+    container = next((item for item in included if item['type'] == 'container'), None)
+    legs = []
+    if container and 'relationships' in container and 'transport_events' in container['relationships']:
+        event_ids = [e['id'] for e in container['relationships']['transport_events']['data'] if 'id' in e]
+        events = [item for item in included if item['type'] == 'transport_event' and item['id'] in event_ids]
+        events.sort(key=lambda ev: ev.get('attributes', {}).get('timestamp') or '')
+        for ev in events:
+            port_id = None
+            if 'relationships' in ev and 'location' in ev['relationships'] and ev['relationships']['location']['data']:
+                port_id = ev['relationships']['location']['data']['id']
+            if port_id and port_id in port_lookup:
+                legs.append(port_lookup[port_id])
+    for p in included:
+        if p['type'] == 'port' and 'attributes' in p and 'name' in p['attributes']:
+            pname = p['attributes']['name']
+            if pname not in legs and pname not in (origin_name, dest_name):
+                legs.append(pname)
+    full_legs = [origin_name]
+    for port in legs:
+        if port not in (origin_name, dest_name) and port not in full_legs:
+            full_legs.append(port)
+    if dest_name not in full_legs:
+        full_legs.append(dest_name)
+    next((item for item in included if item['type'] == 'vessel' and 'attributes' in item and item['attributes'].get('name') == vessel_name), None)
+    return full_legs
+
+
+def time_call(fn, payload, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(payload)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 5000])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    print(f"{'events':>8} {'legacy ms':>12} {'indexed ms':>12} {'speedup':>8}")
+    for n in args.sizes:
+        payload = make_shipment_payload(seed=n, n_events=n, n_ports=max(2, n // 4))
+        assert legacy_parse(payload) == parse_shipment_payload(payload).legs
+        legacy = time_call(legacy_parse, payload, args.repeat)
+        indexed = time_call(parse_shipment_payload, payload, args.repeat)
+        print(f"{n:>8} {legacy * 1000:>12.3f} {indexed * 1000:>12.3f} {legacy / indexed:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
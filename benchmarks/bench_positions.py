@@ -0,0 +1,65 @@
+"""
+Throughput benchmark: position reports per second through PositionStore.ingest_stream
+(parsing, vessel lookup, raw insert, three downsampled tracks and current positions).
+Usage: python -m benchmarks.bench_positions [--reports 200000] [--vessels 2000] [--chunk 5000]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+import db
+from positions import PositionStore, RESOLUTIONS
+
+
+def make_reports(n_reports, n_vessels, seed=0):
+    """AIS-like reports: every vessel reports every 10-30 seconds, interleaved in time order."""
+    rng = random.Random(seed)
+    start = 1735689600
+    state = [[rng.uniform(-60, 70), rng.uniform(-180, 180), start + rng.randrange(30)] for _ in range(n_vessels)]
+    reports = []
+    while len(reports) < n_reports:
+        vessel = rng.randrange(n_vessels)
+        lat, lon, ts = state[vessel]
+        state[vessel] = [min(max(lat + rng.uniform(-0.01, 0.01), -89), 89),
+                         (lon + rng.uniform(-0.01, 0.01) + 180) % 360 - 180, ts + rng.randint(10, 30)]
+        reports.append({'mmsi': 200000000 + vessel, 'vessel': f'VESSEL {vessel}', 'lat': round(lat, 5),
+                        'lon': round(lon, 5), 'timestamp': ts, 'sog': 12.5, 'cog': 90.0})
+    return reports
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--reports', type=int, default=200000)
+    parser.add_argument('--vessels', type=int, default=2000)
+    parser.add_argument('--chunk', type=int, default=5000, help='reports per transaction')
+    args = parser.parse_args()
+    reports = make_reports(args.reports, args.vessels)
+    path = os.path.join(tempfile.mkdtemp(), 'bench_positions.db')
+    store = PositionStore(path)
+    # First pass creates the vessels; the timed passes see known vessels like a running system
+    warmup = args.vessels * 5
+    store.ingest_stream(reports[:warmup], args.chunk)
+    start = time.perf_counter()
+    stored, duplicates, errors = store.ingest_stream(reports[warmup:], args.chunk)
+    elapsed = time.perf_counter() - start
+    assert not errors and duplicates == 0
+    print(f"{stored} reports from {args.vessels} vessels in {elapsed:.2f} s: {stored / elapsed:,.0f} reports/s "
+          f"({args.chunk} per transaction)")
+    resent = reports[warmup:warmup + args.chunk * 4]
+    start = time.perf_counter()
+    _, duplicates, _ = store.ingest_stream(resent, args.chunk)
+    elapsed = time.perf_counter() - start
+    print(f"{duplicates} resent reports ignored at {duplicates / elapsed:,.0f} reports/s")
+    conn = db.get_connection(path)
+    for name, width in RESOLUTIONS.items():
+        buckets = conn.execute('SELECT COUNT(*) FROM vessel_tracks WHERE resolution = ?', (width,)).fetchone()[0]
+        print(f"{name:>4} track: {buckets} buckets")
+    start = time.perf_counter()
+    # The synthetic reports are dated 2025; the wake window ends at the newest of them
+    wakes = store.wakes(now=max(report['timestamp'] for report in reports))
+    print(f"wakes for {len(wakes)} vessels read in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
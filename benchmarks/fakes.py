@@ -0,0 +1,75 @@
+"""
+Offline stand-ins for Nominatim and searoute, so benchmarks need no network and
+give the same answers on every run. offline() installs both for the duration of a
+with block; latencies can be simulated to model the real services.
+"""
+import math
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+import route_cache
+from geocoding import get_geocoder, normalize_place_name
+from geodesy import haversine_km
+
+Location = namedtuple('Location', 'latitude longitude')
+
+
+class FakeNominatim:
+    """Answers geocode() from a {name: (lat, lon)} gazetteer, like geopy's Nominatim does."""
+    def __init__(self, gazetteer, latency=0.0):
+        self.places = {normalize_place_name(name): coords for name, coords in gazetteer.items()}
+        self.latency = latency
+        self.calls = 0
+
+    def geocode(self, query, **kwargs):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        coords = self.places.get(normalize_place_name(query))
+        return Location(*coords) if coords else None
+
+
+class FakeSearoute:
+    """
+    searoute.searoute look-alike: a straight line in unwrapped longitude with one vertex
+    per ~100 km, as a GeoJSON Feature with the length in properties.
+    """
+    def __init__(self, latency=0.0, km_per_vertex=100.0, max_vertices=400):
+        self.latency = latency
+        self.km_per_vertex = km_per_vertex
+        self.max_vertices = max_vertices
+        self.calls = 0
+
+    def searoute(self, origin, destination, units='km', **kwargs):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        (lon1, lat1), (lon2, lat2) = origin, destination
+        # Take the short way round, like the real network does across the Pacific
+        lon2 = lon1 + (lon2 - lon1 + 180) % 360 - 180
+        length = float(haversine_km([[lat1, lon1]], [[lat2, lon2]])[0])
+        steps = min(self.max_vertices, max(1, math.ceil(length / self.km_per_vertex)))
+        coordinates = []
+        for i in range(steps + 1):
+            t = i / steps
+            lon = lon1 + (lon2 - lon1) * t
+            coordinates.append([(lon + 180) % 360 - 180, lat1 + (lat2 - lat1) * t])
+        return {'type': 'Feature', 'geometry': {'type': 'LineString', 'coordinates': coordinates},
+                'properties': {'length': length, 'units': units}}
+
+
+@contextmanager
+def offline(gazetteer, geocode_latency=0.0, searoute_latency=0.0):
+    """Routes geocoding and sea routing through the fakes; yields (nominatim, searoute)."""
+    geocoder = get_geocoder()
+    nominatim = FakeNominatim(gazetteer, geocode_latency)
+    searoute = FakeSearoute(searoute_latency)
+    saved = geocoder.geolocator, geocoder.limiter, route_cache.sr
+    geocoder.geolocator = nominatim
+    # The real rate limit is Nominatim's; the fake models latency explicitly instead
+    geocoder.limiter = None
+    route_cache.sr = searoute
+    try:
+        yield nominatim, searoute
+    finally:
+        geocoder.geolocator, geocoder.limiter, route_cache.sr = saved
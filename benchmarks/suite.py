@@ -0,0 +1,248 @@
+"""
+End-to-end benchmark: ingests a synthetic fleet through the webhook into a fresh database,
+then times the read paths the dashboard uses. Geocoding and sea routing go through the
+offline fakes. Every stage reports throughput, latency percentiles and peak memory, and the
+whole run is written as JSON so runs can be compared over time.
+Usage: python -m benchmarks.suite [--scenario 10|1k|100k|1m] [--output results.json] [--render-limit 500]
+"""
+import argparse
+import contextlib
+import gc
+import json
+import os
+import platform
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import numpy as np
+import db
+from benchmarks.fakes import offline
+from benchmarks.synthetic import SyntheticFleet
+
+SCENARIOS = {'10': 10, '1k': 1000, '100k': 100000, '1m': 1000000}
+# Voyages posted one at a time to /webhook/shipment; the rest of the fleet goes through the batch endpoint
+SINGLE_INGEST = 500
+BATCH_SIZE = 1000
+SAMPLE_SIZE = 1000
+PAGE_SIZE = 100
+PAGES = 100
+
+
+def log(message):
+    print(f"[INFO] {message}", file=sys.stderr)
+
+
+def percentiles(seconds):
+    ms = np.asarray(seconds) * 1000
+    return {'mean': round(float(ms.mean()), 3), 'p50': round(float(np.percentile(ms, 50)), 3),
+            'p90': round(float(np.percentile(ms, 90)), 3), 'p99': round(float(np.percentile(ms, 99)), 3),
+            'max': round(float(ms.max()), 3)}
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def current_rss():
+    """Resident set size in bytes; the lifetime peak where /proc is not available."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class RssSampler:
+    """Peak resident set size while a stage runs, sampled on a background thread."""
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self._stop = threading.Event()
+
+    def __enter__(self):
+        self.start = self.peak = current_rss()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+
+class StageRecorder:
+    """
+    Runs stages one after another and collects their measurements. Peak memory is the
+    sampled RSS; trace_memory adds the Python heap peak from tracemalloc, which also
+    slows everything down several times, so timings of traced runs don't compare to untraced ones.
+    """
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.stages = {}
+        if trace_memory:
+            tracemalloc.start()
+
+    def run(self, name, fn, unit):
+        """fn() returns (items processed, per-item or per-request latencies in seconds)."""
+        gc.collect()
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+        with RssSampler() as rss:
+            start = time.perf_counter()
+            items, latencies = fn()
+            elapsed = time.perf_counter() - start
+        stage = {'items': items, 'unit': unit, 'seconds': round(elapsed, 4),
+                 'throughput_per_s': round(items / elapsed, 1) if elapsed else None}
+        if latencies:
+            stage['latency_ms'] = percentiles(latencies)
+        stage['rss_peak_mb'] = round(rss.peak / 1e6, 1)
+        stage['rss_growth_mb'] = round((rss.peak - rss.start) / 1e6, 1)
+        if self.trace_memory:
+            stage['heap_peak_mb'] = round((tracemalloc.get_traced_memory()[1] - baseline) / 1e6, 2)
+        self.stages[name] = stage
+        latency = f", p50 {stage['latency_ms']['p50']} ms, p99 {stage['latency_ms']['p99']} ms" if latencies else ''
+        log(f"{name}: {items} {unit} in {elapsed:.2f} s ({stage['throughput_per_s']}/s{latency})")
+        return stage
+
+
+def ingest_single(client, fleet, count):
+    latencies = []
+    for payload in fleet.payloads(0, count):
+        response, seconds = timed(client.post, '/webhook/shipment', json=payload)
+        if response.status_code != 201:
+            raise RuntimeError(f'Webhook returned {response.status_code}: {response.get_json()}')
+        latencies.append(seconds)
+    return count, latencies
+
+
+def ingest_batches(client, fleet, start, batch_size):
+    latencies = []
+    created = 0
+    for first in range(start, fleet.n_voyages, batch_size):
+        body = '\n'.join(json.dumps(p) for p in fleet.payloads(first, min(first + batch_size, fleet.n_voyages)))
+        response, seconds = timed(client.post, '/webhook/shipments:batch', data=body)
+        result = response.get_json()
+        if response.status_code != 200 or result['failed']:
+            raise RuntimeError(f'Batch at {first} failed: {response.status_code}')
+        created += result['created']
+        latencies.append(seconds)
+    return created, latencies
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scenario', choices=SCENARIOS, default='1k', help='fleet size in voyages')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the JSON result here instead of stdout')
+    parser.add_argument('--render-limit', type=int, default=500, help='voyages drawn by the render_routes stage')
+    parser.add_argument('--workers', type=int, default=1, help='processes for route geometry in render_routes')
+    parser.add_argument('--geocode-latency-ms', type=float, default=0.0, help='simulated Nominatim latency')
+    parser.add_argument('--searoute-latency-ms', type=float, default=0.0, help='simulated searoute latency')
+    parser.add_argument('--trace-memory', action='store_true', help='also report the Python heap peak (much slower)')
+    args = parser.parse_args()
+
+    n_voyages = SCENARIOS[args.scenario]
+    workdir = tempfile.mkdtemp(prefix='vessel-bench-')
+    db.set_db_path(os.path.join(workdir, 'vessel_tracking.db'))
+    fleet = SyntheticFleet(n_voyages, seed=args.seed)
+    log(f"Scenario {args.scenario}: {n_voyages} voyages, {len(fleet.ports)} ports, "
+        f"{len(fleet.vessel_names)} vessels in {workdir}")
+
+    # The code under test logs to stdout, which is reserved for the JSON result
+    with contextlib.redirect_stdout(sys.stderr), \
+            offline(fleet.ports, args.geocode_latency_ms / 1000, args.searoute_latency_ms / 1000) as (nominatim, searoute):
+        # Imported here so the fakes are installed before anything can geocode
+        from server import app
+        from service import VesselTrackingService
+        from dashboard import VesselTrackingDashboard
+        recorder = StageRecorder(trace_memory=args.trace_memory)
+        client = app.test_client()
+        service = VesselTrackingService()
+        single = min(SINGLE_INGEST, n_voyages)
+        recorder.run('webhook_single', lambda: ingest_single(client, fleet, single), 'voyages')
+        if n_voyages > single:
+            recorder.run('webhook_batch', lambda: ingest_batches(client, fleet, single, BATCH_SIZE), 'voyages')
+
+        voyages = []
+
+        def load_all():
+            voyages[:], seconds = timed(service.get_voyages)
+            return len(voyages), [seconds]
+        recorder.run('get_voyages', load_all, 'voyages')
+
+        def page_through():
+            latencies = []
+            cursor = None
+            for _ in range(PAGES):
+                (page, cursor), seconds = timed(lambda: service.get_voyage_page(PAGE_SIZE, cursor))
+                latencies.append(seconds)
+                if cursor is None:
+                    break
+            return len(latencies), latencies
+        recorder.run('get_voyage_page', page_through, 'pages')
+
+        dashboard = VesselTrackingDashboard(workers=args.workers)
+        sample = voyages[:SAMPLE_SIZE]
+
+        def sort_each():
+            latencies = [timed(dashboard.sorting_dynamic_voyages, voyage)[1] for voyage in sample]
+            return len(sample), latencies
+        recorder.run('sorting_dynamic_voyages', sort_each, 'voyages')
+        recorder.run('sort_voyages_batch', lambda: (len(voyages), [timed(dashboard.sort_voyages, voyages)[1]]), 'voyages')
+
+        def render():
+            dashboard.voyages = voyages[:args.render_limit]
+            _, seconds = timed(dashboard.render_routes)
+            html, render_seconds = timed(dashboard.map.get_root().render)
+            log(f"Rendered map HTML: {len(html) / 1e6:.1f} MB")
+            return len(dashboard.voyages), [seconds + render_seconds]
+        recorder.run('render_routes', render, 'voyages')
+        fakes = {'geocode_calls': nominatim.calls, 'searoute_calls': searoute.calls}
+
+    result = {
+        'scenario': args.scenario,
+        'voyages': n_voyages,
+        'ports': len(fleet.ports),
+        'vessels': len(fleet.vessel_names),
+        'seed': args.seed,
+        'trace_memory': args.trace_memory,
+        'render_limit': args.render_limit,
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'fakes': fakes,
+        'stages': recorder.stages,
+    }
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+        log(f"Results written to {args.output}")
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
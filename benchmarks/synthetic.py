@@ -0,0 +1,92 @@
+"""
+Deterministic synthetic data for benchmarks.
+Payloads follow the JSON:API shape the shipment webhook expects: a shipment,
+a container whose transport_events point at ports, the ports, and the vessel.
+"""
+import random
+
+PORT_NAMES = [
+    'Rotterdam', 'Norfolk, VA', 'Halifax', 'Montreal', 'Singapore', 'Haiphong',
+    'Yantian', 'Ningbo', 'Shanghai', 'Busan', 'Kaohsiung', 'Colombo', 'Salalah',
+    'Hamburg', 'Felixstowe', 'Southampton', 'New York', 'Vancouver', 'Chittagong',
+]
+
+
+def make_shipment_payload(seed=0, n_events=6, n_ports=None, port_names=PORT_NAMES, vessel_name=None):
+    """
+    Builds one webhook payload with n_events transport events spread over n_ports ports.
+    The same seed always yields the same payload.
+    """
+    rng = random.Random(seed)
+    n_ports = n_ports or max(2, min(len(port_names), n_events))
+    if n_ports <= len(port_names):
+        names = rng.sample(port_names, n_ports)
+    else:
+        names = [f'{rng.choice(port_names)} {i}' for i in range(n_ports)]
+    ports = [{'id': f'port-{seed}-{i}', 'type': 'port', 'attributes': {'name': name}} for i, name in enumerate(names)]
+    events = []
+    for i in range(n_events):
+        port = ports[min(i * n_ports // max(n_events, 1), n_ports - 1)]
+        events.append({
+            'id': f'event-{seed}-{i}',
+            'type': 'transport_event',
+            'attributes': {'event': 'container.transport.vessel_departed', 'timestamp': f'2025-{1 + i // 28 % 12:02d}-{1 + i % 28:02d}T00:00:00Z'},
+            'relationships': {'location': {'data': {'id': port['id'], 'type': 'port'}}},
+        })
+    rng.shuffle(events)
+    vessel_name = vessel_name or f'SYNTH VESSEL {seed % 997}'
+    container = {
+        'id': f'container-{seed}',
+        'type': 'container',
+        'attributes': {'number': f'SYNU{seed:07d}'},
+        'relationships': {'transport_events': {'data': [{'id': e['id'], 'type': 'transport_event'} for e in events]}},
+    }
+    shipment = {
+        'id': f'shipment-{seed}',
+        'type': 'shipment',
+        'attributes': {
+            'bill_of_lading_number': f'SYNBL{seed:08d}',
+            'port_of_lading_name': names[0],
+            'port_of_discharge_name': names[-1],
+            'pod_vessel_name': vessel_name,
+            'pol_atd_at': '2025-01-01T00:00:00Z',
+            'pod_eta_at': '2025-03-01T00:00:00Z',
+        },
+    }
+    vessel = {
+        'id': f'vessel-{seed}',
+        'type': 'vessel',
+        'attributes': {'name': vessel_name, 'latitude': rng.uniform(-60, 60), 'longitude': rng.uniform(-180, 180)},
+    }
+    included = [shipment, container] + events + ports + [vessel]
+    return {'data': {'id': f'notification-{seed}', 'type': 'webhook_notification'}, 'included': included}
+
+
+class SyntheticFleet:
+    """
+    A deterministic world for end-to-end benchmarks: named ports with coordinates, a pool
+    of vessel names and one webhook payload per voyage. The same seed and sizes always give
+    the same fleet; payloads are generated on demand, so a million voyages are never held at once.
+    """
+    def __init__(self, n_voyages, seed=0, n_ports=None, n_vessels=None):
+        self.n_voyages = n_voyages
+        self.seed = seed
+        rng = random.Random(seed)
+        n_ports = n_ports or min(2000, max(len(PORT_NAMES), n_voyages // 50))
+        names = list(PORT_NAMES) + [f'{PORT_NAMES[i % len(PORT_NAMES)]} {i}' for i in range(len(PORT_NAMES), n_ports)]
+        self.ports = {name: (round(rng.uniform(-50, 60), 4), round(rng.uniform(-180, 180), 4)) for name in names[:n_ports]}
+        self.port_names = list(self.ports)
+        self.vessel_names = [f'SYNTH VESSEL {i}' for i in range(n_vessels or max(4, n_voyages // 20))]
+
+    def coordinates(self, name):
+        """The gazetteer the fake geocoder answers from; None for names outside the fleet."""
+        return self.ports.get(name)
+
+    def payload(self, index):
+        rng = random.Random(self.seed * 1_000_003 + index)
+        return make_shipment_payload(seed=index, n_events=rng.randint(2, 6), port_names=self.port_names,
+                                     vessel_name=self.vessel_names[index % len(self.vessel_names)])
+
+    def payloads(self, start=0, stop=None):
+        for index in range(start, self.n_voyages if stop is None else stop):
+            yield self.payload(index)
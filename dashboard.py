@@ -1,43 +1,31 @@
 import folium
-import sqlite3
-import math
-import searoute as sr
+import os
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext
+from branca.element import Element
 from service import VesselTrackingService
+from route_cache import get_route_cache, normalize_point
+from geodesy import nearest_neighbor_orders
+from polyline import PathPostProcessor, SIMPLIFY_TOLERANCE, COORDINATE_PRECISION
+from layer_cache import LayerCache, CachedVoyageLayer, capture_fragment, layer_key
 from models import Port
-from geopy.geocoders import Nominatim
-try:
-    from global_land_mask import globe
-except ImportError:
-    globe = None
+from gazetteer import locode_for
+from geocoding import geocode, normalize_place_name
+from land_mask import get_land_classifier, land_runs, globe
+from migrations import ensure_schema
+from positions import PositionStore, unwrap_track
+from logs import get_logger, event, DEBUG
+import db
+import logs
+import metrics
 
-class VesselTrackingDashboard:
-    def handle_last_mile_leg(self, current_pos, end_pos, start_port_name, end_port_name, route, current_ref_lon, feature_group):
-        leg_path, is_inland = self.get_continuous_leg(current_pos, end_pos, current_ref_lon, force_sea_route=False)
-        # Log segment info
-        if is_inland:
-            print(f"[INFO] Fallback: Inland segment used from {start_port_name} ({current_pos}) to {end_port_name} ({end_pos}) (sea route not used)")
-        else:
-            print(f"[INFO] SeaRoute library used: Path generated from {start_port_name} ({current_pos}) to {end_port_name} ({end_pos})")
-        folium.PolyLine(
-            locations=leg_path,
-            color=route.color,
-            weight=2,
-            opacity=0.5
-        ).add_to(feature_group)
-        folium.Marker(
-            leg_path[-1],
-            popup=folium.Popup(
-                f"""
-                <div style='padding:8px;min-width:160px;max-width:220px;background:#fff;border-radius:8px;box-shadow:0 2px 8px rgba(0,0,0,0.12);border:1px solid #e0e0e0;'>
-                    <div style='font-weight:bold;font-size:1.1em;color:#2c3e50;'>Port</div>
-                    <div style='margin-top:4px;color:#555;'>{end_port_name}</div>
-                </div>
-                """,
-                max_width=250
-            )
-        ).add_to(feature_group)
-        return leg_path[-1], leg_path
+log = get_logger('dashboard')
+RENDER_SECONDS = metrics.timer('dashboard_stage_seconds', 'Dashboard generation stages', ('stage',))
 
+
+class VesselTrackingDashboard:
     def add_custom_legend(self, route_infos):
         map_id = self.map._id
         map_var = f"map_{map_id.replace('-', '')}"
@@ -94,7 +82,17 @@ class VesselTrackingDashboard:
         """
         self.map.get_root().html.add_child(folium.Element(legend_html))
 
-    def __init__(self):
+    def __init__(self, workers=None, simplify_tolerance=SIMPLIFY_TOLERANCE, coordinate_precision=COORDINATE_PRECISION,
+                 incremental=False, snap_to_port_km=None):
+        # Processes used for leg geometry; None means one per CPU
+        self.workers = workers
+        # Vessels within this many km of a port are routed through the port itself; None / 0 disable
+        self.snap_to_port_km = snap_to_port_km
+        self._snapped_ports = {}
+        # Reuse rendered layers of voyages whose inputs did not change since the last build
+        self.incremental = incremental
+        # Applied to every leg between path finding and folium.PolyLine; 0 / None disable them
+        self.path_processor = PathPostProcessor(simplify_tolerance, coordinate_precision)
         self.map = folium.Map(
             location=[20, 0],
             tiles='CartoDB Voyager',
@@ -103,8 +101,13 @@ class VesselTrackingDashboard:
             height='60vh',  
             width='100%',
         )
+        if incremental:
+            # Cached layer scripts refer to the map by its JS variable, so it must not change between builds
+            self.map._id = INCREMENTAL_MAP_ID
         self.voyages = []
-        self.geolocator = Nominatim(user_agent="vessel_dashboard_final_leg_only", timeout=10)
+        self.route_cache = get_route_cache()
+        self.land = get_land_classifier()
+        self.layer_cache = LayerCache() if incremental else None
 
     def load_data(self):
         service = VesselTrackingService()
@@ -114,6 +117,23 @@ class VesselTrackingDashboard:
         """
         Returns (sorted_port_names, sorted_coords) for a given voyage using nearest-neighbor logic.
         """
+        return self.sort_voyages([voyage])[0]
+
+    def sort_voyages(self, voyages):
+        """sorting_dynamic_voyages for many voyages, with the nearest-neighbour ordering done in one batch."""
+        endpoints = [self._ordering_points(voyage) for voyage in voyages]
+        orders = nearest_neighbor_orders(
+            [origin['coord'] for origin, _, _ in endpoints],
+            [[p['coord'] for p in others] for _, others, _ in endpoints],
+        )
+        orderings = []
+        for (origin, others, destination), order in zip(endpoints, orders):
+            coords_sorted = [origin] + [others[i] for i in order] + [destination]
+            orderings.append(([p['name'] for p in coords_sorted], [p['coord'] for p in coords_sorted]))
+        return orderings
+
+    def _ordering_points(self, voyage):
+        """(origin, intermediate points with coordinates, destination) as {'name', 'coord'} dicts."""
         origin = {'name': voyage.route.origin_port.name, 'coord': voyage.route.origin_port.location}
         destination = {'name': voyage.route.destination_port.name, 'coord': voyage.route.destination_port.location}
         others = []
@@ -133,41 +153,26 @@ class VesselTrackingDashboard:
                     others.append({'name': str(t), 'coord': None})
         vessel = voyage.vessel
         if hasattr(vessel, 'current_location') and vessel.current_location is not None:
-            others.append({'name': vessel.name + ' (vessel)', 'coord': vessel.current_location})
+            port = self.snap_vessel_position(vessel.current_location)
+            if port is None:
+                others.append({'name': vessel.name + ' (vessel)', 'coord': vessel.current_location})
+            elif all(p['coord'] != port['coord'] for p in [origin, destination] + others):
+                others.append({'name': vessel.name + ' (vessel)', 'coord': port['coord']})
+            # A vessel snapped to one of the voyage's own ports adds no waypoint
         others_with_coords = [p for p in others if p['coord'] is not None]
-        def haversine(coord1, coord2):
-            lat1, lon1 = coord1
-            lat2, lon2 = coord2
-            R = 6371
-            phi1 = math.radians(lat1)
-            phi2 = math.radians(lat2)
-            dphi = math.radians(lat2 - lat1)
-            dlambda = math.radians(lon2 - lon1)
-            a = math.sin(dphi/2)**2 + math.cos(phi1)*math.cos(phi2)*math.sin(dlambda/2)**2
-            c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-            return R * c
-        sorted_points = []
-        current = origin
-        pool = others_with_coords.copy()
-        while pool:
-            next_idx, next_point = min(enumerate(pool), key=lambda x: haversine(current['coord'], x[1]['coord']))
-            sorted_points.append(next_point)
-            current = next_point
-            pool.pop(next_idx)
-        coords_sorted = [origin] + sorted_points + [destination]
-        port_names_sorted = [p['name'] for p in coords_sorted]
-        coords_sorted_only = [p['coord'] for p in coords_sorted]
-        # Print the ordered array
-        print("[COORDINATES ORDERED]")
-        for p in coords_sorted:
-            print(f"  {p['name']}: {p['coord']}")
-        print("---")
-        return port_names_sorted, coords_sorted_only
+        return origin, others_with_coords, destination
+
+    def snap_vessel_position(self, location):
+        """The port within snap_to_port_km of a vessel position as {'name', 'coord'}, or None."""
+        if not self.snap_to_port_km:
+            return None
+        if location not in self._snapped_ports:
+            port = VesselTrackingService().nearest_port(location[0], location[1], self.snap_to_port_km)
+            self._snapped_ports[location] = {'name': port['name'], 'coord': (port['latitude'], port['longitude'])} if port else None
+        return self._snapped_ports[location]
 
     def is_land(self, lat, lon):
-        if globe:
-            return globe.is_land(lat, lon)
-        return False
+        return self.land.is_land(lat, lon)
 
     # function returns an adjusted longitude value. ensures that when plotting routes crossing the 180° meridian, the path remains visually continuous and accurate, avoiding misleading jumps on the map
     def unwrap_longitude(self, target_lon, reference_lon):
@@ -176,24 +181,23 @@ class VesselTrackingDashboard:
         return target_lon - (turns * 360)
 
     def get_port_coords(self, port_name):
-        conn = sqlite3.connect('vessel_tracking.db')
+        ensure_schema()
+        conn = db.get_connection()
         cursor = conn.cursor()
-        cursor.execute('SELECT latitude, longitude FROM ports WHERE name = ?', (port_name,))
+        name_key = normalize_place_name(port_name)
+        locode = locode_for(port_name)
+        cursor.execute('SELECT latitude, longitude FROM ports WHERE name_key = ? OR locode = ? ORDER BY name_key = ? DESC LIMIT 1',
+                       (name_key, locode, name_key))
         row = cursor.fetchone()
         if row:
-            conn.close()
             return [row[0], row[1]]
-        try:
-            location = self.geolocator.geocode(port_name)
-            if location:
-                cursor.execute('INSERT INTO ports (name, latitude, longitude, status) VALUES (?, ?, ?, ?)', 
-                               (port_name, location.latitude, location.longitude, 'normal'))
-                conn.commit()
-                conn.close()
-                return [location.latitude, location.longitude]
-        except:
-            pass
-        conn.close()
+        coords = geocode(port_name)
+        if coords:
+            cursor.execute('''INSERT INTO ports (name, name_key, locode, latitude, longitude, status) VALUES (?, ?, ?, ?, ?, ?)
+                              ON CONFLICT DO NOTHING''', 
+                           (port_name, name_key, locode, coords[0], coords[1], 'normal'))
+            conn.commit()
+            return [coords[0], coords[1]]
         return None
 
     def get_continuous_leg(self, start_coords, end_coords, global_ref_lon, force_sea_route=False):
@@ -217,10 +221,9 @@ class VesselTrackingDashboard:
         calculates a sea route leg using the searoute library, normalizes coordinates, unwraps longitude for continuity.
         returns a list of [lat, lon] pairs.
         """
-        norm_start = [(start_coords[1] + 180) % 360 - 180, start_coords[0]]
-        norm_end = [(end_coords[1] + 180) % 360 - 180, end_coords[0]]
-        route = sr.searoute(norm_start, norm_end, units="km")
-        raw_path = route['geometry']['coordinates']
+        norm_start = normalize_point(start_coords)
+        norm_end = normalize_point(end_coords)
+        raw_path, _ = self.route_cache.get(norm_start, norm_end)
         linear_path = []
         prev_lon = start_coords[1]
         for lon, lat in raw_path:
@@ -229,106 +232,318 @@ class VesselTrackingDashboard:
             prev_lon = actual_lon
         return linear_path
 
-    def render_routes(self):
-        all_bounds = []
-        route_infos = []
+    def compute_voyage_geometry(self, voyage, ordering=None):
+        """
+        Orders the voyage's ports and computes every leg path, without touching the map.
+        Returns a plain dict (so it can come back from a worker process), or None if
+        the voyage has no resolvable coordinates. ordering is a precomputed result of
+        sorting_dynamic_voyages.
+        """
+        port_names, resolved_coords = ordering or self.sorting_dynamic_voyages(voyage)
+        if not resolved_coords:
+            return None
+        current_pos = resolved_coords[0]
+        current_ref_lon = current_pos[1]
+        num_legs = len(resolved_coords) - 1
+        legs = []
+        for i in range(num_legs):
+            is_final_leg = (i == num_legs - 1)
+            end_port_coords = resolved_coords[i+1]
+            if is_final_leg:
+                # Last mile: may fall back to a straight inland segment
+                log_start = current_pos
+                leg_path, is_inland = self.get_continuous_leg(current_pos, end_port_coords, current_ref_lon, force_sea_route=False)
+                current_pos = leg_path[-1]
+            else:
+                log_start = resolved_coords[i]
+                leg_path, is_inland = self.get_continuous_leg(current_pos, end_port_coords, current_ref_lon, force_sea_route=True)
+                current_pos = leg_path[-1]
+                current_ref_lon = current_pos[1]
+            legs.append({
+                'start_name': port_names[i],
+                'end_name': port_names[i+1],
+                'log_start': log_start,
+                'end_coords': end_port_coords,
+                'path': leg_path,
+                'is_inland': is_inland,
+            })
+        return {'port_names': port_names, 'origin': resolved_coords[0], 'legs': legs, 'ref_lon': current_ref_lon}
 
-        for voyage in self.voyages:
-            route = voyage.route
-            feature_group = folium.FeatureGroup(name=route.name, show=True)
-            route_infos.append((route.name, route.color))
-            port_names, resolved_coords = self.sorting_dynamic_voyages(voyage)
-            if not resolved_coords:
-                continue
-            current_pos = resolved_coords[0]
-            current_ref_lon = current_pos[1]
+    def compute_route_geometries(self, voyages, orderings=None):
+        """Leg geometry for every voyage, in voyage order; fanned out to a process pool for large fleets."""
+        if orderings:
+            # Final-leg destinations decide the inland fallback; classify them in one call (workers inherit the memo)
+            self.land.classify([coords[-1] for _, coords in orderings if coords])
+        orderings = orderings or [None] * len(voyages)
+        workers = self.workers or os.cpu_count() or 1
+        if workers <= 1 or len(voyages) < MIN_PARALLEL_VOYAGES:
+            return [self.compute_voyage_geometry(voyage, ordering) for voyage, ordering in zip(voyages, orderings)]
+        chunksize = max(1, len(voyages) // (workers * 4))
+        geometries = []
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_geometry_worker) as pool:
+            for geometry, counts in pool.map(_compute_voyage_geometry, voyages, orderings, chunksize=chunksize):
+                # Workers look routes up in their own copy of the cache; their counts belong in this one's stats
+                self.route_cache.add_counts(*counts)
+                geometries.append(geometry)
+        return geometries
+
+    def render_voyage(self, voyage, geometry, feature_group, all_bounds):
+        route = voyage.route
+        port_names = geometry['port_names']
+        folium.Marker(
+            geometry['origin'],
+            popup=folium.Popup(
+                f"""
+                <div style='padding:8px;min-width:160px;max-width:220px;background:#fff;border-radius:8px;box-shadow:0 2px 8px rgba(0,0,0,0.12);border:1px solid #e0e0e0;'>
+                    <div style='font-weight:bold;font-size:1.1em;color:#2c3e50;'>Origin Port</div>
+                    <div style='margin-top:4px;color:#555;'>{port_names[0]}</div>
+                </div>
+                """,
+                max_width=250
+            )
+        ).add_to(feature_group)
+        log_legs = log.isEnabledFor(DEBUG)
+        for leg in geometry['legs']:
+            leg_path = self.path_processor.process(leg['path'])
+            if log_legs:
+                event(log, DEBUG, 'inland_leg' if leg['is_inland'] else 'sea_leg', start=leg['start_name'],
+                      start_coords=leg['log_start'], end=leg['end_name'], end_coords=leg['end_coords'], vertices=len(leg_path))
+            folium.PolyLine(
+                locations=leg_path,
+                color=route.color,
+                weight=2,
+                opacity=0.5
+            ).add_to(feature_group)
             folium.Marker(
-                current_pos,
+                leg_path[-1],
                 popup=folium.Popup(
                     f"""
                     <div style='padding:8px;min-width:160px;max-width:220px;background:#fff;border-radius:8px;box-shadow:0 2px 8px rgba(0,0,0,0.12);border:1px solid #e0e0e0;'>
-                        <div style='font-weight:bold;font-size:1.1em;color:#2c3e50;'>Origin Port</div>
-                        <div style='margin-top:4px;color:#555;'>{port_names[0]}</div>
+                        <div style='font-weight:bold;font-size:1.1em;color:#2c3e50;'>Port</div>
+                        <div style='margin-top:4px;color:#555;'>{leg['end_name']}</div>
                     </div>
                     """,
                     max_width=250
                 )
             ).add_to(feature_group)
-            num_legs = len(resolved_coords) - 1
-
-            for i in range(num_legs):
-                is_final_leg = (i == num_legs - 1)
-                # Set port names for logging
-                start_port_name = port_names[i]
-                end_port_name = port_names[i+1]
-                start_port_coords = resolved_coords[i]
-                end_port_coords = resolved_coords[i+1]
-                # Exception: if not Pacific and only two legs, always use searoute
-                route_name_lower = route.name.lower()
-                is_pacific = 'pacific' in route_name_lower or 'pacific' in start_port_name.lower() or 'pacific' in end_port_name.lower()
-                force_sea_override = False
-                if num_legs == 1 and not is_pacific:
-                    force_sea_override = True
-                if is_final_leg:
-                    current_pos, leg_path = self.handle_last_mile_leg(current_pos, end_port_coords, start_port_name, end_port_name, route, current_ref_lon, feature_group)
-                else:
-                    leg_path, is_inland = self.get_continuous_leg(current_pos, end_port_coords, current_ref_lon, force_sea_route=(True or force_sea_override))
-                    # Log segment info
-                    if is_inland:
-                        print(f"[INFO] Fallback: Inland segment used from {start_port_name} ({start_port_coords}) to {end_port_name} ({end_port_coords}) (sea route not used)")
-                    else:
-                        print(f"[INFO] SeaRoute library used: Path generated from {start_port_name} ({start_port_coords}) to {end_port_name} ({end_port_coords})")
-                    folium.PolyLine(
-                        locations=leg_path,
-                        color=route.color,
-                        weight=2,
-                        opacity=0.5
-                    ).add_to(feature_group)
-                    current_pos = leg_path[-1]
-                    current_ref_lon = current_pos[1]
-                    folium.Marker(
-                        current_pos,
-                        popup=folium.Popup(
-                            f"""
-                            <div style='padding:8px;min-width:160px;max-width:220px;background:#fff;border-radius:8px;box-shadow:0 2px 8px rgba(0,0,0,0.12);border:1px solid #e0e0e0;'>
-                                <div style='font-weight:bold;font-size:1.1em;color:#2c3e50;'>Port</div>
-                                <div style='margin-top:4px;color:#555;'>{end_port_name}</div>
-                            </div>
-                            """,
-                            max_width=250
-                        )
-                    ).add_to(feature_group)
-                all_bounds.extend(leg_path)
-            v_loc = voyage.vessel.current_location
-            if v_loc:
-                v_lat, v_lon_u = v_loc[0], self.unwrap_longitude(v_loc[1], current_ref_lon)
-                folium.Marker(
-                    [v_lat, v_lon_u],
-                    icon=folium.Icon(color='green', icon='ship', prefix='fa'),
-                    popup=folium.Popup(
-                        f"""
-                        <div style='padding:10px;min-width:170px;max-width:240px;background:#f8f9fa;border-radius:10px;box-shadow:0 2px 10px rgba(0,0,0,0.13);border:1px solid #b2bec3;'>
-                            <div style='font-weight:bold;font-size:1.1em;color:#006266;'>Vessel</div>
-                            <div style='margin-top:4px;color:#222;'>{voyage.vessel.name}</div>
-                            <div style='margin-top:6px;font-size:0.95em;color:#555;'>Route: <span style='color:{route.color};font-weight:bold'>{route.name}</span></div>
-                        </div>
-                        """,
-                        max_width=260
-                    )
-                ).add_to(feature_group)
-                all_bounds.append([v_lat, v_lon_u])
+            all_bounds.extend(leg_path)
+        v_loc = voyage.vessel.current_location
+        if v_loc:
+            v_lat, v_lon_u = v_loc[0], self.unwrap_longitude(v_loc[1], geometry['ref_lon'])
+            folium.Marker(
+                [v_lat, v_lon_u],
+                icon=folium.Icon(color='green', icon='ship', prefix='fa'),
+                popup=folium.Popup(
+                    f"""
+                    <div style='padding:10px;min-width:170px;max-width:240px;background:#f8f9fa;border-radius:10px;box-shadow:0 2px 10px rgba(0,0,0,0.13);border:1px solid #b2bec3;'>
+                        <div style='font-weight:bold;font-size:1.1em;color:#006266;'>Vessel</div>
+                        <div style='margin-top:4px;color:#222;'>{voyage.vessel.name}</div>
+                        <div style='margin-top:6px;font-size:0.95em;color:#555;'>Route: <span style='color:{route.color};font-weight:bold'>{route.name}</span></div>
+                    </div>
+                    """,
+                    max_width=260
+                )
+            ).add_to(feature_group)
+            all_bounds.append([v_lat, v_lon_u])
+
+    def render_routes(self):
+        if self.incremental:
+            return self.render_routes_incremental()
+        all_bounds = []
+        route_infos = []
+        # Path finding first (possibly in parallel), then folium objects in voyage order
+        geometries = self.compute_route_geometries(self.voyages, self.sort_voyages(self.voyages))
+
+        for voyage, geometry in zip(self.voyages, geometries):
+            route = voyage.route
+            feature_group = folium.FeatureGroup(name=route.name, show=True)
+            route_infos.append((route.name, route.color))
+            if geometry is None:
+                continue
+            self.render_voyage(voyage, geometry, feature_group, all_bounds)
             feature_group.add_to(self.map)
         if all_bounds:
             self.map.fit_bounds(all_bounds, padding=(0.1, 0.1))
         # Add custom legend after all routes are processed
         self.add_custom_legend(route_infos)
 
+    def render_routes_incremental(self):
+        """
+        Same output as render_routes, but each voyage's layer is looked up in the layer cache
+        by a hash of its ordered ports, vessel position, route style and path settings.
+        Only voyages without a cached layer have their legs computed and rendered.
+        """
+        settings = (self.path_processor.tolerance, self.path_processor.precision, globe is not None)
+        orderings = self.sort_voyages(self.voyages)
+        keys = [layer_key(voyage, names, coords, settings) for voyage, (names, coords) in zip(self.voyages, orderings)]
+        cached = self.layer_cache.get_many(keys)
+        stale = [i for i, key in enumerate(keys) if key not in cached]
+        geometries = self.compute_route_geometries([self.voyages[i] for i in stale], [orderings[i] for i in stale])
+        fragments = {}
+        for i, geometry in zip(stale, geometries):
+            voyage = self.voyages[i]
+            route = voyage.route
+            if geometry is None:
+                fragments[keys[i]] = {'id': None, 'bounds': [], 'route': [route.name, route.color]}
+                continue
+            # Ids derived from the key keep a re-rendered layer identical to its cached copy
+            with deterministic_element_ids(prefix=keys[i][:16]):
+                feature_group = folium.FeatureGroup(name=route.name, show=True)
+                bounds = []
+                self.render_voyage(voyage, geometry, feature_group, bounds)
+                fragments[keys[i]] = capture_fragment(feature_group, self.map._id, bounds, (route.name, route.color))
+        if fragments:
+            self.layer_cache.put_many(fragments)
+        cached.update(fragments)
+
+        all_bounds = []
+        route_infos = []
+        for key in keys:
+            fragment = cached[key]
+            route_infos.append(tuple(fragment['route']))
+            if fragment['id'] is None:
+                continue
+            CachedVoyageLayer(fragment).add_to(self.map)
+            all_bounds.extend(fragment['bounds'])
+        if all_bounds:
+            self.map.fit_bounds(all_bounds, padding=(0.1, 0.1))
+        self.add_custom_legend(route_infos)
+        self.layer_cache.prune()
+        print(f"[INFO] Voyage layers: {len(keys) - len(stale)} reused, {len(stale)} rebuilt")
+
+    def render_wakes(self):
+        """Each vessel's recent track, read from the downsampled positions, as a dashed line."""
+        wakes = {name: points for name, points in PositionStore().wakes().items() if len(points) > 1}
+        if not wakes:
+            return
+        feature_group = folium.FeatureGroup(name='Vessel wakes', show=True)
+        for name, points in wakes.items():
+            folium.PolyLine(
+                locations=unwrap_track(points),
+                color='#006266',
+                weight=2,
+                opacity=0.8,
+                dash_array='4 4',
+                tooltip=name
+            ).add_to(feature_group)
+        feature_group.add_to(self.map)
+
+    def land_crossing_report(self):
+        """
+        Sea legs with vertices on land, as dicts. All vertices of all legs are classified in one
+        call; each leg's first and last vertex are skipped because ports sit on the coastline.
+        """
+        if not self.voyages:
+            self.load_data()
+        geometries = self.compute_route_geometries(self.voyages, self.sort_voyages(self.voyages))
+        legs = []
+        for voyage, geometry in zip(self.voyages, geometries):
+            for leg in (geometry['legs'] if geometry else []):
+                if not leg['is_inland'] and len(leg['path']) > 2:
+                    legs.append((voyage, leg))
+        vertices = [point for _, leg in legs for point in leg['path'][1:-1]]
+        mask = self.land.classify(vertices)
+        report = []
+        offset = 0
+        for voyage, leg in legs:
+            inner = leg['path'][1:-1]
+            leg_mask = mask[offset:offset + len(inner)]
+            offset += len(inner)
+            runs = land_runs(leg_mask)
+            if runs:
+                report.append({
+                    'voyage_id': voyage.id,
+                    'route': voyage.route.name,
+                    'start': leg['start_name'],
+                    'end': leg['end_name'],
+                    'land_vertices': int(leg_mask.sum()),
+                    'vertices': len(leg['path']),
+                    'first_land_point': inner[runs[0][0]],
+                    'land_runs': len(runs),
+                })
+        return report
+
+    def print_land_crossing_report(self):
+        report = self.land_crossing_report()
+        if not report:
+            print("[INFO] Land check: no sea leg crosses land")
+        for row in report:
+            print(f"[WARN] Route crosses land: voyage {row['voyage_id']} ({row['route']}) {row['start']} -> {row['end']}: "
+                  f"{row['land_vertices']}/{row['vertices']} vertices in {row['land_runs']} run(s), first at {row['first_land_point']}")
+
     def generate(self):
-        self.load_data()
-        self.render_routes()
+        with RENDER_SECONDS.time(stage='load'):
+            self.load_data()
+        with RENDER_SECONDS.time(stage='routes'):
+            self.render_routes()
+        with RENDER_SECONDS.time(stage='wakes'):
+            self.render_wakes()
         folium.LayerControl(collapsed=False).add_to(self.map)
-        self.map.save('index.html')
+        # Folium renders the whole element tree to HTML here
+        with RENDER_SECONDS.time(stage='save'):
+            self.map.save('index.html')
+        stats = self.route_cache.stats()
+        print(f"[INFO] Sea route cache: {stats['memory_hits']} memory hits, {stats['disk_hits']} disk hits, {stats['misses']} computed")
+        print(f"[INFO] Path post-processing: {self.path_processor.summary()}")
+        timings = metrics.summary()
+        if timings:
+            print("[INFO] Timings (this process):")
+            for line in timings:
+                print(f"    {line}")
+
+# Below this many voyages a process pool costs more than it saves
+MIN_PARALLEL_VOYAGES = 16
+INCREMENTAL_MAP_ID = 'vessel_tracking'
+_geometry_worker = None
+
+
+def _init_geometry_worker():
+    global _geometry_worker
+    # Connections inherited through fork must not be used by the child
+    db.discard_connections()
+    _geometry_worker = VesselTrackingDashboard(workers=1)
+
+
+def _compute_voyage_geometry(voyage, ordering=None):
+    """(geometry, route cache lookups it made as (memory_hits, disk_hits, misses))."""
+    cache = _geometry_worker.route_cache
+    before = cache.counts()
+    geometry = _geometry_worker.compute_voyage_geometry(voyage, ordering)
+    return geometry, tuple(after - start for after, start in zip(cache.counts(), before))
+
+
+@contextmanager
+def deterministic_element_ids(prefix=''):
+    """Numbers folium element ids sequentially instead of randomly, so two renders of the same data can be diffed."""
+    counter = itertools.count()
+    original = Element.__dict__['_generate_id']
+    width = 32 - len(prefix)
+    Element._generate_id = classmethod(lambda cls: f'{prefix}{next(counter):0{width}x}')
+    try:
+        yield
+    finally:
+        Element._generate_id = original
+
 
 if __name__ == '__main__':
-    dashboard = VesselTrackingDashboard()
-    dashboard.generate()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Render the vessel tracking map to index.html')
+    parser.add_argument('--workers', type=int, default=None, help='processes for route computation (default: one per CPU, 1 = serial)')
+    parser.add_argument('--deterministic-ids', action='store_true', help='stable element ids so outputs can be diffed')
+    parser.add_argument('--simplify-tolerance', type=float, default=SIMPLIFY_TOLERANCE, help='Douglas-Peucker tolerance in degrees (0 disables)')
+    parser.add_argument('--precision', type=int, default=COORDINATE_PRECISION, help='decimal places kept in path coordinates (-1 keeps full precision)')
+    parser.add_argument('--incremental', action='store_true', help='only re-render voyages that changed since the last --incremental build')
+    parser.add_argument('--land-report', action='store_true', help='also list sea legs whose vertices fall on land')
+    parser.add_argument('--snap-to-port-km', type=float, default=None, help='route vessels within this distance of a port through the port')
+    args = parser.parse_args()
+    logs.configure()
+    with (deterministic_element_ids() if args.deterministic_ids else nullcontext()):
+        dashboard = VesselTrackingDashboard(
+            workers=args.workers,
+            simplify_tolerance=args.simplify_tolerance,
+            coordinate_precision=None if args.precision < 0 else args.precision,
+            incremental=args.incremental,
+            snap_to_port_km=args.snap_to_port_km,
+        )
+        dashboard.generate()
+        if args.land_report:
+            dashboard.print_land_crossing_report()
\ No newline at end of file
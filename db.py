@@ -0,0 +1,139 @@
+"""
+Shared SQLite access.
+Every module gets its connections from here so the database path is configured
+in one place (VESSEL_DB_PATH) and every connection runs with the same tuned pragmas.
+get_connection() keeps one connection per thread and path, so repeated units of
+work on a thread don't pay the connection setup cost. Threads that only live for one
+unit of work (Werkzeug's thread per request) borrow a set of connections from a
+ConnectionPool instead, so connections outlive the threads that use them.
+"""
+import os
+import queue
+import sqlite3
+import threading
+import metrics
+
+DB_PATH = os.environ.get('VESSEL_DB_PATH', 'vessel_tracking.db')
+BUSY_TIMEOUT = float(os.environ.get('VESSEL_DB_BUSY_TIMEOUT', '30'))
+CACHE_SIZE_KB = int(os.environ.get('VESSEL_DB_CACHE_KB', '65536'))
+MMAP_SIZE = int(os.environ.get('VESSEL_DB_MMAP_BYTES', str(256 * 1024 * 1024)))
+# Idle connection sets a ConnectionPool keeps for the next borrower
+POOL_SIZE = int(os.environ.get('VESSEL_DB_POOL_SIZE', '8'))
+
+_local = threading.local()
+
+
+def get_db_path():
+    return DB_PATH
+
+
+def set_db_path(path):
+    """Points every later connection at another database file."""
+    global DB_PATH
+    DB_PATH = path
+
+
+def configure(conn):
+    # WAL lets dashboard readers run while a webhook writer holds the write lock
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute(f'PRAGMA cache_size = {-CACHE_SIZE_KB}')
+    conn.execute(f'PRAGMA mmap_size = {MMAP_SIZE}')
+    conn.execute(f'PRAGMA busy_timeout = {int(BUSY_TIMEOUT * 1000)}')
+    conn.execute('PRAGMA temp_store = MEMORY')
+    return conn
+
+
+def connect(db_path=None, check_same_thread=True):
+    """A new, unpooled connection with the standard pragmas. The caller closes it."""
+    # Statement timings feed the sqlite_statement_seconds metric
+    factory = metrics.InstrumentedConnection if metrics.enabled else sqlite3.Connection
+    return configure(sqlite3.connect(db_path or DB_PATH, timeout=BUSY_TIMEOUT, factory=factory,
+                                     check_same_thread=check_same_thread))
+
+
+def get_connection(db_path=None, pool='default'):
+    """
+    The calling thread's pooled connection for db_path (from the set it borrowed, during a checkout).
+    Don't close it; commit or roll back so the next user starts outside a transaction.
+    Components that commit on their own (geocode cache, inbox) use a separate pool name
+    so they never commit a caller's open transaction.
+    """
+    key = (db_path or DB_PATH, pool)
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get(key)
+    if conn is None:
+        # A ConnectionPool may hand it to another thread later, never to two at once
+        conn = connections[key] = connect(key[0], check_same_thread=False)
+    return conn
+
+
+def close_connections():
+    """Closes the calling thread's pooled connections."""
+    connections = getattr(_local, 'connections', None) or {}
+    for conn in connections.values():
+        conn.close()
+    connections.clear()
+
+
+class ConnectionPool:
+    """
+    Sets of pooled connections (what get_connection keeps per thread) lent to short-lived
+    threads: checkout() makes one the calling thread's set, checkin() takes it back. At most
+    size idle sets are kept; a set returned to a full pool is closed. Borrowers never wait,
+    so a burst of requests opens extra connections instead of queueing behind each other.
+    """
+    def __init__(self, size=POOL_SIZE):
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def checkout(self):
+        try:
+            connections = self._idle.get_nowait()
+        except queue.Empty:
+            connections = {}
+        # The thread's own set, if it has one, comes back at checkin
+        _local.saved = getattr(_local, 'connections', None)
+        _local.connections = connections
+        _local.borrowed = True
+
+    def checkin(self):
+        if not getattr(_local, 'borrowed', False):
+            return
+        connections = _local.connections
+        _local.connections = _local.saved
+        _local.saved = None
+        _local.borrowed = False
+        for conn in connections.values():
+            # Left open by a failed request; the next borrower starts outside a transaction
+            if conn.in_transaction:
+                conn.rollback()
+        try:
+            self._idle.put_nowait(connections)
+        except queue.Full:
+            for conn in connections.values():
+                conn.close()
+
+    def close(self):
+        """Closes the idle connections."""
+        while True:
+            try:
+                connections = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            for conn in connections.values():
+                conn.close()
+
+
+# Connections a forked child inherited: kept referenced so they are never garbage collected,
+# since closing them would close SQLite handles (and WAL files) the parent is still using
+_inherited = []
+
+
+def discard_connections():
+    """In a forked child: forget the parent's pooled connections without closing them."""
+    connections = getattr(_local, 'connections', None)
+    if connections:
+        _inherited.append(connections)
+    _local.connections = {}
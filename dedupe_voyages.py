@@ -0,0 +1,89 @@
+"""
+One-off cleanup of the duplicate voyages that webhook reposts created before voyages were
+keyed by shipment id. Only voyages without a shipment key are considered, and only rows
+whose stored content is identical are grouped: vessel, route, departure and arrival dates,
+status, the legs JSON and every stored leg with its event time. A repost that moved the ETA
+or added a transshipment is left alone rather than guessed at.
+Identical content still does not prove a repost: legacy rows carry no carrier id, and several
+containers on one sailing store the same values. So by default the groups are only printed;
+--apply deletes all but the newest row of each group (with its voyage_legs) once a human has
+checked them. Rows without a departure date are only grouped with --include-undated.
+Usage: python dedupe_voyages.py [--apply] [--include-undated]
+"""
+import argparse
+import db
+from migrations import ensure_schema
+
+DELETE_CHUNK = 500
+
+_DUPLICATE_GROUPS = '''
+    WITH content AS (
+        SELECT v.id, v.vessel_id, v.route_id, v.departure_date, v.arrival_date, v.status, v.legs,
+               (SELECT GROUP_CONCAT(seq || ':' || port_id || ':' || IFNULL(event_time, ''), '|')
+                FROM (SELECT seq, port_id, event_time FROM voyage_legs WHERE voyage_id = v.id ORDER BY seq)) AS leg_events
+        FROM voyages v
+        WHERE v.shipment_key IS NULL {undated}
+    )
+    SELECT keep_id, GROUP_CONCAT(id) FROM (
+        SELECT id,
+               FIRST_VALUE(id) OVER w AS keep_id,
+               ROW_NUMBER() OVER w AS rn
+        FROM content
+        WINDOW w AS (PARTITION BY vessel_id, route_id, departure_date, arrival_date, status, legs, leg_events ORDER BY id DESC)
+    ) WHERE rn > 1
+    GROUP BY keep_id
+    ORDER BY keep_id
+'''
+
+
+def duplicate_groups(cursor, include_undated=False):
+    """[(kept voyage id, [ids of identical older voyages]), ...]"""
+    cursor.execute(_DUPLICATE_GROUPS.format(undated='' if include_undated else 'AND v.departure_date IS NOT NULL'))
+    return [(keep_id, sorted(int(i) for i in ids.split(','))) for keep_id, ids in cursor.fetchall()]
+
+
+def dedupe_voyages(db_path=None, include_undated=False, apply=False):
+    """
+    Finds groups of identical unkeyed voyages and, with apply, deletes all but the newest of each
+    in one transaction. Returns (voyages before, duplicate groups).
+    """
+    ensure_schema(db_path)
+    conn = db.connect(db_path)
+    try:
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute('SELECT COUNT(*) FROM voyages')
+        total = cursor.fetchone()[0]
+        groups = duplicate_groups(cursor, include_undated)
+        if not apply:
+            conn.rollback()
+            return total, groups
+        ids = sorted(i for _, duplicates in groups for i in duplicates)
+        for i in range(0, len(ids), DELETE_CHUNK):
+            chunk = ids[i:i + DELETE_CHUNK]
+            # trg_voyages_delete_legs removes their voyage_legs
+            cursor.execute(f'DELETE FROM voyages WHERE id IN ({",".join("?" * len(chunk))})', chunk)
+        conn.commit()
+        return total, groups
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Find, and with --apply delete, identical voyages left by webhook reposts')
+    parser.add_argument('--apply', action='store_true', help='delete the duplicates instead of only listing them')
+    parser.add_argument('--include-undated', action='store_true',
+                        help='also group identical voyages that have no departure date')
+    args = parser.parse_args()
+    total, groups = dedupe_voyages(include_undated=args.include_undated, apply=args.apply)
+    removed = sum(len(duplicates) for _, duplicates in groups)
+    for keep_id, duplicates in groups:
+        print(f"[INFO] voyage {keep_id} is identical to {', '.join(map(str, duplicates))}")
+    if args.apply:
+        print(f"[INFO] Removed {removed} duplicate voyages in {len(groups)} groups; {total - removed} remain")
+    else:
+        print(f"[INFO] {removed} of {total} voyages in {len(groups)} groups look like duplicates; "
+              f"nothing deleted, check the groups and re-run with --apply")
@@ -0,0 +1,184 @@
+"""
+Fleet-wide ETA estimation on top of the sea distance matrix.
+Every in-transit voyage is handled in one vectorized pass: its legs are padded into a
+(voyages x legs) array of matrix indexes, the leg the vessel is on is the one its
+position deviates least from (great-circle), and the remaining distance is the rest of
+that leg, scaled by the leg's sea/great-circle detour, plus the sea distances of the
+legs after it. The ETA divides that by the vessel's last reported speed. A voyage is
+delayed when its ETA is more than DELAY_TOLERANCE past arrival_date; vessels.status
+follows its voyages. Results are written to voyage_etas.
+Usage: python eta.py [--every SECONDS]
+"""
+import argparse
+import time
+import numpy as np
+import db
+import logs
+from geodesy import haversine_km
+from logs import get_logger, event, INFO
+from positions import PositionError, parse_timestamp
+from sea_distances import SeaDistanceMatrix
+
+KM_PER_NAUTICAL_MILE = 1.852
+# Assumed when a vessel has not reported a speed, or reports being (nearly) stopped
+DEFAULT_SPEED_KNOTS = 16.0
+MIN_SPEED_KNOTS = 3.0
+DELAY_TOLERANCE = 12 * 3600
+log = get_logger('eta')
+
+
+def _arrival_epoch(value):
+    try:
+        return float(parse_timestamp(value)) if value else np.nan
+    except PositionError:
+        return np.nan
+
+
+class EtaEngine:
+    def __init__(self, db_path=None, matrix=None):
+        self.db_path = db_path
+        self.matrix = matrix or SeaDistanceMatrix(db_path).load()
+
+    def load_fleet(self):
+        """In-transit voyages with their vessel position, last reported speed and leg port ids."""
+        conn = db.get_connection(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT v.id, v.vessel_id, v.arrival_date, ve.current_latitude, ve.current_longitude, p.speed
+            FROM voyages v
+            JOIN vessels ve ON v.vessel_id = ve.id
+            -- position_time is the vessel's newest report: one primary key lookup, not a scan of its history
+            LEFT JOIN vessel_positions p ON p.vessel_id = ve.id AND p.ts = ve.position_time
+            WHERE v.status = 'in_transit'
+            ORDER BY v.id
+        ''')
+        voyages = cursor.fetchall()
+        cursor.execute('''
+            SELECT vl.voyage_id, vl.port_id FROM voyage_legs vl
+            JOIN voyages v ON v.id = vl.voyage_id
+            WHERE v.status = 'in_transit'
+            ORDER BY vl.voyage_id, vl.seq
+        ''')
+        legs = {}
+        for voyage_id, port_id in cursor.fetchall():
+            legs.setdefault(voyage_id, []).append(port_id)
+        conn.commit()
+        return voyages, legs
+
+    def estimate(self, now=None):
+        """
+        Returns a dict of parallel arrays: voyage_id, vessel_id, remaining_km, eta (epoch seconds)
+        and delayed. remaining_km and eta are NaN where a voyage lacks a position or routable legs.
+        """
+        now = time.time() if now is None else now
+        self.matrix.sync()
+        voyages, legs = self.load_fleet()
+        count = len(voyages)
+        width = max((len(legs.get(row[0], ())) for row in voyages), default=0)
+        width = max(width, 2)
+        # Matrix index of each voyage's k-th port, -1 past its last port
+        ports = np.full((count, width), -1, dtype=np.int64)
+        for v, row in enumerate(voyages):
+            indexes = self.matrix.indexes(legs.get(row[0], ()))
+            ports[v, :len(indexes)] = indexes
+        position = np.array([(row[3], row[4]) for row in voyages], dtype=float).reshape(count, 2)
+        speed = np.array([row[5] if row[5] is not None else np.nan for row in voyages], dtype=float)
+        arrival = np.array([_arrival_epoch(row[2]) for row in voyages], dtype=float)
+
+        # Leg k runs from ports[:, k] to ports[:, k + 1]
+        start, end = ports[:, :-1], ports[:, 1:]
+        valid = (start >= 0) & (end >= 0)
+        self.matrix.ensure(np.stack([start[valid], end[valid]], axis=1))
+        sea = np.where(valid, self.matrix.distances[np.maximum(start, 0), np.maximum(end, 0)], np.nan)
+        valid &= np.isfinite(sea)
+
+        coords = self.matrix.coords
+        legs_count = start.shape[1]
+        start_xy = coords[np.maximum(start, 0)].reshape(-1, 2)
+        end_xy = coords[np.maximum(end, 0)].reshape(-1, 2)
+        here = np.repeat(position, legs_count, axis=0)
+        to_start = haversine_km(here, start_xy).reshape(count, legs_count)
+        to_end = haversine_km(here, end_xy).reshape(count, legs_count)
+        direct = haversine_km(start_xy, end_xy).reshape(count, legs_count)
+        # The vessel is on the leg whose detour through its position is smallest
+        deviation = np.where(valid, to_start + to_end - direct, np.inf)
+        current = np.argmin(deviation, axis=1)
+        rows = np.arange(count)
+        has_leg = np.isfinite(deviation[rows, current]) & np.isfinite(position).all(axis=1)
+
+        detour = np.where(direct > 0, sea / np.where(direct > 0, direct, 1.0), 1.0)
+        current_part = to_end[rows, current] * np.maximum(detour[rows, current], 1.0)
+        later = np.arange(legs_count)[None, :] > current[:, None]
+        later_part = np.where(later & valid, sea, 0.0).sum(axis=1)
+        remaining = np.where(has_leg, current_part + later_part, np.nan)
+
+        knots = np.where(np.isfinite(speed) & (speed >= MIN_SPEED_KNOTS), speed, DEFAULT_SPEED_KNOTS)
+        eta = now + remaining / (knots * KM_PER_NAUTICAL_MILE) * 3600
+        delayed = np.isfinite(eta) & np.isfinite(arrival) & (eta > arrival + DELAY_TOLERANCE)
+        return {
+            'voyage_id': np.array([row[0] for row in voyages], dtype=np.int64),
+            'vessel_id': np.array([row[1] for row in voyages], dtype=np.int64),
+            'remaining_km': remaining,
+            'eta': eta,
+            'delayed': delayed,
+            'computed_at': now,
+        }
+
+    def store(self, result):
+        """Writes voyage_etas and sets vessels.status from their voyages. Returns the number of vessels whose status changed."""
+        known = np.isfinite(result['eta'])
+        rows = [(int(voyage_id), float(km), int(eta), int(delayed), result['computed_at'])
+                for voyage_id, km, eta, delayed in zip(result['voyage_id'][known], result['remaining_km'][known],
+                                                       result['eta'][known], result['delayed'][known])]
+        # A vessel is delayed if any of its estimated voyages is
+        statuses = {}
+        for vessel_id, delayed in zip(result['vessel_id'][known], result['delayed'][known]):
+            if statuses.get(int(vessel_id)) != 'delayed':
+                statuses[int(vessel_id)] = 'delayed' if delayed else 'on_time'
+        conn = db.get_connection(self.db_path)
+        cursor = conn.cursor()
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.executemany('''INSERT INTO voyage_etas (voyage_id, remaining_km, eta, delayed, computed_at) VALUES (?, ?, ?, ?, ?)
+                                  ON CONFLICT(voyage_id) DO UPDATE SET remaining_km = excluded.remaining_km, eta = excluded.eta,
+                                      delayed = excluded.delayed, computed_at = excluded.computed_at''', rows)
+            # Only changed statuses are written, so an unchanged fleet doesn't bump the data revision
+            cursor.executemany('UPDATE vessels SET status = ? WHERE id = ? AND status IS NOT ?',
+                               [(status, vessel_id, status) for vessel_id, status in statuses.items()])
+            changed = cursor.rowcount
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return changed
+
+    def run(self):
+        """Estimates and stores every in-transit voyage's ETA, saving newly routed matrix cells. Returns the estimate."""
+        started = time.perf_counter()
+        result = self.estimate()
+        estimated_at = time.perf_counter()
+        changed = self.store(result)
+        # Cells computed on demand are kept for the next run
+        if self.matrix.computed:
+            self.matrix.save()
+            self.matrix.computed = 0
+        known = int(np.isfinite(result['eta']).sum())
+        event(log, INFO, 'eta_run', known=known, voyages=len(result['eta']), delayed=int(result['delayed'].sum()),
+              changed=changed, estimate_ms=round((estimated_at - started) * 1000),
+              store_ms=round((time.perf_counter() - estimated_at) * 1000))
+        return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Estimate arrival times and delays for every in-transit voyage')
+    parser.add_argument('--every', type=float, default=None, help='repeat every this many seconds instead of running once')
+    args = parser.parse_args()
+    logs.configure()
+    engine = EtaEngine()
+    while True:
+        result = engine.run()
+        known = int(np.isfinite(result['eta']).sum())
+        print(f"[INFO] ETAs: {known}/{len(result['eta'])} in-transit voyages estimated, {int(result['delayed'].sum())} delayed")
+        if not args.every:
+            break
+        time.sleep(args.every)
@@ -0,0 +1,267 @@
+"""
+Offline port gazetteer.
+Ports come from a bundled UN/LOCODE-style file (data/ports.csv), an alias table
+(data/port_aliases.csv) and a table of the state/province/country qualifiers that follow
+a comma in names like 'Sydney, NS' (data/port_qualifiers.csv). Names are resolved in memory:
+first through a hash index of normalized names, aliases and LOCODEs (an exact hit), then
+through a few spelling variants ('Shenzhen (Yantian)', 'Port of Rotterdam', 'Halifax, NS'),
+then through a trigram index for misspellings. A variant or fuzzy hit whose country
+contradicts the name's qualifier is rejected. Only exact hits are authoritative: locode_for
+ignores the others, so they never merge port rows. Nothing here touches the network.
+VESSEL_GAZETTEER_DIR points at another data directory.
+"""
+import csv
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter
+from dataclasses import dataclass
+
+DATA_DIR = os.environ.get('VESSEL_GAZETTEER_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data'))
+PORTS_FILE = 'ports.csv'
+ALIASES_FILE = 'port_aliases.csv'
+QUALIFIERS_FILE = 'port_qualifiers.csv'
+# Dice coefficient of trigram sets a fuzzy match needs, and its lead over the best other port
+FUZZY_THRESHOLD = 0.6
+FUZZY_MARGIN = 0.1
+# Shorter names have too few trigrams to match fuzzily
+FUZZY_MIN_LENGTH = 4
+MEMO_SIZE = 65536
+
+_NON_ALNUM = re.compile(r'[^0-9a-z]+')
+_PARENTHESES = re.compile(r'\(([^)]*)\)')
+# 'Port Klang' and 'Port Elizabeth' are names; only 'Port of' is a prefix
+_PREFIXES = ('port of ',)
+EXACT, VARIANT, FUZZY = 'exact', 'variant', 'fuzzy'
+
+
+@dataclass(frozen=True)
+class PortEntry:
+    locode: str
+    name: str
+    country: str
+    latitude: float
+    longitude: float
+
+    @property
+    def coordinates(self):
+        return (self.latitude, self.longitude)
+
+
+def gazetteer_key(name):
+    """'Montréal', 'MONTREAL ' and 'Montreal.' all give 'montreal'."""
+    text = unicodedata.normalize('NFKD', str(name)).encode('ascii', 'ignore').decode('ascii').casefold()
+    return _NON_ALNUM.sub(' ', text).strip()
+
+
+def split_qualifiers(name):
+    """'Sydney, NS, Canada' -> ('Sydney', ['ns', 'canada'])."""
+    base, *rest = str(name).split(',')
+    return base, [key for key in map(gazetteer_key, rest) if key]
+
+
+def name_variants(name):
+    """Keys to try for a raw name, most specific first; the first is the exact key."""
+    raw = str(name).casefold()
+    variants = [gazetteer_key(raw)]
+    inside = _PARENTHESES.findall(raw)
+    if inside:
+        # 'Shenzhen (Yantian)': the terminal in parentheses, then the city
+        variants.extend(gazetteer_key(part) for part in inside)
+        variants.append(gazetteer_key(_PARENTHESES.sub(' ', raw)))
+    if ',' in raw:
+        # 'Norfolk, VA', 'Busan, Korea': the qualifier is checked against the port's country
+        variants.append(gazetteer_key(split_qualifiers(raw)[0]))
+    for key in list(variants):
+        for prefix in _PREFIXES:
+            if key.startswith(prefix):
+                variants.append(key[len(prefix):])
+    return [key for i, key in enumerate(variants) if key and key not in variants[:i]]
+
+
+def trigrams(key):
+    padded = f'  {key} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class Gazetteer:
+    def __init__(self, entries=(), aliases=(), qualifiers=()):
+        self.entries = {}
+        # normalized name, alias or LOCODE -> entry
+        self.index = {}
+        # keys claimed by several ports ('sydney') -> all of them, in claim order
+        self.homonyms = {}
+        # normalized qualifier ('ns', 'nova scotia', 'korea') -> country codes it can mean
+        self.qualifiers = {}
+        # trigram -> indexed keys containing it
+        self.trigram_index = {}
+        self._key_sizes = {}
+        self._memo = {}
+        self._lock = threading.Lock()
+        for entry in entries:
+            self.add(entry)
+        for alias, locode in aliases:
+            self.add_alias(alias, locode)
+        for qualifier, country in qualifiers:
+            self.qualifiers.setdefault(gazetteer_key(qualifier), set()).add(country)
+
+    @classmethod
+    def load(cls, data_dir=DATA_DIR):
+        """
+        Reads ports.csv (locode, name, country, latitude, longitude), port_aliases.csv (alias, locode)
+        and port_qualifiers.csv (qualifier, country).
+        """
+        entries = []
+        with open(os.path.join(data_dir, PORTS_FILE), newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                entries.append(PortEntry(row['locode'].strip().upper(), row['name'].strip(), row['country'].strip().upper(),
+                                         float(row['latitude']), float(row['longitude'])))
+        aliases = []
+        aliases_path = os.path.join(data_dir, ALIASES_FILE)
+        if os.path.exists(aliases_path):
+            with open(aliases_path, newline='', encoding='utf-8') as f:
+                aliases = [(row['alias'], row['locode'].strip().upper()) for row in csv.DictReader(f)]
+        qualifiers = []
+        qualifiers_path = os.path.join(data_dir, QUALIFIERS_FILE)
+        if os.path.exists(qualifiers_path):
+            with open(qualifiers_path, newline='', encoding='utf-8') as f:
+                qualifiers = [(row['qualifier'], row['country'].strip().upper()) for row in csv.DictReader(f)]
+        return cls(entries, aliases, qualifiers)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, entry):
+        self.entries[entry.locode] = entry
+        self._index_key(gazetteer_key(entry.name), entry)
+        self._index_key(entry.locode.casefold(), entry)
+
+    def add_alias(self, alias, locode):
+        entry = self.entries.get(locode)
+        if entry is None:
+            raise KeyError(f'Alias {alias!r} refers to unknown LOCODE {locode}')
+        self._index_key(gazetteer_key(alias), entry)
+
+    def _index_key(self, key, entry):
+        # The first port to claim a name keeps it; ports.csv order is the preference
+        if not key:
+            return
+        if key in self.index:
+            claimed = self.homonyms.setdefault(key, [self.index[key]])
+            if entry not in claimed:
+                claimed.append(entry)
+            return
+        self.index[key] = entry
+        self._key_sizes[key] = len(trigrams(key))
+        for gram in trigrams(key):
+            self.trigram_index.setdefault(gram, []).append(key)
+        self._memo.clear()
+
+    def match(self, name):
+        """(PortEntry, EXACT | VARIANT | FUZZY) for a name, or (None, None) if nothing fits."""
+        if not name:
+            return None, None
+        result = self._memo.get(name)
+        if result is None:
+            result = self._resolve(name)
+            with self._lock:
+                if len(self._memo) >= MEMO_SIZE:
+                    self._memo.clear()
+                self._memo[name] = result
+        return result
+
+    def lookup(self, name):
+        """The PortEntry for a name, exact first, then variants, then fuzzy; None if nothing is close enough."""
+        return self.match(name)[0]
+
+    def exact(self, name):
+        """The PortEntry whose name, alias or LOCODE is exactly this name, or None."""
+        entry, kind = self.match(name)
+        return entry if kind == EXACT else None
+
+    def coordinates(self, name):
+        entry = self.lookup(name)
+        return entry.coordinates if entry else None
+
+    def countries_of(self, qualifiers):
+        """Country codes every known qualifier allows, or None when no qualifier is known."""
+        allowed = None
+        for qualifier in qualifiers:
+            countries = set(self.qualifiers.get(qualifier, ()))
+            if len(qualifier) == 2 and any(e.country == qualifier.upper() for e in self.entries.values()):
+                countries.add(qualifier.upper())
+            if countries:
+                allowed = countries if allowed is None else allowed & countries
+        return allowed
+
+    def _resolve(self, name):
+        variants = name_variants(name)
+        entry = self.index.get(variants[0])
+        if entry is not None:
+            return entry, EXACT
+        allowed = self.countries_of(split_qualifiers(name)[1])
+        for key in variants[1:]:
+            # 'Sydney, NS' is the Canadian Sydney even though the Australian one claimed the name first
+            for entry in self.homonyms.get(key) or [self.index.get(key)]:
+                if entry is not None and (allowed is None or entry.country in allowed):
+                    return entry, VARIANT
+        for key in variants:
+            entry = self.fuzzy(key, allowed)
+            if entry is not None:
+                return entry, FUZZY
+        return None, None
+
+    def fuzzy(self, key, countries=None):
+        """
+        Closest indexed name by trigram Dice coefficient, if it is close enough, has as many words
+        and is clearly ahead of other ports; countries optionally limits the candidates.
+        """
+        # 'Rotterdam 2' is a different place than Rotterdam, not a misspelling of it
+        if len(key) < FUZZY_MIN_LENGTH or any(c.isdigit() for c in key):
+            return None
+        words = len(key.split())
+        grams = trigrams(key)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.trigram_index.get(gram, ()))
+        best = {}
+        for candidate, count in shared.items():
+            # 'Port Elizabeth' is not a misspelling of 'Elizabeth', nor "St John's" of 'St John'
+            if len(candidate.split()) != words:
+                continue
+            score = 2 * count / (len(grams) + self._key_sizes[candidate])
+            entry = self.index[candidate]
+            if countries is not None and entry.country not in countries:
+                continue
+            if score > best.get(entry.locode, (0, None))[0]:
+                best[entry.locode] = (score, entry)
+        ranked = sorted(best.values(), key=lambda item: item[0], reverse=True)
+        if not ranked or ranked[0][0] < FUZZY_THRESHOLD:
+            return None
+        if len(ranked) > 1 and ranked[0][0] - ranked[1][0] < FUZZY_MARGIN:
+            return None
+        return ranked[0][1]
+
+
+_shared_gazetteer = None
+_shared_lock = threading.Lock()
+
+
+def get_gazetteer():
+    """Process-wide gazetteer loaded from DATA_DIR; an empty one if the data files are missing."""
+    global _shared_gazetteer
+    if _shared_gazetteer is None:
+        with _shared_lock:
+            if _shared_gazetteer is None:
+                try:
+                    _shared_gazetteer = Gazetteer.load()
+                except FileNotFoundError:
+                    _shared_gazetteer = Gazetteer()
+    return _shared_gazetteer
+
+
+def locode_for(name):
+    """LOCODE of the port a name, alias or LOCODE exactly matches, or None; variant and fuzzy hits don't count."""
+    entry = get_gazetteer().exact(name)
+    return entry.locode if entry else None
@@ -0,0 +1,267 @@
+"""
+Shared geocoding layer used by the server, the dashboard and route inference.
+Names the offline gazetteer knows exactly are answered by it. Other names go through an
+in-process LRU, then a persistent SQLite cache table that remembers both hits and misses;
+a variant or fuzzy gazetteer hit only answers names with no cached coordinates, and the
+rest go out to Nominatim. Network requests share a process-wide token bucket, and
+concurrent lookups of the same name wait for a single request instead of each making one.
+"""
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from geopy.geocoders import Nominatim
+import db
+import metrics
+from gazetteer import EXACT, get_gazetteer
+from logs import get_logger, event, WARNING
+
+USER_AGENT = "vessel_tracking_app_v1"
+LRU_SIZE = 4096
+HIT_TTL = 90 * 24 * 3600
+MISS_TTL = 24 * 3600
+# Nominatim's usage policy allows at most one request per second
+MIN_REQUEST_INTERVAL = 1.0
+
+_NOT_CACHED = object()
+# Default for Geocoder(limiter=...): the shared Nominatim limiter, so an explicit None can mean no limit
+_SHARED_LIMITER = object()
+log = get_logger('geocoding')
+LOOKUPS = metrics.counter('geocode_lookups_total', 'Geocode lookups by where the answer came from', ('source',))
+REQUEST_SECONDS = metrics.timer('geocode_request_seconds', 'Nominatim requests, including the rate-limit wait', ('outcome',))
+
+
+def normalize_place_name(name):
+    """'Halifax', 'halifax ' and 'HALIFAX' all map to the same cache key."""
+    if name is None:
+        return ''
+    return ' '.join(str(name).split()).casefold()
+
+
+class TokenBucket:
+    """
+    Blocking rate limiter: rate tokens per second, at most capacity saved up.
+    acquire() reserves the next slot under the lock and sleeps outside it, so
+    concurrent callers are spaced out instead of serialized behind one sleeper.
+    """
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Takes one token, sleeping until it is available. Returns the seconds waited."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+# Shared by every Geocoder in the process, since the limit is per client, not per instance
+nominatim_limiter = TokenBucket(1 / MIN_REQUEST_INTERVAL)
+
+
+class _InFlight:
+    __slots__ = ('done', 'coords')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.coords = None
+
+
+def create_cache_table(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS geocode_cache (
+            key TEXT PRIMARY KEY,
+            latitude REAL,
+            longitude REAL,
+            found INTEGER NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    ''')
+
+
+class Geocoder:
+    def __init__(self, db_path=None, user_agent=USER_AGENT, lru_size=LRU_SIZE,
+                 hit_ttl=HIT_TTL, miss_ttl=MISS_TTL, limiter=_SHARED_LIMITER, use_gazetteer=True):
+        self.db_path = db_path
+        self.gazetteer = get_gazetteer() if use_gazetteer else None
+        self.lru_size = lru_size
+        self.hit_ttl = hit_ttl
+        self.miss_ttl = miss_ttl
+        # None disables rate limiting (tests and offline fakes)
+        self.limiter = nominatim_limiter if limiter is _SHARED_LIMITER else limiter
+        self.geolocator = Nominatim(user_agent=user_agent, timeout=10)
+        self._lru = OrderedDict()
+        self._lru_lock = threading.Lock()
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        self._table_ready = False
+
+    def geocode(self, place):
+        """
+        Returns (latitude, longitude) for a place name, or None if it cannot be found.
+        Misses are cached too, so an unknown port only costs one network lookup per miss_ttl.
+        """
+        key = normalize_place_name(place)
+        if not key:
+            return None
+        entry, kind = self.gazetteer.match(place) if self.gazetteer is not None else (None, None)
+        if kind == EXACT:
+            LOOKUPS.inc(source='gazetteer')
+            return entry.coordinates
+        cached, source = self._lru_get(key), 'memory'
+        if cached is _NOT_CACHED:
+            stored = self._db_get(key)
+            if stored is not _NOT_CACHED:
+                self._lru_put(key, stored[0], stored[1])
+                cached, source = stored[0], 'disk'
+        # A stored answer beats a variant or fuzzy gazetteer guess; a stored miss doesn't
+        if cached is not _NOT_CACHED and cached is not None:
+            LOOKUPS.inc(source=source)
+            return cached
+        if entry is not None:
+            LOOKUPS.inc(source='gazetteer')
+            return entry.coordinates
+        if cached is not _NOT_CACHED:
+            LOOKUPS.inc(source=source)
+            return cached
+        with self._inflight_lock:
+            pending = self._inflight.get(key)
+            owner = pending is None
+            if owner:
+                pending = self._inflight[key] = _InFlight()
+        if not owner:
+            LOOKUPS.inc(source='coalesced')
+            pending.done.wait()
+            return pending.coords
+        try:
+            pending.coords = self._fetch(place, key)
+            return pending.coords
+        finally:
+            with self._inflight_lock:
+                del self._inflight[key]
+            pending.done.set()
+
+    def is_known(self, place):
+        """
+        True when geocode(place) answers from the gazetteer or a cached hit or miss. A None from
+        geocode() for a place that isn't known came from a failed request, which is worth retrying.
+        """
+        key = normalize_place_name(place)
+        if not key:
+            return True
+        if self.gazetteer is not None and self.gazetteer.match(place)[0] is not None:
+            return True
+        return self._lru_get(key) is not _NOT_CACHED or self._db_get(key) is not _NOT_CACHED
+
+    def _fetch(self, place, key):
+        # A request that finished between our cache check and registering as in flight already stored its answer
+        cached = self._lru_get(key)
+        if cached is not _NOT_CACHED:
+            return cached
+        LOOKUPS.inc(source='network')
+        started = time.perf_counter()
+        try:
+            coords = self._lookup(key)
+        except Exception as e:
+            REQUEST_SECONDS.observe(time.perf_counter() - started, outcome='error')
+            # Transient failures (timeouts, rate limiting) are not cached
+            event(log, WARNING, 'geocode_failed', place=place, error=e)
+            return None
+        REQUEST_SECONDS.observe(time.perf_counter() - started, outcome='found' if coords else 'not_found')
+        expires_at = time.time() + (self.hit_ttl if coords else self.miss_ttl)
+        self._lru_put(key, coords, expires_at)
+        self._db_put(key, coords, expires_at)
+        return coords
+
+    def clear(self):
+        with self._lru_lock:
+            self._lru.clear()
+
+    def _lookup(self, key):
+        if self.limiter is not None:
+            self.limiter.acquire()
+        location = self.geolocator.geocode(key)
+        if location:
+            return (location.latitude, location.longitude)
+        return None
+
+    def _lru_get(self, key):
+        with self._lru_lock:
+            entry = self._lru.get(key)
+            if entry is None:
+                return _NOT_CACHED
+            coords, expires_at = entry
+            if expires_at <= time.time():
+                del self._lru[key]
+                return _NOT_CACHED
+            self._lru.move_to_end(key)
+            return coords
+
+    def _lru_put(self, key, coords, expires_at):
+        with self._lru_lock:
+            self._lru[key] = (coords, expires_at)
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.lru_size:
+                self._lru.popitem(last=False)
+
+    def _connect(self):
+        conn = db.get_connection(self.db_path, pool='geocoding')
+        if not self._table_ready:
+            create_cache_table(conn.cursor())
+            conn.commit()
+            self._table_ready = True
+        return conn
+
+    def _db_get(self, key):
+        row = self._connect().execute(
+            'SELECT latitude, longitude, found, expires_at FROM geocode_cache WHERE key = ?', (key,)
+        ).fetchone()
+        if not row or row[3] <= time.time():
+            return _NOT_CACHED
+        coords = (row[0], row[1]) if row[2] else None
+        return coords, row[3]
+
+    def _db_put(self, key, coords, expires_at):
+        lat, lon = coords if coords else (None, None)
+        conn = self._connect()
+        try:
+            conn.execute(
+                'INSERT OR REPLACE INTO geocode_cache (key, latitude, longitude, found, expires_at) VALUES (?, ?, ?, ?, ?)',
+                (key, lat, lon, 1 if coords else 0, expires_at)
+            )
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            event(log, WARNING, 'geocode_cache_write_failed', key=key, error=e)
+
+
+_shared_geocoder = None
+_shared_lock = threading.Lock()
+
+
+def get_geocoder():
+    """Process-wide geocoder, so every caller shares one LRU and one rate limit."""
+    global _shared_geocoder
+    if _shared_geocoder is None:
+        with _shared_lock:
+            if _shared_geocoder is None:
+                _shared_geocoder = Geocoder()
+    return _shared_geocoder
+
+
+def geocode(place):
+    return get_geocoder().geocode(place)
+
+
+def geocode_failed(place):
+    """True when the last geocode(place) returned None because the lookup failed, not because the place is unknown."""
+    return not get_geocoder().is_known(place)
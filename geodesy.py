@@ -0,0 +1,105 @@
+"""
+Vectorized great-circle distances with NumPy.
+Coordinates are [lat, lon] in degrees, like everywhere else in the project.
+Distances are haversine kilometres on a spherical earth, computed for whole
+matrices at once instead of point by point.
+"""
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0
+# Upper bound on distance-matrix cells evaluated at once when ordering voyages in batch
+MAX_BATCH_CELLS = 4_000_000
+
+
+def _as_radians(coords):
+    """Sequence of [lat, lon] -> (n, 2) float array in radians."""
+    array = np.asarray(coords, dtype=float).reshape(-1, 2)
+    return np.radians(array)
+
+
+def haversine_matrix(a, b=None):
+    """(len(a), len(b)) matrix of distances in km; b defaults to a."""
+    a = _as_radians(a)
+    b = a if b is None else _as_radians(b)
+    lat1 = a[:, 0][:, None]
+    lat2 = b[:, 0][None, :]
+    dphi = lat2 - lat1
+    dlambda = b[:, 1][None, :] - a[:, 1][:, None]
+    h = np.sin(dphi / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlambda / 2) ** 2
+    return _central_distance(h)
+
+
+def _central_distance(h):
+    # Rounding can push h just past 1 for antipodal points
+    h = np.clip(h, 0.0, 1.0)
+    return EARTH_RADIUS_KM * 2 * np.arctan2(np.sqrt(h), np.sqrt(1 - h))
+
+
+def haversine_km(a, b):
+    """Element-wise distances between two equally long sequences of points."""
+    a = _as_radians(a)
+    b = _as_radians(b)
+    dphi = b[:, 0] - a[:, 0]
+    dlambda = b[:, 1] - a[:, 1]
+    h = np.sin(dphi / 2) ** 2 + np.cos(a[:, 0]) * np.cos(b[:, 0]) * np.sin(dlambda / 2) ** 2
+    return _central_distance(h)
+
+
+def nearest_neighbor_order(start, points):
+    """
+    Greedy nearest-neighbour tour through points starting from start. Returns the
+    indices of points in visiting order; ties go to the lower index.
+    """
+    return nearest_neighbor_orders([start], [points])[0]
+
+
+def nearest_neighbor_orders(starts, point_sets):
+    """
+    nearest_neighbor_order for many voyages at once. Voyages of similar size are padded
+    to a common length and stepped in lockstep, so each step is one argmin for the group.
+    """
+    orders = [[] for _ in starts]
+    by_size = sorted((i for i in range(len(starts)) if len(point_sets[i])), key=lambda i: len(point_sets[i]))
+    group = []
+    for i in by_size:
+        width = len(point_sets[i]) + 1
+        if group and (len(group) + 1) * width * width > MAX_BATCH_CELLS:
+            _order_group(group, starts, point_sets, orders)
+            group = []
+        group.append(i)
+    if group:
+        _order_group(group, starts, point_sets, orders)
+    return orders
+
+
+def _order_group(group, starts, point_sets, orders):
+    count = len(group)
+    lengths = np.array([len(point_sets[i]) for i in group])
+    width = int(lengths.max())
+    # Slot 0 holds the start, slots 1..width the (padded) points
+    coords = np.full((count, width + 1, 2), np.nan)
+    for row, i in enumerate(group):
+        coords[row, 0] = starts[i]
+        coords[row, 1:lengths[row] + 1] = point_sets[i]
+    rad = np.radians(coords)
+    lat = rad[:, :, 0]
+    lon = rad[:, :, 1]
+    dphi = lat[:, None, :] - lat[:, :, None]
+    dlambda = lon[:, None, :] - lon[:, :, None]
+    cos_lat = np.cos(lat)
+    distances = _central_distance(np.sin(dphi / 2) ** 2 + cos_lat[:, :, None] * cos_lat[:, None, :] * np.sin(dlambda / 2) ** 2)
+    # Padding and the start are never candidates
+    available = ~np.isnan(coords[:, :, 0])
+    available[:, 0] = False
+    rows = np.arange(count)
+    current = np.zeros(count, dtype=int)
+    visits = np.zeros((count, width), dtype=int)
+    for step in range(width):
+        candidates = np.where(available, distances[rows, current], np.inf)
+        chosen = np.argmin(candidates, axis=1)
+        active = step < lengths
+        visits[:, step] = chosen - 1
+        available[rows[active], chosen[active]] = False
+        current = np.where(active, chosen, current)
+    for row, i in enumerate(group):
+        orders[i] = visits[row, :lengths[row]].tolist()
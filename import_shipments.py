@@ -0,0 +1,328 @@
+"""
+Bulk importer for in-transit shipment lists (CSV rows of container, vessel, then the
+ports of the voyage in order, like in-transit-shipments.csv).
+The file is read twice as a stream. The first pass collects the distinct port names and
+resolves each once, through the ports table or the geocoder. The second pass inserts
+vessels, routes, voyages and voyage_legs in chunked transactions. A voyage is keyed by its
+container ('/<container>', see payload_parser.shipment_key), and a voyage a webhook stored for
+the same container is matched too (payload_parser.stored_shipments), so importing a file again
+updates changed voyages and skips unchanged ones instead of adding them twice; each chunk also records
+how far into the file it got, so an interrupted import resumes after the last committed
+chunk. Memory holds one chunk of rows plus one id per distinct port, vessel and route.
+Usage: python import_shipments.py FILE [--chunk-size 5000] [--restart]
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import random
+import sys
+import time
+import db
+import logs
+from gazetteer import locode_for
+from geocoding import geocode, normalize_place_name
+from logs import get_logger, event, INFO, WARNING
+from migrations import ensure_schema
+from payload_parser import ShipmentRecord, content_hash, shipment_key, stored_shipments
+
+CHUNK_SIZE = 5000
+log = get_logger('import_shipments')
+# Bytes hashed to recognise the file a checkpoint belongs to
+FINGERPRINT_BYTES = 64 * 1024
+
+
+_UNSEEN = object()
+
+
+class CheckpointError(Exception):
+    pass
+
+
+def file_fingerprint(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read(FINGERPRINT_BYTES)).hexdigest()
+
+
+def iter_rows(path, offset=0):
+    """
+    Yields (row, end_offset) for the rows of a CSV file starting at byte offset.
+    Blank rows are skipped; end_offset is where the next row starts, for checkpoints.
+    """
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        position = offset
+
+        def lines():
+            # csv.reader pulls one line at a time, so after each row position is exactly where it ended
+            nonlocal position
+            for line in f:
+                # Spreadsheet exports often start with a byte order mark
+                text = line.decode('utf-8-sig' if position == 0 else 'utf-8')
+                position += len(line)
+                yield text
+
+        for row in csv.reader(lines(), skipinitialspace=True):
+            fields = [field.strip() for field in row]
+            if any(fields):
+                yield fields, position
+
+
+def parse_row(fields):
+    """(container, vessel, ports) of one row, or raises ValueError."""
+    ports = [name for name in fields[2:] if name]
+    if len(fields) < 2 or not fields[1]:
+        raise ValueError('missing vessel')
+    if len(ports) < 2:
+        raise ValueError('a voyage needs at least an origin and a destination port')
+    return fields[0] or None, fields[1], ports
+
+
+class ShipmentImporter:
+    def __init__(self, path, db_path=None, chunk_size=CHUNK_SIZE):
+        self.path = path
+        self.source = os.path.abspath(path)
+        self.db_path = db_path
+        self.chunk_size = chunk_size
+        self.ports = {}
+        self.vessels = {}
+        self.routes = {}
+        self._coords = {}
+        self._port_ids = {}
+        self.stats = {'rows': 0, 'voyages': 0, 'updated': 0, 'unchanged': 0, 'skipped': 0, 'ports_known': 0,
+                      'ports_geocoded': 0, 'ports_missing': 0, 'seconds': 0.0}
+
+    def _connection(self):
+        ensure_schema(self.db_path)
+        return db.get_connection(self.db_path, pool='import')
+
+    def checkpoint(self):
+        """(byte offset, rows done) to resume from; (0, 0) for a new import."""
+        row = self._connection().execute('SELECT fingerprint, byte_offset, rows_done FROM import_checkpoints WHERE source = ?',
+                                         (self.source,)).fetchone()
+        if row is None:
+            return 0, 0
+        if row[0] != file_fingerprint(self.path):
+            raise CheckpointError(f'{self.path} changed since the last import; run again with --restart')
+        return row[1], row[2]
+
+    def reset_checkpoint(self):
+        conn = self._connection()
+        conn.execute('DELETE FROM import_checkpoints WHERE source = ?', (self.source,))
+        conn.commit()
+
+    def resolve_ports(self, offset):
+        """First pass: every distinct port name from offset on, looked up or geocoded once."""
+        names = {}
+        for fields, _ in iter_rows(self.path, offset):
+            for name in fields[2:]:
+                if name:
+                    names.setdefault(normalize_place_name(name), name)
+        conn = self._connection()
+        keys = list(names)
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            rows = conn.execute(f'SELECT name_key, id FROM ports WHERE name_key IN ({",".join("?" * len(chunk))})',
+                                chunk).fetchall()
+            self.ports.update(rows)
+        conn.commit()
+        self.stats['ports_known'] = len(self.ports)
+        # Geocode outside any transaction, so the write lock is never held over the network
+        found = []
+        for key in names.keys() - self.ports.keys():
+            coords = geocode(names[key])
+            if coords:
+                found.append((names[key], key, coords[0], coords[1]))
+            else:
+                event(log, WARNING, 'import_port_not_found', port=names[key])
+                self.stats['ports_missing'] += 1
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            for name, key, lat, lon in found:
+                # An alias of a gazetteer port resolves to the row that already holds its LOCODE
+                cursor.execute('''INSERT INTO ports (name, name_key, locode, latitude, longitude) VALUES (?, ?, ?, ?, ?)
+                                  ON CONFLICT(name_key) DO UPDATE SET name_key = excluded.name_key
+                                  ON CONFLICT(locode) WHERE locode IS NOT NULL DO UPDATE SET locode = excluded.locode
+                                  RETURNING id''', (name, key, locode_for(name), lat, lon))
+                self.ports[key] = cursor.fetchone()[0]
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        self.stats['ports_geocoded'] = len(found)
+
+    def port_id(self, name):
+        """Id of a port resolved by resolve_ports, memoized by spelling; None if it was not found."""
+        port_id = self._port_ids.get(name, _UNSEEN)
+        if port_id is _UNSEEN:
+            port_id = self._port_ids[name] = self.ports.get(normalize_place_name(name))
+        return port_id
+
+    def _port_coordinates(self, cursor, port_ids):
+        missing = [port_id for port_id in port_ids if port_id not in self._coords]
+        for i in range(0, len(missing), 500):
+            chunk = missing[i:i + 500]
+            cursor.execute(f'SELECT id, latitude, longitude FROM ports WHERE id IN ({",".join("?" * len(chunk))})', chunk)
+            self._coords.update((row[0], (row[1], row[2])) for row in cursor.fetchall())
+
+    def _route_id(self, cursor, origin_id, destination_id, origin_name, destination_name):
+        """Get-or-create of a route, the same way the webhook creates them (see server.get_or_create_route)."""
+        cursor.execute('''INSERT INTO service_lines (name, name_key, region_from, region_to) VALUES (?, ?, ?, ?)
+                          ON CONFLICT(name_key) DO UPDATE SET name_key = excluded.name_key
+                          RETURNING id''',
+                       ('Unassigned', normalize_place_name('Unassigned'), 'Unknown', 'Unknown'))
+        service_line_id = cursor.fetchone()[0]
+        cursor.execute('''INSERT INTO routes (service_line_id, name, color, origin_port_id, destination_port_id)
+                          VALUES (?, ?, ?, ?, ?)
+                          ON CONFLICT(origin_port_id, destination_port_id) DO UPDATE SET origin_port_id = excluded.origin_port_id
+                          RETURNING id''',
+                       (service_line_id, f'{origin_name}-{destination_name} Route', f'#{random.randint(0, 0xFFFFFF):06x}',
+                        origin_id, destination_id))
+        return cursor.fetchone()[0]
+
+    def store_chunk(self, rows, end_offset, rows_done):
+        """
+        Stores one chunk of parsed rows and the new checkpoint in a single transaction. Rows with a
+        container already stored are updated in place, or skipped when their content hash matches.
+        """
+        conn = self._connection()
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            self._port_coordinates(cursor, {port_ids[0] for _, _, _, port_ids in rows})
+            # Hashed as the webhook would hash a payload with the same container, vessel and ports
+            records = [ShipmentRecord(shipment_id=None, origin=port_names[0], discharge=port_names[-1],
+                                      destination=port_names[-1], legs=port_names, vessel_name=vessel_name,
+                                      container_id=container)
+                       for container, vessel_name, port_names, _ in rows]
+            keys = [shipment_key(record) for record in records]
+            # Every row's key is '/<container>', so a key stands for its container; a webhook voyage of it counts too
+            stored = {keys[i]: match for i, match in stored_shipments(cursor, records).items()}
+            voyages = []
+            legs = []
+            updates = {}
+            # Containers met earlier in this chunk -> their index in voyages; a later row replaces the earlier one
+            added = {}
+            for (container, vessel_name, port_names, port_ids), record, key in zip(rows, records, keys):
+                payload_hash = content_hash(record)
+                if key in stored and stored[key][1] == payload_hash and key not in added:
+                    self.stats['unchanged'] += 1
+                    continue
+                origin_id, destination_id = port_ids[0], port_ids[-1]
+                # Keyed by the name as written; spellings of one vessel still meet on name_key in the table
+                vessel_id = self.vessels.get(vessel_name)
+                if vessel_id is None:
+                    # Like the webhook, a new vessel starts at its origin port
+                    lat, lon = self._coords[origin_id]
+                    cursor.execute('''INSERT INTO vessels (name, name_key, current_latitude, current_longitude) VALUES (?, ?, ?, ?)
+                                      ON CONFLICT(name_key) DO UPDATE SET name_key = excluded.name_key
+                                      RETURNING id''', (vessel_name, normalize_place_name(vessel_name), lat, lon))
+                    vessel_id = self.vessels[vessel_name] = cursor.fetchone()[0]
+                route_id = self.routes.get((origin_id, destination_id))
+                if route_id is None:
+                    route_id = self.routes[(origin_id, destination_id)] = self._route_id(
+                        cursor, origin_id, destination_id, port_names[0], port_names[-1])
+                voyage = (route_id, vessel_id, json.dumps(port_names), key, payload_hash)
+                if key in added:
+                    voyages[added[key]], legs[added[key]] = voyage, port_ids
+                elif key in stored:
+                    voyage_id = stored[key][0]
+                    updates[voyage_id] = (voyage, port_ids)
+                    stored[key] = (voyage_id, payload_hash)
+                else:
+                    if key is not None:
+                        added[key] = len(voyages)
+                    voyages.append(voyage)
+                    legs.append(port_ids)
+            # The write lock is held, so the next ids are known and both tables can be filled with executemany
+            cursor.execute('''SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'voyages'), 0),
+                                         COALESCE((SELECT MAX(id) FROM voyages), 0))''')
+            first_id = cursor.fetchone()[0] + 1
+            cursor.executemany('''INSERT INTO voyages (id, route_id, vessel_id, status, legs, shipment_key, container_id, payload_hash)
+                                  VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                               [(first_id + i, route_id, vessel_id, 'in_transit', port_json, key, key and key[1:], payload_hash)
+                                for i, (route_id, vessel_id, port_json, key, payload_hash) in enumerate(voyages)])
+            cursor.executemany('UPDATE voyages SET route_id = ?, vessel_id = ?, legs = ?, payload_hash = ? WHERE id = ?',
+                               [(route_id, vessel_id, port_json, payload_hash, voyage_id)
+                                for voyage_id, ((route_id, vessel_id, port_json, _, payload_hash), _) in updates.items()])
+            cursor.executemany('DELETE FROM voyage_legs WHERE voyage_id = ?', [(voyage_id,) for voyage_id in updates])
+            leg_rows = [(first_id + i, port_ids) for i, port_ids in enumerate(legs)]
+            leg_rows += [(voyage_id, port_ids) for voyage_id, (_, port_ids) in updates.items()]
+            cursor.executemany('INSERT INTO voyage_legs (voyage_id, seq, port_id) VALUES (?, ?, ?)',
+                               [(voyage_id, seq, port_id) for voyage_id, port_ids in leg_rows
+                                for seq, port_id in enumerate(port_ids) if port_id])
+            cursor.execute('''INSERT INTO import_checkpoints (source, fingerprint, byte_offset, rows_done, updated_at)
+                              VALUES (?, ?, ?, ?, ?)
+                              ON CONFLICT(source) DO UPDATE SET fingerprint = excluded.fingerprint,
+                                  byte_offset = excluded.byte_offset, rows_done = excluded.rows_done,
+                                  updated_at = excluded.updated_at''',
+                           (self.source, self.fingerprint, end_offset, rows_done, time.time()))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            # Ids handed out inside the rolled-back transaction no longer exist
+            self.vessels.clear()
+            self.routes.clear()
+            raise
+        self.stats['voyages'] += len(voyages)
+        self.stats['updated'] += len(updates)
+
+    def run(self):
+        self.fingerprint = file_fingerprint(self.path)
+        offset, rows_done = self.checkpoint()
+        if offset:
+            event(log, INFO, 'import_resumed', path=self.path, row=rows_done, byte_offset=offset)
+        started = time.perf_counter()
+        self.resolve_ports(offset)
+        event(log, INFO, 'import_ports_resolved', known=self.stats['ports_known'], geocoded=self.stats['ports_geocoded'],
+              missing=self.stats['ports_missing'], seconds=round(time.perf_counter() - started, 1))
+        started = time.perf_counter()
+        chunk = []
+        end_offset = offset
+        for fields, end_offset in iter_rows(self.path, offset):
+            rows_done += 1
+            self.stats['rows'] += 1
+            try:
+                container, vessel_name, port_names = parse_row(fields)
+            except ValueError as e:
+                event(log, WARNING, 'import_row_skipped', row=rows_done, error=e)
+                self.stats['skipped'] += 1
+                continue
+            port_ids = [self.port_id(name) for name in port_names]
+            if port_ids[0] is None or port_ids[-1] is None:
+                event(log, WARNING, 'import_row_skipped', row=rows_done, error='origin or destination could not be geocoded')
+                self.stats['skipped'] += 1
+                continue
+            chunk.append((container, vessel_name, port_names, port_ids))
+            if len(chunk) >= self.chunk_size:
+                self.store_chunk(chunk, end_offset, rows_done)
+                chunk = []
+                elapsed = time.perf_counter() - started
+                event(log, INFO, 'import_progress', row=rows_done, voyages=self.stats['voyages'],
+                      rows_per_second=round(self.stats['rows'] / elapsed))
+        # The last chunk also moves the checkpoint past trailing skipped rows
+        self.store_chunk(chunk, end_offset, rows_done)
+        self.stats['seconds'] = time.perf_counter() - started
+        return self.stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Import an in-transit shipment CSV (container, vessel, ports...)')
+    parser.add_argument('path')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='rows per transaction')
+    parser.add_argument('--restart', action='store_true', help='ignore the checkpoint and import the whole file again')
+    args = parser.parse_args()
+    importer = ShipmentImporter(args.path, chunk_size=args.chunk_size)
+    if args.restart:
+        importer.reset_checkpoint()
+    logs.configure()
+    try:
+        stats = importer.run()
+    except CheckpointError as e:
+        print(f"[ERROR] {e}")
+        sys.exit(1)
+    print(f"[INFO] Imported {stats['voyages']} voyages from {stats['rows']} rows "
+          f"({stats['updated']} updated, {stats['unchanged']} unchanged, {stats['skipped']} skipped) "
+          f"in {stats['seconds']:.1f} s, {stats['rows'] / max(stats['seconds'], 1e-9):,.0f} rows/s")
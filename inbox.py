@@ -0,0 +1,214 @@
+"""
+Durable webhook inbox.
+The webhook endpoint only validates and enqueues payloads; a pool of worker
+threads drains the inbox, does the geocoding and DB writes, and retries failed
+jobs with exponential backoff.
+"""
+import sqlite3
+import json
+import threading
+import time
+import uuid
+import db
+from logs import get_logger, event, WARNING
+
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 2.0
+BACKOFF_MAX = 300.0
+POLL_INTERVAL = 1.0
+# A job 'processing' for longer than this is taken to belong to a worker that died
+LEASE_TIMEOUT = 600.0
+log = get_logger('inbox')
+
+
+def create_inbox_table(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS webhook_inbox (
+            id TEXT PRIMARY KEY,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            last_error TEXT,
+            result TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_webhook_inbox_pending ON webhook_inbox(status, next_attempt_at)')
+
+
+class ShipmentInbox:
+    def __init__(self, db_path=None, max_attempts=MAX_ATTEMPTS,
+                 backoff_base=BACKOFF_BASE, backoff_max=BACKOFF_MAX):
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        conn = self._connect()
+        create_inbox_table(conn.cursor())
+        conn.commit()
+
+    def _connect(self):
+        return db.get_connection(self.db_path, pool='inbox')
+
+    def enqueue(self, payload):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute(
+                'INSERT INTO webhook_inbox (id, payload, status, next_attempt_at, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (job_id, json.dumps(payload), 'queued', now, now, now)
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return job_id
+
+    def claim(self):
+        """Atomically moves the oldest due job to 'processing'. Returns (job_id, payload, attempts) or None."""
+        now = time.time()
+        conn = self._connect()
+        try:
+            row = conn.execute('''
+                UPDATE webhook_inbox
+                SET status = 'processing', attempts = attempts + 1, updated_at = ?
+                WHERE id = (
+                    SELECT id FROM webhook_inbox
+                    WHERE status = 'queued' AND next_attempt_at <= ?
+                    ORDER BY next_attempt_at
+                    LIMIT 1
+                )
+                RETURNING id, payload, attempts
+            ''', (now, now)).fetchone()
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        if not row:
+            return None
+        return row[0], json.loads(row[1]), row[2]
+
+    def complete(self, job_id, result):
+        self._update(job_id, 'done', None, json.dumps(result), time.time())
+
+    def fail(self, job_id, attempts, error, retry=True):
+        """Schedules a retry with backoff, or marks the job failed when retry is False or attempts are used up."""
+        if not retry or attempts >= self.max_attempts:
+            self._update(job_id, 'failed', error, None, time.time())
+            return
+        delay = min(self.backoff_base * (2 ** (attempts - 1)), self.backoff_max)
+        self._update(job_id, 'queued', error, None, time.time() + delay)
+
+    def _update(self, job_id, status, error, result, next_attempt_at):
+        conn = self._connect()
+        try:
+            conn.execute(
+                'UPDATE webhook_inbox SET status = ?, last_error = ?, result = ?, next_attempt_at = ?, updated_at = ? WHERE id = ?',
+                (status, error, result, next_attempt_at, time.time(), job_id)
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    def requeue_stale(self, lease_timeout=LEASE_TIMEOUT):
+        """
+        Jobs left in 'processing' by a crashed worker are put back in the queue. Only jobs claimed
+        more than lease_timeout seconds ago count, so jobs another process is working on are left alone.
+        """
+        conn = self._connect()
+        try:
+            conn.execute("UPDATE webhook_inbox SET status = 'queued' WHERE status = 'processing' AND updated_at < ?",
+                         (time.time() - lease_timeout,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    def get(self, job_id):
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                'SELECT id, status, attempts, last_error, result, created_at, updated_at FROM webhook_inbox WHERE id = ?',
+                (job_id,)
+            ).fetchone()
+        except Exception:
+            conn.rollback()
+            raise
+        if not row:
+            return None
+        return {
+            'id': row[0],
+            'status': row[1],
+            'attempts': row[2],
+            'last_error': row[3],
+            'result': json.loads(row[4]) if row[4] else None,
+            'created_at': row[5],
+            'updated_at': row[6],
+        }
+
+
+class InboxWorkerPool:
+    """
+    Worker threads that drain a ShipmentInbox.
+    handler(payload) must return (response_dict, http_status). A 5xx status, 408, 429 or a
+    raised exception counts as a failed attempt and is retried; any other 4xx status means
+    the payload itself is bad, so the job fails at once.
+    """
+    def __init__(self, inbox, handler, workers=4, poll_interval=POLL_INTERVAL, lease_timeout=LEASE_TIMEOUT):
+        self.inbox = inbox
+        self.handler = handler
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.lease_timeout = lease_timeout
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        if self._threads:
+            return
+        self.inbox.requeue_stale(self.lease_timeout)
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'inbox-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def notify(self):
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                job = self.inbox.claim()
+            except sqlite3.Error as e:
+                event(log, WARNING, 'inbox_claim_failed', error=e)
+                job = None
+            if job is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            job_id, payload, attempts = job
+            try:
+                body, status = self.handler(payload)
+            except Exception as e:
+                body, status = {'error': str(e)}, 500
+            try:
+                if status < 400:
+                    self.inbox.complete(job_id, body)
+                else:
+                    retry = status >= 500 or status in (408, 429)
+                    self.inbox.fail(job_id, attempts, body.get('error', f'HTTP {status}'), retry)
+            except sqlite3.Error as e:
+                # The job stays leased and is requeued by requeue_stale; the worker keeps going
+                event(log, WARNING, 'inbox_update_failed', job_id=job_id, status=status, error=e)
@@ -1,72 +1,32 @@
-import sqlite3
-import json
+import sys
+import db
+from gazetteer import locode_for
+from geocoding import normalize_place_name
+from migrations import migrate
 
-def init_database():
-    conn = sqlite3.connect('vessel_tracking.db')
+def init_database(db_path=None, reset=False):
+    conn = db.connect(db_path)
     cursor = conn.cursor()
     
-    # Drop old tables
-    cursor.execute('DROP TABLE IF EXISTS routes')
-    cursor.execute('DROP TABLE IF EXISTS vessels')
-    cursor.execute('DROP TABLE IF EXISTS ports')
+    if reset:
+        # Every table the migrations created, read from the schema so a new one can't be left behind.
+        # Virtual tables go first: dropping one also drops its shadow tables (ports_rtree_node, ...)
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND sql LIKE 'CREATE VIRTUAL TABLE%'")
+        for (table,) in cursor.fetchall():
+            cursor.execute(f'DROP TABLE IF EXISTS "{table}"')
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")
+        for (table,) in cursor.fetchall():
+            cursor.execute(f'DROP TABLE IF EXISTS "{table}"')
+        cursor.execute('PRAGMA user_version = 0')
+        conn.commit()
     
-    # Create tables
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS ports (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            latitude REAL NOT NULL,
-            longitude REAL NOT NULL,
-            status TEXT DEFAULT 'normal'
-        )
-    ''')
+    # Create or upgrade tables in place
+    migrate(conn)
     
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS vessels (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            current_latitude REAL NOT NULL,
-            current_longitude REAL NOT NULL,
-            status TEXT DEFAULT 'on_time'
-        )
-    ''')
-    
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS service_lines (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            region_from TEXT,
-            region_to TEXT
-        )
-    ''')
-    
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS routes (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            service_line_id INTEGER,
-            name TEXT NOT NULL,
-            color TEXT NOT NULL,
-            origin_port_id INTEGER,
-            destination_port_id INTEGER,
-            FOREIGN KEY (service_line_id) REFERENCES service_lines(id),
-            FOREIGN KEY (origin_port_id) REFERENCES ports(id),
-            FOREIGN KEY (destination_port_id) REFERENCES ports(id)
-        )
-    ''')
-    
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS voyages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            route_id INTEGER,
-            vessel_id INTEGER,
-            departure_date TEXT,
-            arrival_date TEXT,
-            status TEXT DEFAULT 'scheduled',
-            legs TEXT DEFAULT '[]',
-            FOREIGN KEY (route_id) REFERENCES routes(id),
-            FOREIGN KEY (vessel_id) REFERENCES vessels(id)
-        )
-    ''')
+    cursor.execute('SELECT COUNT(*) FROM ports')
+    if cursor.fetchone()[0] > 0:
+        conn.close()
+        return
     
     # Insert ports
     ports_data = [
@@ -82,7 +42,8 @@ def init_database():
         ('Felixstowe', 51.9613, 1.2977, 'normal'),
         ('New York', 40.6692, -74.0445, 'normal')
     ]
-    cursor.executemany('INSERT INTO ports (name, latitude, longitude, status) VALUES (?, ?, ?, ?)', ports_data)
+    cursor.executemany('INSERT INTO ports (name, name_key, locode, latitude, longitude, status) VALUES (?, ?, ?, ?, ?, ?)',
+                       [(name, normalize_place_name(name), locode_for(name), lat, lon, status) for name, lat, lon, status in ports_data])
     
     # Insert vessels
     vessels_data = [
@@ -91,14 +52,16 @@ def init_database():
         ('HAPAG LLOYD EXPRESS', 45.0, -55.0, 'on_time'),
         ('MAERSK SEALAND', 48.0, -30.0, 'on_time')
     ]
-    cursor.executemany('INSERT INTO vessels (name, current_latitude, current_longitude, status) VALUES (?, ?, ?, ?)', vessels_data)
+    cursor.executemany('INSERT INTO vessels (name, name_key, current_latitude, current_longitude, status) VALUES (?, ?, ?, ?, ?)',
+                       [(name, normalize_place_name(name), lat, lon, status) for name, lat, lon, status in vessels_data])
     
     # Insert service lines
     service_lines_data = [
         ('Asia-North America Service', 'Asia', 'North America'),
         ('Europe-North America Service', 'Europe', 'North America')
     ]
-    cursor.executemany('INSERT INTO service_lines (name, region_from, region_to) VALUES (?, ?, ?)', service_lines_data)
+    cursor.executemany('INSERT INTO service_lines (name, name_key, region_from, region_to) VALUES (?, ?, ?, ?)',
+                       [(name, normalize_place_name(name), region_from, region_to) for name, region_from, region_to in service_lines_data])
     
     # Insert routes
     routes_data = [
@@ -113,4 +76,5 @@ def init_database():
     conn.close()
 
 if __name__ == '__main__':
-    init_database()
+    # --reset drops every table first; without it an existing database is upgraded in place
+    init_database(reset='--reset' in sys.argv[1:])
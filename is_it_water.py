@@ -1,7 +1,8 @@
-from global_land_mask import globe
+from land_mask import get_land_classifier
 
-# Montreal
-lat_city, lon_city = 45.5031824, -73.5698065
+# Montreal, mid-Atlantic, Rotterdam
+points = [[45.5031824, -73.5698065], [40.0, -40.0], [51.9244, 4.4777]]
 
 
-print(f"montreal City: {globe.is_land(lat_city, lon_city)}") # Output: True
+print(f"montreal City: {get_land_classifier().is_land(*points[0])}") # Output: True
+print(f"batch: {get_land_classifier().classify(points).tolist()}") # Output: [True, False, True]
@@ -0,0 +1,165 @@
+"""
+Incremental readers for batch webhook bodies.
+Both a JSON array of payloads and newline-delimited JSON (one payload per line)
+are decoded item by item, so a batch never has to be held in memory as a whole.
+Lines are independent, so a bad JSONL line only fails itself; a broken array fails the body.
+"""
+import codecs
+import json
+
+CHUNK_SIZE = 64 * 1024
+_WHITESPACE = ' \t\r\n'
+
+
+def _read_text(stream, chunk_size=CHUNK_SIZE):
+    # A multi-byte character can straddle two reads; the incremental decoder carries its first bytes over
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            # Raises on a body that ends in the middle of a character
+            tail = decoder.decode(b'', final=True)
+            if tail:
+                yield tail
+            return
+        if isinstance(chunk, bytes):
+            chunk = decoder.decode(chunk)
+            if not chunk:
+                continue
+        yield chunk
+
+
+def iter_json_array(stream, chunk_size=CHUNK_SIZE):
+    """Yields the elements of a top-level JSON array one at a time."""
+    decoder = json.JSONDecoder()
+    chunks = _read_text(stream, chunk_size)
+    buf = ''
+    pos = 0
+    started = False
+    exhausted = False
+    while True:
+        # Skip separators between elements
+        while pos < len(buf) and (buf[pos] in _WHITESPACE or (started and buf[pos] == ',')):
+            pos += 1
+        if pos == len(buf):
+            if exhausted:
+                raise ValueError('Unterminated JSON array')
+            chunk = next(chunks, None)
+            if chunk is None:
+                exhausted = True
+                continue
+            buf, pos = buf[pos:] + chunk, 0
+            continue
+        if not started:
+            if buf[pos] != '[':
+                raise ValueError('Expected a JSON array')
+            started = True
+            pos += 1
+            continue
+        if buf[pos] == ']':
+            return
+        try:
+            item, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if exhausted:
+                raise
+            chunk = next(chunks, None)
+            if chunk is None:
+                exhausted = True
+            else:
+                buf, pos = buf[pos:] + chunk, 0
+            continue
+        # A number at the end of the buffer may continue in the next chunk
+        if end == len(buf) and not exhausted:
+            chunk = next(chunks, None)
+            if chunk is None:
+                exhausted = True
+            else:
+                buf, pos = buf[pos:] + chunk, 0
+                continue
+        yield item
+        pos = end
+        if pos > chunk_size:
+            buf, pos = buf[pos:], 0
+
+
+class MalformedLine:
+    """Yielded by iter_json_lines in place of a line that isn't valid JSON, so the other lines still count."""
+    __slots__ = ('error',)
+
+    def __init__(self, error):
+        self.error = error
+
+
+def _decode_line(text):
+    try:
+        return json.loads(text)
+    except ValueError as e:
+        return MalformedLine(str(e))
+
+
+def iter_json_lines(stream):
+    """Yields one decoded value per non-empty line; a malformed line yields a MalformedLine."""
+    pending = b''
+    for line in stream:
+        if isinstance(line, str):
+            line = line.encode('utf-8')
+        pending += line
+        if not pending.endswith(b'\n'):
+            continue
+        text = pending.strip()
+        pending = b''
+        if text:
+            yield _decode_line(text)
+    if pending.strip():
+        yield _decode_line(pending)
+
+
+def iter_batch(stream, chunk_size=CHUNK_SIZE):
+    """
+    Detects array vs. JSONL from the first non-whitespace byte and yields payloads. A broken
+    array raises ValueError; in JSONL each malformed line is yielded as a MalformedLine.
+    """
+    head = b''
+    while True:
+        chunk = stream.read(1)
+        if not chunk:
+            return
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        if chunk.strip():
+            head = chunk
+            break
+    rest = _Prefixed(head, stream)
+    if head == b'[':
+        yield from iter_json_array(rest, chunk_size)
+    else:
+        yield from iter_json_lines(rest)
+
+
+class _Prefixed:
+    """Puts back bytes that were consumed while sniffing the stream format."""
+    def __init__(self, prefix, stream):
+        self.prefix = prefix
+        self.stream = stream
+
+    def read(self, size=-1):
+        if self.prefix:
+            data, self.prefix = self.prefix, b''
+            return data
+        data = self.stream.read(size)
+        return data.encode('utf-8') if isinstance(data, str) else data
+
+    def __iter__(self):
+        # Line iteration over a request stream reads it a byte at a time; split whole chunks instead
+        pending, self.prefix = self.prefix, b''
+        while True:
+            chunk = self.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            lines = (pending + chunk).split(b'\n')
+            pending = lines.pop()
+            for line in lines:
+                yield line + b'\n'
+        if pending:
+            yield pending
@@ -0,0 +1,93 @@
+"""
+Batched land/water classification on top of global_land_mask.
+Points are snapped to the mask's own grid (1/120°, ~1 km) and each cell is looked
+up once; later calls reuse the memoized cells, so answers are exactly those of
+globe.is_land. Longitudes may be unwrapped (outside [-180, 180]); they are wrapped
+before the lookup.
+"""
+import threading
+import numpy as np
+import metrics
+try:
+    from global_land_mask import globe
+except ImportError:
+    globe = None
+
+# The memo is dropped when it grows past this many cells
+MAX_CELLS = 2_000_000
+CELLS = metrics.counter('land_mask_cells_total', 'Grid cells looked up, by whether the memo had them', ('result',))
+CLASSIFY_SECONDS = metrics.timer('land_mask_classify_seconds', 'Time in LandClassifier.classify')
+
+
+class LandClassifier:
+    def __init__(self, max_cells=MAX_CELLS):
+        self.max_cells = max_cells
+        self._keys = np.empty(0, dtype=np.int64)
+        self._values = np.empty(0, dtype=bool)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def classify(self, coords):
+        """Boolean mask (True = land) for a sequence or (n, 2) array of [lat, lon] points."""
+        points = np.asarray(coords, dtype=float).reshape(-1, 2)
+        if globe is None or len(points) == 0:
+            return np.zeros(len(points), dtype=bool)
+        with CLASSIFY_SECONDS.time():
+            return self._classify(points)
+
+    def _classify(self, points):
+        lat = np.clip(points[:, 0], -90, 90)
+        lon = (points[:, 1] + 180) % 360 - 180
+        keys = (globe.lat_to_index(lat).astype(np.int64) << 32) | globe.lon_to_index(lon).astype(np.int64)
+        unique, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        with self._lock:
+            positions = np.searchsorted(self._keys, unique)
+            known = positions < len(self._keys)
+            known[known] = self._keys[positions[known]] == unique[known]
+            values = np.zeros(len(unique), dtype=bool)
+            values[known] = self._values[positions[known]]
+            missing = unique[~known]
+            if len(missing):
+                # Any point of a cell gives that cell's answer
+                sample = first[~known]
+                computed = np.asarray(globe.is_land(lat[sample], lon[sample]), dtype=bool)
+                values[~known] = computed
+                self._remember(missing, computed)
+            self.hits += int(known.sum())
+            self.misses += len(missing)
+        CELLS.inc(len(unique) - len(missing), result='hit')
+        CELLS.inc(len(missing), result='miss')
+        return values[inverse.reshape(-1)]
+
+    def _remember(self, keys, values):
+        if len(self._keys) + len(keys) > self.max_cells:
+            self._keys = np.empty(0, dtype=np.int64)
+            self._values = np.empty(0, dtype=bool)
+        merged_keys = np.concatenate([self._keys, keys])
+        order = np.argsort(merged_keys, kind='stable')
+        self._keys = merged_keys[order]
+        self._values = np.concatenate([self._values, values])[order]
+
+    def is_land(self, lat, lon):
+        return bool(self.classify([[lat, lon]])[0])
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'cells': len(self._keys)}
+
+
+def land_runs(mask):
+    """(first, last) index pairs of consecutive True values in a boolean mask."""
+    padded = np.concatenate([[False], np.asarray(mask, dtype=bool), [False]])
+    edges = np.flatnonzero(padded[1:] != padded[:-1])
+    return [(int(start), int(end) - 1) for start, end in zip(edges[::2], edges[1::2])]
+
+
+_shared_classifier = None
+
+
+def get_land_classifier():
+    global _shared_classifier
+    if _shared_classifier is None:
+        _shared_classifier = LandClassifier()
+    return _shared_classifier
@@ -0,0 +1,139 @@
+"""
+On-disk cache of rendered voyage layers for incremental dashboard builds.
+Each voyage's feature group is rendered once into its header/html/script pieces
+and stored under a hash of everything it was drawn from. Later builds replay the
+stored pieces through CachedVoyageLayer and only re-render voyages whose hash changed.
+"""
+import hashlib
+import json
+import sqlite3
+import time
+import folium
+from branca.element import Element
+from folium.map import Layer
+import db
+from logs import get_logger, event, WARNING
+from migrations import ensure_schema
+
+# Bump when the rendering code changes so old fragments are not reused
+LAYER_CACHE_VERSION = 1
+# Fragments unused for this long are deleted after a build
+MAX_AGE = 30 * 24 * 3600
+log = get_logger('layer_cache')
+_SECTIONS = ('header', 'html', 'script')
+
+
+def layer_key(voyage, port_names, coords, settings):
+    """Content hash of the inputs a voyage's rendered layer depends on."""
+    vessel = voyage.vessel
+    inputs = {
+        'version': LAYER_CACHE_VERSION,
+        'voyage': getattr(voyage, 'id', None),
+        'route': [voyage.route.name, voyage.route.color],
+        'ports': [port_names, [list(c) if c is not None else None for c in coords]],
+        'vessel': [vessel.name, list(vessel.current_location) if vessel.current_location else None],
+        'settings': list(settings),
+    }
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def capture_fragment(feature_group, map_id, bounds, route_info):
+    """
+    Renders a feature group on its own and returns the pieces it adds to the page.
+    A scratch map with the real map's id stands in as the parent, so the captured
+    script adds the layer to the real map when it is replayed.
+    """
+    scratch = folium.Map(tiles=None)
+    scratch._id = map_id
+    feature_group.add_to(scratch)
+    figure = scratch.get_root()
+    before = {section: set(getattr(figure, section)._children) for section in _SECTIONS}
+    feature_group.render()
+    fragment = {'id': feature_group._id, 'bounds': bounds, 'route': list(route_info)}
+    for section in _SECTIONS:
+        children = getattr(figure, section)._children
+        fragment[section] = [[name, child.render()] for name, child in children.items() if name not in before[section]]
+    return fragment
+
+
+class _RawElement(Element):
+    """Pre-rendered markup that is emitted verbatim (not treated as a template)."""
+    def __init__(self, text):
+        super().__init__()
+        self.text = text
+
+    def render(self, **kwargs):
+        return self.text
+
+
+class CachedVoyageLayer(Layer):
+    """
+    Stands in for a voyage's FeatureGroup. It has the same name and id, so LayerControl
+    lists it as before, and rendering replays the cached pieces instead of the elements.
+    """
+    def __init__(self, fragment):
+        super().__init__(name=fragment['route'][0], overlay=True, control=True, show=True)
+        self._name = 'FeatureGroup'
+        self._id = fragment['id']
+        self.fragment = fragment
+
+    def render(self, **kwargs):
+        figure = self.get_root()
+        for section in _SECTIONS:
+            target = getattr(figure, section)
+            for name, text in self.fragment[section]:
+                target.add_child(_RawElement(text), name=name)
+
+
+class LayerCache:
+    def __init__(self, db_path=None):
+        self.db_path = db_path
+        self.hits = 0
+        self.misses = 0
+
+    def _connect(self):
+        ensure_schema(self.db_path)
+        return db.get_connection(self.db_path, pool='layer_cache')
+
+    def get_many(self, keys):
+        conn = self._connect()
+        found = {}
+        keys = list(dict.fromkeys(keys))
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            cursor = conn.execute(
+                f'SELECT key, fragment FROM dashboard_layer_cache WHERE key IN ({",".join("?" * len(chunk))})', chunk)
+            for key, fragment in cursor.fetchall():
+                found[key] = json.loads(fragment)
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        if found:
+            now = time.time()
+            try:
+                conn.executemany('UPDATE dashboard_layer_cache SET last_used_at = ? WHERE key = ?',
+                                 [(now, key) for key in found])
+                conn.commit()
+            except sqlite3.Error:
+                conn.rollback()
+        return found
+
+    def put_many(self, fragments):
+        conn = self._connect()
+        now = time.time()
+        try:
+            conn.executemany(
+                'INSERT OR REPLACE INTO dashboard_layer_cache (key, fragment, last_used_at) VALUES (?, ?, ?)',
+                [(key, json.dumps(fragment, separators=(',', ':')), now) for key, fragment in fragments.items()]
+            )
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            event(log, WARNING, 'layer_cache_write_failed', error=e)
+
+    def prune(self, max_age=MAX_AGE):
+        conn = self._connect()
+        try:
+            conn.execute('DELETE FROM dashboard_layer_cache WHERE last_used_at < ?', (time.time() - max_age,))
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
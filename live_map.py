@@ -0,0 +1,274 @@
+"""
+GeoJSON view of the fleet for the live map served by server.py.
+Features are built once per data revision (see migrations.get_data_revision) and
+filtered per request, so polling an unchanged database only costs one SELECT. A new
+revision only reroutes the voyages that changed, and is built while the previous
+one keeps being served.
+"""
+import gzip
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from dashboard import VesselTrackingDashboard
+from geocoding import normalize_place_name
+from migrations import ensure_schema, get_data_revision
+from models import Port
+from polyline import PathPostProcessor
+from positions import PositionStore, unwrap_track
+from service import VesselTrackingService
+import db
+
+LAYERS = ('legs', 'ports', 'vessels', 'wakes')
+GZIP_LEVEL = 6
+
+
+class MapQuery:
+    """Validated filters of one GeoJSON request. Raises ValueError on malformed input."""
+    def __init__(self, bbox=None, routes=None, statuses=None, vessels=None, layers=None):
+        self.bbox = parse_bbox(bbox) if bbox else None
+        self.routes = _parse_names(routes)
+        self.statuses = _parse_names(statuses)
+        self.vessels = _parse_names(vessels)
+        self.layers = _parse_names(layers) or frozenset(LAYERS)
+        unknown = self.layers - set(LAYERS)
+        if unknown:
+            raise ValueError(f"Unknown layer(s): {', '.join(sorted(unknown))}")
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(args.get('bbox'), args.get('route'), args.get('status'), args.get('vessel'), args.get('layers'))
+
+    def cache_key(self):
+        return json.dumps([self.bbox, sorted(self.routes), sorted(self.statuses), sorted(self.vessels),
+                           sorted(self.layers)])
+
+    def matches(self, voyage):
+        return ((not self.routes or voyage['route_key'] in self.routes)
+                and (not self.statuses or voyage['status_key'] in self.statuses)
+                and (not self.vessels or voyage['vessel_key'] in self.vessels))
+
+
+def _parse_names(value):
+    if not value:
+        return frozenset()
+    return frozenset(normalize_place_name(part) for part in value.split(',') if part.strip())
+
+
+def parse_bbox(value):
+    """'min_lon,min_lat,max_lon,max_lat' -> list of floats. min_lon > max_lon means the box crosses 180°."""
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(v) for v in value.split(','))
+    except ValueError:
+        raise ValueError('bbox must be min_lon,min_lat,max_lon,max_lat')
+    if min_lat > max_lat:
+        raise ValueError('bbox min_lat is greater than max_lat')
+    if min_lon > max_lon:
+        max_lon += 360
+    return [min_lon, min_lat, max_lon, max_lat]
+
+
+def bbox_intersects(a, b):
+    """Intersection test for [min_lon, min_lat, max_lon, max_lat] boxes, treating longitude as periodic."""
+    if a[1] > b[3] or b[1] > a[3]:
+        return False
+    if a[2] - a[0] >= 360 or b[2] - b[0] >= 360:
+        return True
+    # Leg longitudes are unwrapped and may lie a turn or two outside [-180, 180]
+    return any(a[0] + shift <= b[2] and b[0] <= a[2] + shift for shift in (-720, -360, 0, 360, 720))
+
+
+def _bbox_of(points):
+    lons = [p[0] for p in points]
+    lats = [p[1] for p in points]
+    return [min(lons), min(lats), max(lons), max(lats)]
+
+
+def _point(lat_lon, properties):
+    coordinates = [lat_lon[1], lat_lon[0]]
+    return {'type': 'Feature', 'bbox': coordinates + coordinates,
+            'geometry': {'type': 'Point', 'coordinates': coordinates}, 'properties': properties}
+
+
+def _port_signature(port):
+    if isinstance(port, Port):
+        return port.name, port.location, port.status
+    return port
+
+
+def _voyage_signature(voyage):
+    """Everything a voyage's features are built from; an unchanged signature reuses the built features."""
+    route = voyage.route
+    vessel = voyage.vessel
+    return repr((voyage.id, voyage.departure_date, voyage.arrival_date, voyage.status,
+                 route.name, route.color, _port_signature(route.origin_port), _port_signature(route.destination_port),
+                 vessel.name, vessel.current_location, vessel.status,
+                 [_port_signature(port) for port in voyage.transshipment_ports]))
+
+
+class _Snapshot:
+    """Features of one data revision; never modified once published."""
+    __slots__ = ('revision', 'voyages', 'ports', 'wakes')
+
+    def __init__(self, revision, voyages, ports, wakes):
+        self.revision = revision
+        self.voyages = voyages
+        self.ports = ports
+        self.wakes = wakes
+
+
+class LiveMapData:
+    def __init__(self, db_path=None, max_responses=64):
+        self.db_path = db_path
+        self.max_responses = max_responses
+        # Guards the published snapshot and the response cache; held only for lookups and swaps
+        self._lock = threading.Lock()
+        # One rebuild at a time; requests for the published revision don't wait for it
+        self._build_lock = threading.Lock()
+        self._snapshot = None
+        self._built = {}
+        self._responses = OrderedDict()
+        self._geometry = None
+
+    def revision(self):
+        ensure_schema(self.db_path)
+        return get_data_revision(db.get_connection(self.db_path, pool='live_map'))
+
+    def etag(self, revision, query):
+        digest = hashlib.sha256(f'{revision}|{query.cache_key()}'.encode('utf-8')).hexdigest()
+        return f'fleet-{revision}-{digest[:20]}'
+
+    def _build_voyage(self, voyage, ordering, processor):
+        route = voyage.route
+        vessel = voyage.vessel
+        geometry = self._geometry.compute_voyage_geometry(voyage, ordering)
+        common = {'voyage_id': voyage.id, 'route': route.name, 'color': route.color, 'status': voyage.status,
+                  'vessel': vessel.name, 'departure_date': voyage.departure_date,
+                  'arrival_date': voyage.arrival_date}
+        legs = []
+        for leg in (geometry['legs'] if geometry else []):
+            coordinates = [[lon, lat] for lat, lon in processor.process(leg['path'])]
+            properties = dict(common, kind='leg', start=leg['start_name'], end=leg['end_name'],
+                              inland=leg['is_inland'])
+            legs.append({'type': 'Feature', 'bbox': _bbox_of(coordinates),
+                         'geometry': {'type': 'LineString', 'coordinates': coordinates},
+                         'properties': properties})
+        vessel_feature = None
+        if vessel.current_location:
+            vessel_feature = _point(vessel.current_location, dict(common, kind='vessel', vessel_status=vessel.status))
+        ports = {}
+        vessel_label = vessel.name + ' (vessel)'
+        for name, coords in zip(*ordering):
+            if coords is None or name == vessel_label:
+                continue
+            key = normalize_place_name(name)
+            if key not in ports:
+                ports[key] = _point(coords, {'kind': 'port', 'name': name})
+        return {
+            'route_key': normalize_place_name(route.name),
+            'status_key': normalize_place_name(voyage.status or ''),
+            'vessel_key': normalize_place_name(vessel.name),
+            'legs': legs,
+            'vessel': vessel_feature,
+            'ports': ports,
+        }
+
+    def _build(self, revision):
+        """
+        Features for the current data. Only voyages whose signature changed since the last
+        build are ordered and routed again; the rest reuse their features.
+        """
+        if self._geometry is None:
+            self._geometry = VesselTrackingDashboard(workers=1)
+        processor = PathPostProcessor(self._geometry.path_processor.tolerance, self._geometry.path_processor.precision)
+        voyages = VesselTrackingService(self.db_path).get_voyages()
+        signatures = [_voyage_signature(voyage) for voyage in voyages]
+        changed = [voyage for voyage, signature in zip(voyages, signatures) if signature not in self._built]
+        built = {signature: self._built[signature] for signature in signatures if signature in self._built}
+        for voyage, ordering in zip(changed, self._geometry.sort_voyages(changed)):
+            built[_voyage_signature(voyage)] = self._build_voyage(voyage, ordering, processor)
+        # Voyages that are gone or changed drop out here
+        self._built = built
+        built_voyages = [built[signature] for signature in signatures]
+        ports = {}
+        for voyage in built_voyages:
+            for key, feature in voyage['ports'].items():
+                ports.setdefault(key, feature)
+        wakes = {}
+        for name, points in PositionStore(self.db_path).wakes().items():
+            if len(points) > 1:
+                coordinates = [[lon, lat] for lat, lon in unwrap_track(points)]
+                wakes[normalize_place_name(name)] = {
+                    'type': 'Feature', 'bbox': _bbox_of(coordinates),
+                    'geometry': {'type': 'LineString', 'coordinates': coordinates},
+                    'properties': {'kind': 'wake', 'vessel': name}}
+        return _Snapshot(revision, built_voyages, ports, wakes)
+
+    def _current(self, revision):
+        """The snapshot for revision, building it outside self._lock if it isn't published yet."""
+        with self._lock:
+            snapshot = self._snapshot
+        # Revisions only grow: a request that read an older one is served the newer data
+        if snapshot is not None and snapshot.revision >= revision:
+            return snapshot
+        with self._build_lock:
+            with self._lock:
+                snapshot = self._snapshot
+            if snapshot is not None and snapshot.revision >= revision:
+                return snapshot
+            snapshot = self._build(revision)
+            with self._lock:
+                self._snapshot = snapshot
+                self._responses.clear()
+            return snapshot
+
+    def _collect(self, snapshot, query):
+        features = []
+        port_keys = []
+        for voyage in snapshot.voyages:
+            if not query.matches(voyage):
+                continue
+            if 'legs' in query.layers:
+                features.extend(voyage['legs'])
+            if 'vessels' in query.layers and voyage['vessel']:
+                features.append(voyage['vessel'])
+            port_keys.extend(voyage['ports'])
+        if 'ports' in query.layers:
+            features.extend(snapshot.ports[key] for key in dict.fromkeys(port_keys))
+        if 'wakes' in query.layers:
+            # Wakes belong to vessels, not voyages: only the vessel filter applies
+            features.extend(wake for key, wake in snapshot.wakes.items() if not query.vessels or key in query.vessels)
+        if query.bbox:
+            features = [f for f in features if bbox_intersects(f['bbox'], query.bbox)]
+        return features
+
+    def response_body(self, revision, query, compress=False):
+        """Serialized (and optionally gzipped) FeatureCollection for query at revision."""
+        snapshot = self._current(revision)
+        key = (snapshot.revision, query.cache_key(), compress)
+        with self._lock:
+            body = self._responses.get(key)
+            if body is not None:
+                self._responses.move_to_end(key)
+                return body
+        # Concurrent misses for the same query may both serialize it; the result is the same
+        collection = {'type': 'FeatureCollection', 'revision': snapshot.revision,
+                      'features': self._collect(snapshot, query)}
+        body = json.dumps(collection, separators=(',', ':')).encode('utf-8')
+        if compress:
+            body = gzip.compress(body, GZIP_LEVEL)
+        with self._lock:
+            self._responses[key] = body
+            while len(self._responses) > self.max_responses:
+                self._responses.popitem(last=False)
+        return body
+
+
+_shared_map_data = None
+
+
+def get_live_map_data():
+    global _shared_map_data
+    if _shared_map_data is None:
+        _shared_map_data = LiveMapData()
+    return _shared_map_data
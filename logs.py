@@ -0,0 +1,57 @@
+"""
+Leveled, structured logging on top of the standard logging module.
+Events are a short name plus key=value fields, e.g.
+    2026-01-01 12:00:00 DEBUG dashboard sea_leg start=Rotterdam end=Halifax vertices=120
+Call sites in hot loops check logger.isEnabledFor() first, so a disabled level costs one
+comparison and no formatting. The level comes from VESSEL_LOG_LEVEL (default INFO).
+"""
+import logging
+import os
+import sys
+
+ROOT = 'vessel_tracking'
+DEBUG = logging.DEBUG
+INFO = logging.INFO
+WARNING = logging.WARNING
+ERROR = logging.ERROR
+
+
+def get_logger(name):
+    return logging.getLogger(f'{ROOT}.{name}')
+
+
+def event(logger, level, name, **fields):
+    """Logs name with fields as key=value pairs, if level is enabled. The fields also travel as record.fields."""
+    if logger.isEnabledFor(level):
+        message = ' '.join([name] + [f'{key}={_format_value(value)}' for key, value in fields.items()])
+        logger.log(level, message, extra={'fields': fields})
+
+
+def _format_value(value):
+    text = str(value)
+    if not text or any(c in text for c in ' ="'):
+        return '"' + text.replace('\\', '\\\\').replace('"', '\\"') + '"'
+    return text
+
+
+class KeyValueFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(short_name)s %(message)s', '%Y-%m-%d %H:%M:%S')
+
+    def format(self, record):
+        record.short_name = record.name[len(ROOT) + 1:] if record.name.startswith(ROOT + '.') else record.name
+        return super().format(record)
+
+
+def configure(level=None, stream=None):
+    """Sends the project's log records to stream (stderr by default) at level; safe to call more than once."""
+    level = level or os.environ.get('VESSEL_LOG_LEVEL', 'INFO')
+    logger = logging.getLogger(ROOT)
+    logger.setLevel(level.upper() if isinstance(level, str) else level)
+    if not any(getattr(h, '_vessel_tracking', False) for h in logger.handlers):
+        handler = logging.StreamHandler(stream or sys.stderr)
+        handler.setFormatter(KeyValueFormatter())
+        handler._vessel_tracking = True
+        logger.addHandler(handler)
+        logger.propagate = False
+    return logger
@@ -0,0 +1,204 @@
+"""
+In-process counters and timers, rendered in the Prometheus text format by server.py
+(/metrics) and as a plain summary by the dashboard.
+Observations are a dict update under a lock, cheap enough for hot paths. Setting
+VESSEL_METRICS=0 turns every call into a no-op and leaves SQLite connections unwrapped.
+Metrics are per process; dashboard worker processes keep their own.
+"""
+import bisect
+import math
+import os
+import sqlite3
+import threading
+import time
+
+enabled = os.environ.get('VESSEL_METRICS', '1') != '0'
+# Upper bounds in seconds of the timer histogram buckets
+BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, math.inf)
+
+_lock = threading.Lock()
+_registry = {}
+
+
+def _label_key(labelnames, labels):
+    return tuple(str(labels.get(name, '')) for name in labelnames)
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        if not enabled:
+            return
+        key = _label_key(self.labelnames, labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with _lock:
+            return [(self.name, key, value) for key, value in sorted(self.values.items())]
+
+
+class Timer:
+    """A histogram of durations in seconds; time() measures a with block."""
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        # label key -> [bucket counts..., count, sum]
+        self.values = {}
+
+    def observe(self, seconds, **labels):
+        if enabled:
+            self.observe_key(_label_key(self.labelnames, labels), seconds)
+
+    def observe_key(self, key, seconds):
+        """observe() with the label values already as a tuple in labelnames order, for hot paths."""
+        bucket = bisect.bisect_left(BUCKETS, seconds)
+        with _lock:
+            value = self.values.get(key)
+            if value is None:
+                value = self.values[key] = [0] * len(BUCKETS) + [0, 0.0]
+            value[bucket] += 1
+            value[-2] += 1
+            value[-1] += seconds
+
+    def time(self, **labels):
+        return _Timing(self, labels)
+
+    def totals(self):
+        """{label key: (count, total seconds)}"""
+        with _lock:
+            return {key: (value[-2], value[-1]) for key, value in self.values.items()}
+
+    def samples(self):
+        with _lock:
+            items = sorted((key, list(value)) for key, value in self.values.items())
+        samples = []
+        for key, value in items:
+            cumulative = 0
+            for bound, count in zip(BUCKETS, value):
+                cumulative += count
+                samples.append((self.name + '_bucket', key + ('+Inf' if bound == math.inf else repr(bound),), cumulative))
+            samples.append((self.name + '_count', key, value[-2]))
+            samples.append((self.name + '_sum', key, value[-1]))
+        return samples
+
+
+class _Timing:
+    __slots__ = ('timer', 'labels', 'start')
+
+    def __init__(self, timer, labels):
+        self.timer = timer
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timer.observe(time.perf_counter() - self.start, **self.labels)
+
+
+def _register(cls, name, help, labelnames):
+    with _lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = _registry[name] = cls(name, help, labelnames)
+    return metric
+
+
+def counter(name, help, labelnames=()):
+    return _register(Counter, name, help, labelnames)
+
+
+def timer(name, help, labelnames=()):
+    return _register(Timer, name, help, labelnames)
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_prometheus():
+    """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+    lines = []
+    for name, metric in sorted(_registry.items()):
+        kind = 'histogram' if isinstance(metric, Timer) else 'counter'
+        lines.append(f'# HELP {name} {metric.help}')
+        lines.append(f'# TYPE {name} {kind}')
+        labelnames = metric.labelnames + (('le',) if kind == 'histogram' else ())
+        for sample, key, value in metric.samples():
+            names = labelnames if sample.endswith('_bucket') else metric.labelnames
+            labels = ','.join(f'{n}="{_escape(v)}"' for n, v in zip(names, key))
+            lines.append(f'{sample}{{{labels}}} {value}' if labels else f'{sample} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def summary():
+    """Lines of 'timer{labels}: count, total, mean' for every timer that was used, slowest total first."""
+    rows = []
+    for name, metric in _registry.items():
+        if not isinstance(metric, Timer):
+            continue
+        for key, (count, total) in metric.totals().items():
+            labels = ','.join(f'{n}={v}' for n, v in zip(metric.labelnames, key))
+            rows.append((total, f'{name}{{{labels}}}' if labels else name, count))
+    rows.sort(reverse=True)
+    return [f'{label}: {count} calls, {total:.3f} s total, {total / count * 1000:.3f} ms mean'
+            for total, label, count in rows if count]
+
+
+def reset():
+    with _lock:
+        for metric in _registry.values():
+            metric.values.clear()
+
+
+SQL_SECONDS = timer('sqlite_statement_seconds', 'Time in execute/executemany by statement kind', ('statement',))
+_statement_kinds = {}
+
+
+def statement_kind(sql):
+    """Label key of a statement: its first keyword (SELECT, INSERT, UPDATE, BEGIN, ...)."""
+    key = _statement_kinds.get(sql)
+    if key is None:
+        words = sql.split(None, 1)
+        key = (words[0].upper() if words else '',)
+        # Statements are mostly literals from the code; IN lists of varying length are not
+        if len(_statement_kinds) < 4096:
+            _statement_kinds[sql] = key
+    return key
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    def execute(self, sql, *args):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, *args)
+        finally:
+            SQL_SECONDS.observe_key(statement_kind(sql), time.perf_counter() - start)
+
+    def executemany(self, sql, *args):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, *args)
+        finally:
+            SQL_SECONDS.observe_key(statement_kind(sql), time.perf_counter() - start)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Times every statement run through a cursor or the execute shortcuts (excluding row fetching)."""
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    # The C shortcuts don't go through cursor()
+    def execute(self, sql, *args):
+        return self.cursor().execute(sql, *args)
+
+    def executemany(self, sql, *args):
+        return self.cursor().executemany(sql, *args)
@@ -0,0 +1,460 @@
+"""
+Schema versioning for vessel_tracking.db.
+The version is kept in PRAGMA user_version; migrate() applies every pending
+migration in order, each in its own transaction, so existing databases are
+upgraded in place instead of being dropped and recreated.
+"""
+import json
+import threading
+import db
+from gazetteer import locode_for
+from geocoding import create_cache_table, normalize_place_name
+from inbox import create_inbox_table
+from spatial import TRACK_BOX_SECONDS
+
+
+def _baseline(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ports (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            latitude REAL NOT NULL,
+            longitude REAL NOT NULL,
+            status TEXT DEFAULT 'normal'
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS vessels (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            current_latitude REAL NOT NULL,
+            current_longitude REAL NOT NULL,
+            status TEXT DEFAULT 'on_time'
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS service_lines (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            region_from TEXT,
+            region_to TEXT
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS routes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            service_line_id INTEGER,
+            name TEXT NOT NULL,
+            color TEXT NOT NULL,
+            origin_port_id INTEGER,
+            destination_port_id INTEGER,
+            FOREIGN KEY (service_line_id) REFERENCES service_lines(id),
+            FOREIGN KEY (origin_port_id) REFERENCES ports(id),
+            FOREIGN KEY (destination_port_id) REFERENCES ports(id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS voyages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            route_id INTEGER,
+            vessel_id INTEGER,
+            departure_date TEXT,
+            arrival_date TEXT,
+            status TEXT DEFAULT 'scheduled',
+            legs TEXT DEFAULT '[]',
+            FOREIGN KEY (route_id) REFERENCES routes(id),
+            FOREIGN KEY (vessel_id) REFERENCES vessels(id)
+        )
+    ''')
+    create_cache_table(cursor)
+    create_inbox_table(cursor)
+
+
+def _merge_duplicates(cursor, table, key_column, references):
+    """Keeps the lowest id of each key group, repoints referencing columns to it and deletes the rest."""
+    cursor.execute(f'''
+        SELECT MIN(id), GROUP_CONCAT(id) FROM {table}
+        WHERE {key_column} IS NOT NULL
+        GROUP BY {key_column} HAVING COUNT(*) > 1
+    ''')
+    for keep_id, ids in cursor.fetchall():
+        duplicate_ids = [int(i) for i in ids.split(',') if int(i) != keep_id]
+        placeholders = ','.join('?' * len(duplicate_ids))
+        for ref_table, ref_column in references:
+            cursor.execute(f'UPDATE {ref_table} SET {ref_column} = ? WHERE {ref_column} IN ({placeholders})',
+                           [keep_id] + duplicate_ids)
+        cursor.execute(f'DELETE FROM {table} WHERE id IN ({placeholders})', duplicate_ids)
+
+
+def _name_keys_and_indexes(cursor):
+    for table in ('ports', 'vessels', 'service_lines'):
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN name_key TEXT')
+        cursor.execute(f'SELECT id, name FROM {table}')
+        cursor.executemany(f'UPDATE {table} SET name_key = ? WHERE id = ?',
+                           [(normalize_place_name(name), row_id) for row_id, name in cursor.fetchall()])
+    _merge_duplicates(cursor, 'ports', 'name_key',
+                      [('routes', 'origin_port_id'), ('routes', 'destination_port_id')])
+    _merge_duplicates(cursor, 'vessels', 'name_key', [('voyages', 'vessel_id')])
+    _merge_duplicates(cursor, 'service_lines', 'name_key', [('routes', 'service_line_id')])
+    _merge_duplicates(cursor, 'routes', "origin_port_id || '>' || destination_port_id", [('voyages', 'route_id')])
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS ux_ports_name_key ON ports(name_key)')
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS ux_vessels_name_key ON vessels(name_key)')
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS ux_service_lines_name_key ON service_lines(name_key)')
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS ux_routes_origin_destination ON routes(origin_port_id, destination_port_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_voyages_route_id ON voyages(route_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_voyages_vessel_id ON voyages(vessel_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_voyages_status ON voyages(status)')
+
+
+def _sea_route_cache(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sea_route_cache (
+            key TEXT PRIMARY KEY,
+            path TEXT NOT NULL,
+            length_km REAL,
+            created_at REAL NOT NULL
+        )
+    ''')
+
+
+def _dashboard_layer_cache(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS dashboard_layer_cache (
+            key TEXT PRIMARY KEY,
+            fragment TEXT NOT NULL,
+            last_used_at REAL NOT NULL
+        )
+    ''')
+
+
+REVISION_TABLES = ('ports', 'vessels', 'service_lines', 'routes', 'voyages')
+
+
+def _data_revision(cursor):
+    # Bumped by triggers on every write to the map tables; used for cheap change detection (ETags)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS data_revision (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            revision INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('INSERT OR IGNORE INTO data_revision (id, revision) VALUES (1, 0)')
+    for table in REVISION_TABLES:
+        _revision_triggers(cursor, table)
+
+
+def _revision_triggers(cursor, table):
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_revision AFTER {event} ON {table}
+            BEGIN
+                UPDATE data_revision SET revision = revision + 1 WHERE id = 1;
+            END
+        ''')
+
+
+def _voyage_legs(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS voyage_legs (
+            voyage_id INTEGER NOT NULL,
+            seq INTEGER NOT NULL,
+            port_id INTEGER NOT NULL,
+            event_time TEXT,
+            PRIMARY KEY (voyage_id, seq),
+            FOREIGN KEY (voyage_id) REFERENCES voyages(id),
+            FOREIGN KEY (port_id) REFERENCES ports(id)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_voyage_legs_port_id ON voyage_legs(port_id)')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_voyages_delete_legs AFTER DELETE ON voyages
+        BEGIN
+            DELETE FROM voyage_legs WHERE voyage_id = old.id;
+        END
+    ''')
+    _revision_triggers(cursor, 'voyage_legs')
+    # Convert the JSON name lists; names that were never geocoded into ports stay JSON-only
+    cursor.execute('SELECT name_key, id FROM ports')
+    port_ids = dict(cursor.fetchall())
+    cursor.execute('SELECT id, legs FROM voyages')
+    rows = []
+    for voyage_id, legs in cursor.fetchall():
+        try:
+            names = json.loads(legs) if legs else []
+        except ValueError:
+            continue
+        for seq, name in enumerate(names):
+            port_id = port_ids.get(normalize_place_name(name)) if isinstance(name, str) else None
+            if port_id is not None:
+                rows.append((voyage_id, seq, port_id))
+    cursor.executemany('INSERT OR IGNORE INTO voyage_legs (voyage_id, seq, port_id) VALUES (?, ?, ?)', rows)
+
+
+def _vessel_positions(cursor):
+    # Append-only position reports; the key doubles as the per-vessel time index and drops resent reports
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS vessel_positions (
+            vessel_id INTEGER NOT NULL,
+            ts INTEGER NOT NULL,
+            latitude REAL NOT NULL,
+            longitude REAL NOT NULL,
+            speed REAL,
+            course REAL,
+            PRIMARY KEY (vessel_id, ts)
+        ) WITHOUT ROWID
+    ''')
+    # Latest report per vessel and time bucket; resolution is the bucket width in seconds
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS vessel_tracks (
+            vessel_id INTEGER NOT NULL,
+            resolution INTEGER NOT NULL,
+            bucket INTEGER NOT NULL,
+            ts INTEGER NOT NULL,
+            latitude REAL NOT NULL,
+            longitude REAL NOT NULL,
+            speed REAL,
+            course REAL,
+            PRIMARY KEY (vessel_id, resolution, bucket)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('ALTER TABLE vessels ADD COLUMN mmsi INTEGER')
+    # Time of the report current_latitude/current_longitude come from, so late reports don't move a vessel back
+    cursor.execute('ALTER TABLE vessels ADD COLUMN position_time INTEGER')
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS ux_vessels_mmsi ON vessels(mmsi) WHERE mmsi IS NOT NULL')
+
+
+def _import_checkpoints(cursor):
+    # How far each CSV import got; written in the same transaction as the rows it covers
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS import_checkpoints (
+            source TEXT PRIMARY KEY,
+            fingerprint TEXT NOT NULL,
+            byte_offset INTEGER NOT NULL,
+            rows_done INTEGER NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    ''')
+
+
+def _voyage_shipment_keys(cursor):
+    # Webhook voyages are keyed by the carrier's shipment/container id; payload_hash lets unchanged reposts skip the write
+    cursor.execute('ALTER TABLE voyages ADD COLUMN shipment_key TEXT')
+    cursor.execute('ALTER TABLE voyages ADD COLUMN payload_hash TEXT')
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS ux_voyages_shipment_key ON voyages(shipment_key) WHERE shipment_key IS NOT NULL')
+
+
+def _port_locodes(cursor):
+    # Spellings of one port ('Norfolk, VA', 'NORFOLK') share the gazetteer's LOCODE; the oldest row claims it
+    cursor.execute('ALTER TABLE ports ADD COLUMN locode TEXT')
+    cursor.execute('SELECT id, name FROM ports ORDER BY id')
+    claimed = {}
+    for port_id, name in cursor.fetchall():
+        locode = locode_for(name)
+        if locode and locode not in claimed:
+            claimed[locode] = port_id
+    cursor.executemany('UPDATE ports SET locode = ? WHERE id = ?', list(claimed.items()))
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS ux_ports_locode ON ports(locode) WHERE locode IS NOT NULL')
+
+
+def _sea_distances_and_etas(cursor):
+    # One row: int64 port ids and a float32 distance matrix in km, row-major (see sea_distances.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sea_distance_matrix (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            port_ids BLOB NOT NULL,
+            distances BLOB NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    ''')
+    # Latest estimate per in-transit voyage; eta and computed_at are epoch seconds
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS voyage_etas (
+            voyage_id INTEGER PRIMARY KEY,
+            remaining_km REAL NOT NULL,
+            eta INTEGER NOT NULL,
+            delayed INTEGER NOT NULL,
+            computed_at REAL NOT NULL,
+            FOREIGN KEY (voyage_id) REFERENCES voyages(id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_voyages_delete_eta AFTER DELETE ON voyages
+        BEGIN
+            DELETE FROM voyage_etas WHERE voyage_id = old.id;
+        END
+    ''')
+
+
+def _spatial_triggers(cursor, table, index, lat, lon):
+    """Keeps an R*Tree of point boxes in step with a table's lat/lon columns; rows without a position are left out."""
+    def insert(row, source=''):
+        return f'''INSERT OR REPLACE INTO {index} (id, min_lat, max_lat, min_lon, max_lon)
+                   SELECT {row}.id, {row}.{lat}, {row}.{lat}, {row}.{lon}, {row}.{lon} {source}
+                   WHERE {row}.{lat} IS NOT NULL AND {row}.{lon} IS NOT NULL'''
+    delete = f'DELETE FROM {index} WHERE id = old.id'
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_spatial_insert AFTER INSERT ON {table}
+        BEGIN
+            {insert('new')};
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_spatial_update AFTER UPDATE OF {lat}, {lon} ON {table}
+        BEGIN
+            {delete};
+            {insert('new')};
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_spatial_delete AFTER DELETE ON {table}
+        BEGIN
+            {delete};
+        END
+    ''')
+    cursor.execute(insert(table, f'FROM {table}'))
+
+
+def _spatial_index(cursor):
+    # R*Tree indexes of ports and current vessel positions (see spatial.py); points are zero-size boxes
+    for index in ('ports_rtree', 'vessels_rtree'):
+        cursor.execute(f'CREATE VIRTUAL TABLE IF NOT EXISTS {index} USING rtree(id, min_lat, max_lat, min_lon, max_lon)')
+    _spatial_triggers(cursor, 'ports', 'ports_rtree', 'latitude', 'longitude')
+    _spatial_triggers(cursor, 'vessels', 'vessels_rtree', 'current_latitude', 'current_longitude')
+    # Position reports are indexed by the box each vessel covered per time bucket, kept up by PositionStore.ingest.
+    # A trigger adding one R*Tree row per report would halve ingest throughput.
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS vessel_track_boxes USING rtree(id, min_lat, max_lat, min_lon, max_lon, min_ts, max_ts)
+    ''')
+    cursor.execute(f'''
+        INSERT INTO vessel_track_boxes (id, min_lat, max_lat, min_lon, max_lon, min_ts, max_ts)
+        SELECT (vessel_id << 32) + ts / {TRACK_BOX_SECONDS}, MIN(latitude), MAX(latitude),
+               CASE WHEN MAX(longitude) - MIN(longitude) > 180 THEN -180 ELSE MIN(longitude) END,
+               CASE WHEN MAX(longitude) - MIN(longitude) > 180 THEN 180 ELSE MAX(longitude) END,
+               MIN(ts), MAX(ts)
+        FROM vessel_positions GROUP BY vessel_id, ts / {TRACK_BOX_SECONDS}
+    ''')
+
+
+def _exact_port_locodes(cursor):
+    # LOCODEs used to come from variant and fuzzy gazetteer hits too ('Sydney, NS' got AUSYD); only exact names keep one
+    cursor.execute('SELECT id, name, locode FROM ports WHERE locode IS NOT NULL')
+    cursor.executemany('UPDATE ports SET locode = NULL WHERE id = ?',
+                       [(port_id,) for port_id, name, locode in cursor.fetchall() if locode_for(name) != locode])
+
+
+def _revision_update_trigger(cursor, table):
+    """
+    Recreates the UPDATE revision trigger of a table so it only fires when a column actually
+    changes; upserts that find their row (ON CONFLICT DO UPDATE SET name_key = excluded.name_key)
+    then leave the revision alone. A migration that adds a column to a REVISION_TABLES table
+    must call this again, or changes to that column alone won't bump the revision.
+    """
+    cursor.execute(f'PRAGMA table_info({table})')
+    changed = ' OR '.join(f'old.{column} IS NOT new.{column}' for _, column, *_ in cursor.fetchall())
+    cursor.execute(f'DROP TRIGGER IF EXISTS trg_{table}_update_revision')
+    cursor.execute(f'''
+        CREATE TRIGGER trg_{table}_update_revision AFTER UPDATE ON {table}
+        WHEN {changed}
+        BEGIN
+            UPDATE data_revision SET revision = revision + 1 WHERE id = 1;
+        END
+    ''')
+
+
+def _revision_on_change(cursor):
+    for table in REVISION_TABLES + ('voyage_legs',):
+        _revision_update_trigger(cursor, table)
+
+
+def _vessel_tracks_bucket_index(cursor):
+    # PositionStore.wakes reads the recent buckets of every vessel at one resolution
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_vessel_tracks_bucket ON vessel_tracks(resolution, bucket)')
+
+
+def _sea_distance_coordinates(cursor):
+    # Port coordinates the stored distances were routed from, so a moved port's cells can be reset (float64, n x 2)
+    cursor.execute('ALTER TABLE sea_distance_matrix ADD COLUMN coordinates BLOB')
+
+
+def _voyage_container_ids(cursor):
+    # Imports key voyages by container alone; webhook posts of that container find them through this column
+    cursor.execute('ALTER TABLE voyages ADD COLUMN container_id TEXT')
+    cursor.execute('SELECT id, shipment_key FROM voyages WHERE shipment_key IS NOT NULL')
+    cursor.executemany('UPDATE voyages SET container_id = ? WHERE id = ?',
+                       [(key.rsplit('/', 1)[1], voyage_id) for voyage_id, key in cursor.fetchall() if key.rsplit('/', 1)[1]])
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_voyages_container_id ON voyages(container_id)')
+    _revision_update_trigger(cursor, 'voyages')
+
+
+# Append only: the position in this list is the schema version a migration produces
+MIGRATIONS = [
+    _baseline,
+    _name_keys_and_indexes,
+    _sea_route_cache,
+    _dashboard_layer_cache,
+    _data_revision,
+    _voyage_legs,
+    _vessel_positions,
+    _import_checkpoints,
+    _voyage_shipment_keys,
+    _port_locodes,
+    _sea_distances_and_etas,
+    _spatial_index,
+    _exact_port_locodes,
+    _revision_on_change,
+    _vessel_tracks_bucket_index,
+    _sea_distance_coordinates,
+    _voyage_container_ids,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def get_data_revision(conn):
+    """Counter that changes whenever ports, vessels, routes or voyages are written."""
+    return conn.execute('SELECT revision FROM data_revision WHERE id = 1').fetchone()[0]
+
+
+def get_schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn):
+    """Applies all pending migrations. Returns the resulting schema version."""
+    version = get_schema_version(conn)
+    if conn.in_transaction:
+        conn.commit()
+    for target, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            # Another process may have migrated while we waited for the write lock
+            if get_schema_version(conn) >= target:
+                conn.rollback()
+                continue
+            migration(cursor)
+            cursor.execute(f'PRAGMA user_version = {target}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return get_schema_version(conn)
+
+
+_migrated_paths = set()
+_migrate_lock = threading.Lock()
+
+
+def ensure_schema(db_path=None):
+    """Migrates a database file once per process."""
+    db_path = db_path or db.get_db_path()
+    if db_path in _migrated_paths:
+        return
+    with _migrate_lock:
+        if db_path in _migrated_paths:
+            return
+        conn = db.connect(db_path)
+        try:
+            migrate(conn)
+        finally:
+            conn.close()
+        _migrated_paths.add(db_path)
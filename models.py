@@ -1,16 +1,32 @@
+import json
+import sys
+from logs import get_logger, event, WARNING
+
+log = get_logger('models')
+
+def _coords(location):
+    """Locations are stored as (lat, lon) tuples."""
+    return tuple(location) if location is not None else None
+
 class Vessel:
+    __slots__ = ('name', 'current_location', 'status')
+
     def __init__(self, name, current_location, status='on_time'):
         self.name = name
-        self.current_location = current_location
+        self.current_location = _coords(current_location)
         self.status = status
 
 class Port:
+    __slots__ = ('name', 'location', 'status')
+
     def __init__(self, name, location, status='normal'):
         self.name = name
-        self.location = location
+        self.location = _coords(location)
         self.status = status
 
 class ShippingRoute:
+    __slots__ = ('name', 'color', 'origin_port', 'destination_port')
+
     def __init__(self, name, color, origin_port, destination_port):
         self.name = name
         self.color = color
@@ -18,10 +34,46 @@ class ShippingRoute:
         self.destination_port = destination_port
 
 class Voyage:
-    def __init__(self, route, vessel, departure_date, arrival_date, status='scheduled', transshipment_ports=None):
+    __slots__ = ('id', 'route', 'vessel', 'departure_date', 'arrival_date', 'status',
+                 '_legs_json', '_legs', '_transshipment_ports')
+
+    def __init__(self, route, vessel, departure_date, arrival_date, status='scheduled', transshipment_ports=None, id=None,
+                 legs_json=None):
+        self.id = id
         self.route = route
         self.vessel = vessel
         self.departure_date = departure_date
         self.arrival_date = arrival_date
         self.status = status
-        self.transshipment_ports = transshipment_ports if transshipment_ports is not None else []
+        # With legs_json the stored legs are only decoded when first accessed
+        self._legs_json = legs_json
+        self._legs = None
+        self._transshipment_ports = transshipment_ports if transshipment_ports is not None or legs_json is not None else []
+
+    @property
+    def legs(self):
+        """Full port sequence as stored (origin, transshipments, destination)."""
+        if self._legs is None:
+            self._legs = decode_legs(self._legs_json)
+            self._legs_json = None
+        return self._legs
+
+    @property
+    def transshipment_ports(self):
+        if self._transshipment_ports is None:
+            legs = self.legs
+            self._transshipment_ports = legs[1:-1] if len(legs) > 2 else []
+        return self._transshipment_ports
+
+    @transshipment_ports.setter
+    def transshipment_ports(self, ports):
+        self._transshipment_ports = ports
+
+def decode_legs(legs_json):
+    """Decodes a stored legs list; port names are interned since the same few recur across voyages."""
+    try:
+        legs = json.loads(legs_json) if legs_json else []
+        return [sys.intern(name) if isinstance(name, str) else name for name in legs]
+    except Exception as e:
+        event(log, WARNING, 'legs_decode_failed', error=e)
+        return []
@@ -0,0 +1,222 @@
+"""
+Parser for JSON:API shipment webhook payloads.
+The `included` list is indexed once by (type, id) and relationships are resolved
+through that index, so parsing is linear in the payload size.
+"""
+import hashlib
+import json
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+
+class PayloadError(ValueError):
+    pass
+
+
+@dataclass
+class ShipmentRecord:
+    shipment_id: Optional[str]
+    origin: str
+    discharge: str
+    destination: str
+    legs: List[str]
+    vessel_name: str
+    vessel_position: Optional[Tuple[float, float]] = None
+    departure_date: Optional[str] = None
+    arrival_date: Optional[str] = None
+    container_id: Optional[str] = None
+    attributes: Dict = field(default_factory=dict, repr=False)
+    # Earliest transport event timestamp per port name
+    leg_times: Dict[str, str] = field(default_factory=dict, repr=False)
+
+
+class IncludedIndex:
+    """Single pass over `included`: items by (type, id) and by type, in payload order."""
+    def __init__(self, included):
+        self.by_key = {}
+        self.by_type = {}
+        self.position = {}
+        for i, item in enumerate(included):
+            key = (item['type'], item.get('id'))
+            self.by_key[key] = item
+            self.position[key] = i
+            self.by_type.setdefault(key[0], []).append(item)
+
+    def get(self, item_type, item_id):
+        return self.by_key.get((item_type, item_id))
+
+    def first(self, item_type):
+        items = self.by_type.get(item_type)
+        return items[0] if items else None
+
+    def all(self, item_type):
+        return self.by_type.get(item_type, [])
+
+
+def _included(payload):
+    if isinstance(payload, dict):
+        return payload.get('included', [])
+    return []
+
+
+def _relationship_ids(item, name):
+    data = item.get('relationships', {}).get(name, {}).get('data')
+    if not data:
+        return []
+    if isinstance(data, dict):
+        data = [data]
+    return [ref['id'] for ref in data if 'id' in ref]
+
+
+def _port_names(index):
+    names = {}
+    for port in index.all('port'):
+        if 'attributes' in port and 'name' in port['attributes']:
+            names[port.get('id')] = port['attributes']['name']
+    return names
+
+
+def _event_ports(index, port_names):
+    """(port name, timestamp) of the first container's transport events, ordered by timestamp."""
+    container = index.first('container')
+    if not container or 'transport_events' not in container.get('relationships', {}):
+        return []
+    keys = {('transport_event', event_id) for event_id in _relationship_ids(container, 'transport_events')}
+    by_key = index.by_key
+    position = index.position
+    ordered = []
+    for key in keys:
+        event = by_key.get(key)
+        if event is not None:
+            # Ties on timestamp keep payload order
+            ordered.append(((event.get('attributes') or {}).get('timestamp') or '', position[key], event))
+    ordered.sort(key=lambda entry: entry[:2])
+    events = []
+    for timestamp, _, event in ordered:
+        location = (event.get('relationships') or {}).get('location') or {}
+        data = location.get('data')
+        if isinstance(data, list):
+            data = data[0] if data else None
+        port_id = data.get('id') if data else None
+        if port_id and port_id in port_names:
+            events.append((port_names[port_id], timestamp or None))
+    return events
+
+
+def compose_legs(origin, discharge, destination, event_ports, other_ports):
+    """origin + transshipments (from events, then any other ports) + port of discharge + final destination"""
+    full_legs = [origin]
+    seen = {origin}
+    for name in event_ports + other_ports:
+        if name not in seen and name != discharge:
+            full_legs.append(name)
+            seen.add(name)
+    if discharge not in seen:
+        full_legs.append(discharge)
+        seen.add(discharge)
+    if destination and destination not in seen:
+        full_legs.append(destination)
+    return full_legs
+
+
+def shipment_key(record):
+    """The carrier's identity of a shipment: shipment id and container id. None when the payload has neither."""
+    if record.shipment_id is None and record.container_id is None:
+        return None
+    return f"{record.shipment_id or ''}/{record.container_id or ''}"
+
+
+def _in_chunks(values, size=500):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def stored_shipments(cursor, records):
+    """
+    {index: (voyage id, payload_hash)} for the records whose shipment is already stored.
+    A record matches the voyage with its shipment_key; failing that, it matches a voyage of the
+    same container when one side has no shipment id (a CSV import keyed '/<container>' and a
+    webhook post keyed '<shipment>/<container>'). Among several such voyages the newest wins.
+    """
+    keys = [shipment_key(record) for record in records]
+    by_key = {}
+    for chunk in _in_chunks({key for key in keys if key is not None}):
+        cursor.execute(f'SELECT shipment_key, id, payload_hash FROM voyages WHERE shipment_key IN ({",".join("?" * len(chunk))})',
+                       chunk)
+        by_key.update((row[0], (row[1], row[2])) for row in cursor.fetchall())
+    found = {i: by_key[key] for i, key in enumerate(keys) if key in by_key}
+    containers = {record.container_id for i, record in enumerate(records) if i not in found and record.container_id}
+    by_container = {}
+    for chunk in _in_chunks(containers):
+        cursor.execute(f'''SELECT container_id, shipment_key, id, payload_hash FROM voyages
+                           WHERE container_id IN ({",".join("?" * len(chunk))}) ORDER BY id''', chunk)
+        for container, key, voyage_id, payload_hash in cursor.fetchall():
+            by_container.setdefault(container, []).append((key, voyage_id, payload_hash))
+    for i, record in enumerate(records):
+        if i in found or not record.container_id:
+            continue
+        candidates = by_container.get(record.container_id, [])
+        if record.shipment_id is not None:
+            # Only a voyage stored without a shipment id can be this shipment's container
+            candidates = [c for c in candidates if c[0] == f'/{record.container_id}']
+        if candidates:
+            found[i] = candidates[-1][1:]
+    return found
+
+
+def content_hash(record):
+    """Hash of the fields a stored voyage is built from, so reposts that change nothing else hash the same."""
+    content = [record.origin, record.destination, record.legs, record.vessel_name,
+               record.departure_date, record.arrival_date, sorted(record.leg_times.items())]
+    return hashlib.sha256(json.dumps(content, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+
+def parse_shipment_payload(payload):
+    """Returns a ShipmentRecord or raises PayloadError."""
+    try:
+        index = IncludedIndex(_included(payload))
+    except (KeyError, TypeError, AttributeError):
+        raise PayloadError('Malformed payload')
+    shipment = index.first('shipment')
+    if not shipment:
+        raise PayloadError('No shipment data found')
+    attrs = shipment.get('attributes') or {}
+    origin = attrs.get('port_of_lading_name')
+    discharge = attrs.get('port_of_discharge_name')
+    vessel_name = attrs.get('pod_vessel_name')
+    if not all([origin, discharge, vessel_name]):
+        raise PayloadError('Missing required fields')
+    port_names = _port_names(index)
+    events = _event_ports(index, port_names)
+    event_ports = [name for name, _ in events]
+    leg_times = {}
+    for name, timestamp in events:
+        if timestamp:
+            leg_times.setdefault(name, timestamp)
+    other_ports = [p['attributes']['name'] for p in index.all('port') if 'attributes' in p and 'name' in p['attributes']]
+    legs = compose_legs(origin, discharge, attrs.get('destination_name'), event_ports, other_ports)
+    vessel_position = None
+    for vessel in index.all('vessel'):
+        vessel_attrs = vessel.get('attributes')
+        if vessel_attrs and vessel_attrs.get('name') == vessel_name:
+            lat, lon = vessel_attrs.get('latitude'), vessel_attrs.get('longitude')
+            if lat is not None and lon is not None:
+                vessel_position = (lat, lon)
+            break
+    container = index.first('container')
+    return ShipmentRecord(
+        shipment_id=shipment.get('id'),
+        origin=origin,
+        discharge=discharge,
+        # The last leg is the true destination for the route
+        destination=legs[-1],
+        legs=legs,
+        vessel_name=vessel_name,
+        vessel_position=vessel_position,
+        departure_date=attrs.get('pol_atd_at'),
+        arrival_date=attrs.get('pod_eta_at'),
+        container_id=container.get('id') if container else None,
+        attributes=attrs,
+        leg_times=leg_times,
+    )
@@ -0,0 +1,88 @@
+"""
+Post-processing for leg paths before they are written into the map.
+Paths are [[lat, lon], ...] lists whose longitudes are already unwrapped (they may
+leave [-180, 180] to stay continuous across the antimeridian). Both steps work on
+those values as they are, so the unwrapping survives.
+"""
+import json
+
+# Degrees; 0.01 is roughly 1 km, well below what is visible at fleet zoom levels
+SIMPLIFY_TOLERANCE = 0.01
+# Decimal places; 4 is roughly 11 m
+COORDINATE_PRECISION = 4
+
+
+def _segment_distance_sq(point, start, end):
+    """Squared planar distance from point to the segment start-end."""
+    dy = end[0] - start[0]
+    dx = end[1] - start[1]
+    if dx == 0 and dy == 0:
+        py, px = point[0] - start[0], point[1] - start[1]
+        return py * py + px * px
+    t = ((point[0] - start[0]) * dy + (point[1] - start[1]) * dx) / (dx * dx + dy * dy)
+    t = max(0.0, min(1.0, t))
+    py = point[0] - (start[0] + t * dy)
+    px = point[1] - (start[1] + t * dx)
+    return py * py + px * px
+
+
+def simplify_path(path, tolerance=SIMPLIFY_TOLERANCE):
+    """Douglas-Peucker simplification. The first and last points are always kept."""
+    if not tolerance or len(path) < 3:
+        return [list(p) for p in path]
+    tolerance_sq = tolerance * tolerance
+    keep = [False] * len(path)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(path) - 1)]
+    while stack:
+        first, last = stack.pop()
+        max_dist = 0.0
+        index = None
+        for i in range(first + 1, last):
+            dist = _segment_distance_sq(path[i], path[first], path[last])
+            if dist > max_dist:
+                max_dist = dist
+                index = i
+        if index is not None and max_dist > tolerance_sq:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return [list(p) for p, kept in zip(path, keep) if kept]
+
+
+def quantize_path(path, precision=COORDINATE_PRECISION):
+    """Rounds coordinates and drops points that become duplicates of their predecessor."""
+    if precision is None:
+        return [list(p) for p in path]
+    quantized = []
+    for lat, lon in path:
+        point = [round(lat, precision), round(lon, precision)]
+        if not quantized or quantized[-1] != point:
+            quantized.append(point)
+    if len(quantized) == 1 and len(path) > 1:
+        quantized.append(list(quantized[0]))
+    return quantized
+
+
+class PathPostProcessor:
+    """Simplifies and quantizes paths and keeps before/after vertex and byte counts."""
+    def __init__(self, tolerance=SIMPLIFY_TOLERANCE, precision=COORDINATE_PRECISION):
+        self.tolerance = tolerance
+        self.precision = precision
+        self.vertices_before = 0
+        self.vertices_after = 0
+        self.bytes_before = 0
+        self.bytes_after = 0
+
+    def process(self, path):
+        result = quantize_path(simplify_path(path, self.tolerance), self.precision)
+        self.vertices_before += len(path)
+        self.vertices_after += len(result)
+        self.bytes_before += len(json.dumps(path))
+        self.bytes_after += len(json.dumps(result))
+        return result
+
+    def summary(self):
+        saved = 1 - self.bytes_after / self.bytes_before if self.bytes_before else 0.0
+        return (f"{self.vertices_before} -> {self.vertices_after} vertices, "
+                f"{self.bytes_before} -> {self.bytes_after} coordinate bytes ({saved:.0%} smaller)")
@@ -0,0 +1,292 @@
+"""
+Vessel position reports (AIS-style) and their downsampled tracks.
+Reports are appended to vessel_positions with bulk inserts. The same batch is folded
+into vessel_tracks, which keeps the latest report of every 1 min / 1 h / 1 day bucket
+per vessel, grows the vessel's spatial track boxes (see spatial.update_track_boxes) and
+moves vessels.current_* to each vessel's newest report. Wakes are read from the tracks,
+so drawing them never touches the raw points.
+"""
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Optional
+import db
+from geocoding import normalize_place_name
+from json_stream import MalformedLine
+from migrations import ensure_schema
+from spatial import update_track_boxes
+
+# Bucket width in seconds of each downsampled track
+RESOLUTIONS = {'1m': 60, '1h': 3600, '1d': 86400}
+# Reports written per transaction by ingest_stream
+INGEST_CHUNK = 5000
+# Buckets per vessel drawn as a wake on the maps
+WAKE_RESOLUTION = '1h'
+WAKE_POINTS = 48
+
+
+class PositionError(ValueError):
+    pass
+
+
+@dataclass
+class PositionReport:
+    vessel_name: Optional[str]
+    mmsi: Optional[int]
+    # Epoch seconds (UTC)
+    timestamp: int
+    latitude: float
+    longitude: float
+    # Speed over ground in knots and course over ground in degrees, when reported
+    speed: Optional[float] = None
+    course: Optional[float] = None
+
+
+def parse_timestamp(value):
+    """ISO 8601 string (naive means UTC) or epoch seconds -> int epoch seconds."""
+    if isinstance(value, bool):
+        raise PositionError(f'Invalid timestamp: {value!r}')
+    if isinstance(value, (int, float)):
+        return int(value)
+    if not isinstance(value, str):
+        raise PositionError(f'Invalid timestamp: {value!r}')
+    try:
+        moment = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise PositionError(f'Invalid timestamp: {value!r}')
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp())
+
+
+def _number(item, *names, required=True):
+    for name in names:
+        value = item.get(name)
+        if value is not None:
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise PositionError(f'{name} must be a number')
+            return float(value)
+    if required:
+        raise PositionError(f'Missing {names[0]}')
+    return None
+
+
+def parse_position_report(item):
+    """
+    One report: {"mmsi": 235000000, "vessel": "NAME", "lat": .., "lon": .., "timestamp": ..,
+    "sog": .., "cog": ..}. At least one of mmsi and vessel is required; latitude/longitude
+    and speed/course are accepted as long names too. Raises PositionError.
+    """
+    if not isinstance(item, dict):
+        raise PositionError('Position report must be an object')
+    mmsi = item.get('mmsi')
+    if mmsi is not None:
+        try:
+            mmsi = int(mmsi)
+        except (TypeError, ValueError):
+            raise PositionError(f'Invalid mmsi: {mmsi!r}')
+    name = item.get('vessel')
+    if name is not None and (not isinstance(name, str) or not name.strip()):
+        raise PositionError('vessel must be a non-empty string')
+    if mmsi is None and name is None:
+        raise PositionError('Missing vessel or mmsi')
+    if 'timestamp' not in item:
+        raise PositionError('Missing timestamp')
+    lat = _number(item, 'lat', 'latitude')
+    lon = _number(item, 'lon', 'longitude')
+    if not -90 <= lat <= 90 or not -180 <= lon <= 180:
+        raise PositionError(f'Position out of range: {lat}, {lon}')
+    return PositionReport(name, mmsi, parse_timestamp(item['timestamp']), lat, lon,
+                          _number(item, 'sog', 'speed', required=False),
+                          _number(item, 'cog', 'course', required=False))
+
+
+def _in_chunks(values, size=500):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def downsample(rows, width):
+    """
+    Latest row per (vessel_id, bucket) of width seconds, for rows of
+    (vessel_id, ts, lat, lon, speed, course). Returns track rows.
+    """
+    latest = {}
+    for row in rows:
+        key = (row[0], row[1] - row[1] % width)
+        kept = latest.get(key)
+        if kept is None or row[1] > kept[1]:
+            latest[key] = row
+    return [(vessel_id, width, bucket) + row[1:] for (vessel_id, bucket), row in latest.items()]
+
+
+class PositionStore:
+    def __init__(self, db_path=None):
+        self.db_path = db_path
+
+    def _connection(self):
+        ensure_schema(self.db_path)
+        # Commits on its own, so it never shares a connection with a caller's transaction
+        return db.get_connection(self.db_path, pool='positions')
+
+    def ingest(self, reports):
+        """Writes a list of PositionReports in one transaction. Returns the number of new positions."""
+        if not reports:
+            return 0
+        conn = self._connection()
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            vessel_ids = self._resolve_vessels(cursor, reports)
+            rows = [(vessel_ids[i], r.timestamp, r.latitude, r.longitude, r.speed, r.course)
+                    for i, r in enumerate(reports)]
+            before = conn.total_changes
+            cursor.executemany('''INSERT OR IGNORE INTO vessel_positions
+                                  (vessel_id, ts, latitude, longitude, speed, course) VALUES (?, ?, ?, ?, ?, ?)''', rows)
+            added = conn.total_changes - before
+            for width in RESOLUTIONS.values():
+                # Re-sending a report changes nothing: a bucket only moves to a newer point
+                cursor.executemany('''INSERT INTO vessel_tracks (vessel_id, resolution, bucket, ts, latitude, longitude, speed, course)
+                                      VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                                      ON CONFLICT (vessel_id, resolution, bucket) DO UPDATE SET
+                                          ts = excluded.ts, latitude = excluded.latitude, longitude = excluded.longitude,
+                                          speed = excluded.speed, course = excluded.course
+                                      WHERE excluded.ts > vessel_tracks.ts''', downsample(rows, width))
+            update_track_boxes(cursor, rows)
+            newest = {}
+            for row in rows:
+                if row[0] not in newest or row[1] > newest[row[0]][1]:
+                    newest[row[0]] = row
+            cursor.executemany('''UPDATE vessels SET current_latitude = ?, current_longitude = ?, position_time = ?
+                                  WHERE id = ? AND (position_time IS NULL OR position_time < ?)''',
+                               [(lat, lon, ts, vessel_id, ts) for vessel_id, ts, lat, lon, _, _ in newest.values()])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return added
+
+    def _resolve_vessels(self, cursor, reports):
+        """Vessel id per report, matched by MMSI, then by name; unknown vessels are created."""
+        mmsis = {r.mmsi for r in reports if r.mmsi is not None}
+        names = {normalize_place_name(r.vessel_name): r.vessel_name for r in reports if r.vessel_name}
+        by_mmsi = {}
+        by_name = {}
+        for chunk in _in_chunks(mmsis):
+            cursor.execute(f'SELECT mmsi, id FROM vessels WHERE mmsi IN ({",".join("?" * len(chunk))})', chunk)
+            by_mmsi.update(cursor.fetchall())
+        for chunk in _in_chunks(names):
+            cursor.execute(f'SELECT name_key, id FROM vessels WHERE name_key IN ({",".join("?" * len(chunk))})', chunk)
+            by_name.update(cursor.fetchall())
+        ids = []
+        for report in reports:
+            key = normalize_place_name(report.vessel_name) if report.vessel_name else None
+            vessel_id = by_mmsi.get(report.mmsi)
+            if vessel_id is None:
+                vessel_id = by_name.get(key)
+                if vessel_id is None:
+                    name = report.vessel_name or f'MMSI {report.mmsi}'
+                    key = key or normalize_place_name(name)
+                    cursor.execute('''INSERT INTO vessels (name, name_key, current_latitude, current_longitude) VALUES (?, ?, ?, ?)
+                                      ON CONFLICT(name_key) DO UPDATE SET name_key = excluded.name_key
+                                      RETURNING id''',
+                                   (name, key, report.latitude, report.longitude))
+                    vessel_id = by_name[key] = cursor.fetchone()[0]
+                if report.mmsi is not None:
+                    cursor.execute('UPDATE vessels SET mmsi = ? WHERE id = ? AND mmsi IS NULL', (report.mmsi, vessel_id))
+                    by_mmsi[report.mmsi] = vessel_id
+            ids.append(vessel_id)
+        return ids
+
+    def ingest_stream(self, items, chunk_size=INGEST_CHUNK):
+        """
+        Parses and stores an iterable of raw report dicts, committing every chunk_size reports.
+        Returns (stored, duplicates, errors) with errors as [{'index', 'error'}].
+        """
+        stored = duplicates = 0
+        errors = []
+        chunk = []
+        for index, item in enumerate(items):
+            if isinstance(item, MalformedLine):
+                errors.append({'index': index, 'error': f'Invalid JSON: {item.error}'})
+                continue
+            try:
+                chunk.append(parse_position_report(item))
+            except PositionError as e:
+                errors.append({'index': index, 'error': str(e)})
+            if len(chunk) >= chunk_size:
+                added = self.ingest(chunk)
+                stored += added
+                duplicates += len(chunk) - added
+                chunk = []
+        if chunk:
+            added = self.ingest(chunk)
+            stored += added
+            duplicates += len(chunk) - added
+        return stored, duplicates, errors
+
+    def vessel_id(self, name):
+        row = self._connection().execute('SELECT id FROM vessels WHERE name_key = ?',
+                                         (normalize_place_name(name),)).fetchone()
+        return row[0] if row else None
+
+    def track(self, vessel_id, resolution=WAKE_RESOLUTION, since=None, until=None):
+        """
+        [(ts, lat, lon, speed, course)] of one vessel in time order. resolution is a key of
+        RESOLUTIONS or 'raw' for the stored reports; since/until are inclusive epoch seconds.
+        """
+        if resolution == 'raw':
+            sql = 'SELECT ts, latitude, longitude, speed, course FROM vessel_positions WHERE vessel_id = ?'
+            params = [vessel_id]
+        elif resolution in RESOLUTIONS:
+            sql = 'SELECT ts, latitude, longitude, speed, course FROM vessel_tracks WHERE vessel_id = ? AND resolution = ?'
+            params = [vessel_id, RESOLUTIONS[resolution]]
+        else:
+            raise ValueError(f"Unknown resolution: {resolution} (use raw, {', '.join(RESOLUTIONS)})")
+        if since is not None:
+            sql += ' AND ts >= ?'
+            params.append(since)
+        if until is not None:
+            sql += ' AND ts <= ?'
+            params.append(until)
+        conn = self._connection()
+        rows = conn.execute(sql + ' ORDER BY ts', params).fetchall()
+        conn.commit()
+        return rows
+
+    def wakes(self, resolution=WAKE_RESOLUTION, points=WAKE_POINTS, now=None):
+        """
+        {vessel name: [(lat, lon), ...]} with each vessel's buckets among the last `points` up to
+        now (epoch seconds, default the current time), oldest first. Vessels silent for longer have no wake.
+        """
+        width = RESOLUTIONS[resolution]
+        now = int(time.time() if now is None else now)
+        # Only the window's buckets are read (idx_vessel_tracks_bucket), not every vessel's whole history
+        since = now - now % width - (points - 1) * width
+        conn = self._connection()
+        rows = conn.execute('''
+            SELECT ve.name, t.latitude, t.longitude FROM (
+                SELECT vessel_id, bucket, latitude, longitude,
+                       ROW_NUMBER() OVER (PARTITION BY vessel_id ORDER BY bucket DESC) AS age
+                FROM vessel_tracks WHERE resolution = ? AND bucket >= ?
+            ) t
+            JOIN vessels ve ON ve.id = t.vessel_id
+            WHERE t.age <= ? ORDER BY t.vessel_id, t.bucket
+        ''', (width, since, points)).fetchall()
+        conn.commit()
+        wakes = {}
+        for name, lat, lon in rows:
+            wakes.setdefault(name, []).append((lat, lon))
+        return wakes
+
+
+def unwrap_track(points):
+    """Shifts longitudes by whole turns so consecutive points are never more than 180° apart."""
+    unwrapped = []
+    for lat, lon in points:
+        if unwrapped:
+            previous = unwrapped[-1][1]
+            lon += round((previous - lon) / 360) * 360
+        unwrapped.append((lat, lon))
+    return unwrapped
@@ -0,0 +1,182 @@
+"""
+Memoized sea-route geometry.
+searoute results are keyed by quantized (start, end) coordinates and kept in
+memory plus the sea_route_cache table, so the same port pair is only routed once
+across dashboard runs. Usage: python route_cache.py [--all-pairs]
+"""
+import json
+import sqlite3
+import sys
+import threading
+import time
+import searoute as sr
+import db
+import metrics
+from logs import get_logger, event, WARNING
+from migrations import ensure_schema
+
+log = get_logger('route_cache')
+LOOKUPS = metrics.counter('sea_route_lookups_total', 'Sea route lookups by cache tier', ('result',))
+SEAROUTE_SECONDS = metrics.timer('searoute_seconds', 'Time spent computing sea routes with searoute')
+
+# 3 decimals is ~110 m; searoute snaps endpoints to its network anyway
+PRECISION = 3
+
+
+def route_key(start, end, precision=PRECISION):
+    """start/end are [lon, lat] pairs, as passed to searoute."""
+    return ','.join(f'{round(v, precision):.{precision}f}' for v in (start[0], start[1], end[0], end[1]))
+
+
+class SeaRouteCache:
+    def __init__(self, db_path=None, precision=PRECISION):
+        self.db_path = db_path
+        self.precision = precision
+        self._memory = {}
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _connect(self):
+        ensure_schema(self.db_path)
+        return db.get_connection(self.db_path, pool='route_cache')
+
+    def get(self, start, end):
+        """
+        Returns (coordinates, length_km) for the sea route from start to end ([lon, lat] each),
+        computing it with searoute only on a cache miss.
+        """
+        key = route_key(start, end, self.precision)
+        cached = self._memory.get(key)
+        if cached is not None:
+            self.memory_hits += 1
+            LOOKUPS.inc(result='memory')
+            return cached
+        row = self._connect().execute('SELECT path, length_km FROM sea_route_cache WHERE key = ?', (key,)).fetchone()
+        if row:
+            self.disk_hits += 1
+            LOOKUPS.inc(result='disk')
+            cached = (json.loads(row[0]), row[1])
+            with self._lock:
+                self._memory[key] = cached
+            return cached
+        self.misses += 1
+        LOOKUPS.inc(result='miss')
+        with SEAROUTE_SECONDS.time():
+            route = sr.searoute(start, end, units="km")
+        cached = (route['geometry']['coordinates'], route['properties'].get('length'))
+        self._store([(key, cached)])
+        return cached
+
+    def _store(self, entries):
+        with self._lock:
+            for key, value in entries:
+                self._memory[key] = value
+        conn = self._connect()
+        try:
+            conn.executemany(
+                'INSERT OR REPLACE INTO sea_route_cache (key, path, length_km, created_at) VALUES (?, ?, ?, ?)',
+                [(key, json.dumps(path, separators=(',', ':')), length, time.time()) for key, (path, length) in entries]
+            )
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            event(log, WARNING, 'sea_route_cache_write_failed', error=e)
+
+    def warm(self, chains):
+        """
+        Routes every leg of each chain of [lat, lon] points that is not cached yet and returns
+        the number computed. Like the dashboard, each leg after the first starts where the
+        previous sea path ended; the warmed keys are the ones render_routes looks up only when
+        the chains are in the dashboard's port order (see known_port_chains).
+        """
+        computed = 0
+        for chain in chains:
+            current = chain[0]
+            for target in chain[1:]:
+                before = self.misses
+                try:
+                    path, _ = self.get(normalize_point(current), normalize_point(target))
+                    current = [path[-1][1], path[-1][0]]
+                except Exception as e:
+                    event(log, WARNING, 'sea_route_failed', start=current, end=target, error=e)
+                    current = target
+                computed += self.misses - before
+        return computed
+
+    def counts(self):
+        """(memory_hits, disk_hits, misses) so far."""
+        return self.memory_hits, self.disk_hits, self.misses
+
+    def add_counts(self, memory_hits, disk_hits, misses):
+        """Adds lookups made elsewhere (a worker process's copy of this cache) to the stats."""
+        self.memory_hits += memory_hits
+        self.disk_hits += disk_hits
+        self.misses += misses
+
+    def stats(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            'entries': len(self._memory),
+        }
+
+
+def normalize_point(coords):
+    """[lat, lon] -> [lon, lat] with longitude wrapped into [-180, 180), the form searoute expects."""
+    return [(coords[1] + 180) % 360 - 180, coords[0]]
+
+
+def known_port_chains(db_path=None, all_pairs=False):
+    """
+    Chains of [lat, lon] points worth precomputing: every route's origin/destination and every
+    voyage's ports in the order the dashboard routes them (nearest-neighbour order, vessel
+    position included, see VesselTrackingDashboard.sort_voyages), or with all_pairs every
+    ordered pair of ports.
+    """
+    ensure_schema(db_path)
+    cursor = db.get_connection(db_path).cursor()
+    if all_pairs:
+        cursor.execute('SELECT latitude, longitude FROM ports')
+        coords = sorted(set(cursor.fetchall()))
+        return [[list(a), list(b)] for a in coords for b in coords if a != b]
+    chains = set()
+    cursor.execute('''
+        SELECT op.latitude, op.longitude, dp.latitude, dp.longitude
+        FROM routes r
+        JOIN ports op ON r.origin_port_id = op.id
+        JOIN ports dp ON r.destination_port_id = dp.id
+    ''')
+    for o_lat, o_lon, d_lat, d_lon in cursor.fetchall():
+        chains.add(((o_lat, o_lon), (d_lat, d_lon)))
+    # Imported here because dashboard imports this module
+    from dashboard import VesselTrackingDashboard
+    from service import VesselTrackingService
+    voyages = VesselTrackingService(db_path).get_voyages()
+    for _, coords in VesselTrackingDashboard(workers=1).sort_voyages(voyages):
+        if len(coords) > 1:
+            chains.add(tuple(tuple(point) for point in coords))
+    return [[list(point) for point in chain] for chain in sorted(chains)]
+
+
+_shared_cache = None
+
+
+def get_route_cache():
+    global _shared_cache
+    if _shared_cache is None:
+        _shared_cache = SeaRouteCache()
+    return _shared_cache
+
+
+if __name__ == '__main__':
+    cache = get_route_cache()
+    chains = known_port_chains(all_pairs='--all-pairs' in sys.argv[1:])
+    started = time.time()
+    computed = cache.warm(chains)
+    print(f"Warmed {len(chains)} port chains ({computed} legs computed) in {time.time() - started:.1f}s")
+    print(cache.stats())
@@ -1,40 +1,90 @@
-
 """
 Dynamic route inference for vessel shipping.
 Given a list of ports (as strings), return their coordinates as the route.
 If the final destination is an East Canada port, add Suez Canal as a waypoint between Asia and Canada.
-No hardcoded port logic; works with any port list.
+No hardcoded port logic; works with any port list: regions are decided by coordinates.
+infer_routes() does a whole batch at once: every distinct port name is geocoded once,
+concurrently (the geocoder rate-limits and coalesces the network requests).
 """
-from typing import List, Tuple
-from geopy.geocoders import Nominatim
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+from geocoding import geocode, normalize_place_name
 
-def get_coords(place: str):
-    geolocator = Nominatim(user_agent="route_inference")
-    loc = geolocator.geocode(place)
-    if loc:
-        return (loc.latitude, loc.longitude)
+SUEZ = (30.0, 32.5)
+GEOCODE_WORKERS = 8
+# (region, min lat, max lat, min lon, max lon); a point is in a region if any of its boxes contains it
+REGION_BOXES = [
+    # Persian Gulf and Arabian Sea coasts
+    ('asia', 12.0, 31.0, 43.0, 60.0),
+    # South, Southeast and East Asia
+    ('asia', -11.0, 46.0, 60.0, 146.0),
+    # Quebec, New Brunswick north of Maine, Newfoundland
+    ('east_canada', 45.0, 52.5, -80.0, -52.0),
+    # Nova Scotia and the Bay of Fundy
+    ('east_canada', 43.4, 47.5, -66.3, -59.5),
+]
+
+
+def region_of(coords) -> Optional[str]:
+    """Region a (lat, lon) point falls in, or None."""
+    if not coords:
+        return None
+    lat, lon = coords
+    for region, min_lat, max_lat, min_lon, max_lon in REGION_BOXES:
+        if min_lat <= lat <= max_lat and min_lon <= lon <= max_lon:
+            return region
     return None
 
-def infer_route(port_list: List[str], east_canada_ports=None) -> List[Tuple[float, float]]:
+
+def get_coords(place: str):
+    return geocode(place)
+
+
+def resolve_ports(port_lists, workers=GEOCODE_WORKERS):
+    """{normalized name: coordinates or None} for every distinct port in port_lists, geocoded concurrently."""
+    names = {}
+    for port_list in port_lists:
+        for port in port_list:
+            names.setdefault(normalize_place_name(port), port)
+    if not names:
+        return {}
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(names)))) as pool:
+        return dict(zip(names, pool.map(get_coords, names.values())))
+
+
+def assemble_route(port_list, coords_by_key, east_canada_ports=None) -> List[Tuple[float, float]]:
+    coords = [coords_by_key.get(normalize_place_name(port)) for port in port_list]
     if east_canada_ports is None:
-        east_canada_ports = {'halifax', 'montreal', 'saint john'}
-    suez = (30.0, 32.5)
-    # Get coordinates for all ports
-    coords = [get_coords(port) for port in port_list]
+        to_east_canada = bool(port_list) and region_of(coords[-1]) == 'east_canada'
+    else:
+        to_east_canada = bool(port_list) and port_list[-1].lower() in east_canada_ports
     # If the last port is an East Canada port and the route includes Asia, add Suez Canal after the last Asia port
-    if port_list and port_list[-1].lower() in east_canada_ports:
-        # Find last Asia port index
-        asia_ports = {'singapore', 'haiphong', 'yantian', 'ningbo', 'shanghai', 'busan', 'kaohsiung'}
+    if to_east_canada:
         last_asia_idx = -1
-        for i, port in enumerate(port_list):
-            if port.lower() in asia_ports:
+        for i, point in enumerate(coords):
+            if region_of(point) == 'asia':
                 last_asia_idx = i
         if last_asia_idx != -1:
             # Insert Suez after last Asia port
-            coords = coords[:last_asia_idx+1] + [suez] + coords[last_asia_idx+1:]
+            coords = coords[:last_asia_idx+1] + [SUEZ] + coords[last_asia_idx+1:]
     # Remove any None values (failed geocoding)
     return [c for c in coords if c]
 
+
+def infer_routes(port_lists: List[List[str]], east_canada_ports=None, workers=GEOCODE_WORKERS) -> List[List[Tuple[float, float]]]:
+    """Routes for many port lists, in order; the same as calling infer_route on each, with one geocode per distinct port."""
+    port_lists = [list(port_list) for port_list in port_lists]
+    coords_by_key = resolve_ports(port_lists, workers)
+    return [assemble_route(port_list, coords_by_key, east_canada_ports) for port_list in port_lists]
+
+
+def infer_route(port_list: List[str], east_canada_ports=None) -> List[Tuple[float, float]]:
+    """
+    east_canada_ports: optional set of lower-case names that count as East Canada destinations;
+    by default the destination's coordinates decide.
+    """
+    return infer_routes([port_list], east_canada_ports)[0]
+
 # Example usage
 if __name__ == "__main__":
     route = infer_route(['Haiphong', 'Singapore', 'Halifax'])
@@ -0,0 +1,159 @@
+"""
+Port-to-port sea distances as a dense NumPy matrix.
+Row/column i belongs to port_ids[i]; cells hold the searoute path length in km, inf when
+searoute finds no path and NaN until computed (or when routing failed, so it is tried again).
+The matrix is stored as blobs (int64 port ids, float32 distances, float64 coordinates) in
+sea_distance_matrix, so loading it is one row read. sync() grows it by the ports added
+since it was saved (webhook, importer or dashboard) without touching existing cells, and
+forgets the row and column of a port whose coordinates changed; ensure() computes only
+the cells a caller needs, and fill() all of them.
+Paths come from the sea route cache, so a rebuild only calls searoute for new pairs.
+Usage: python sea_distances.py [--fill]
+"""
+import argparse
+import time
+import numpy as np
+import db
+import logs
+from logs import get_logger, event, INFO, WARNING
+from migrations import ensure_schema
+from route_cache import get_route_cache, normalize_point
+
+log = get_logger('sea_distances')
+
+
+class SeaDistanceMatrix:
+    def __init__(self, db_path=None, route_cache=None):
+        self.db_path = db_path
+        self.route_cache = route_cache or get_route_cache()
+        self.port_ids = np.empty(0, dtype=np.int64)
+        self.coords = np.empty((0, 2), dtype=float)
+        self.distances = np.empty((0, 0), dtype=np.float32)
+        self.index = {}
+        self.computed = 0
+
+    def _connection(self):
+        ensure_schema(self.db_path)
+        return db.get_connection(self.db_path)
+
+    def load(self):
+        """Reads the stored matrix, then adds any ports created since it was saved. Returns self."""
+        conn = self._connection()
+        row = conn.execute('SELECT port_ids, distances, coordinates FROM sea_distance_matrix WHERE id = 1').fetchone()
+        conn.commit()
+        if row:
+            port_ids = np.frombuffer(row[0], dtype=np.int64).copy()
+            size = len(port_ids)
+            self.port_ids = port_ids
+            self.distances = np.frombuffer(row[1], dtype=np.float32).reshape(size, size).copy()
+            self.index = {int(port_id): i for i, port_id in enumerate(port_ids)}
+            # Matrices saved before coordinates were stored can't tell moved ports; their cells are kept
+            self.coords = (np.frombuffer(row[2], dtype=float).reshape(size, 2).copy() if row[2]
+                           else np.full((size, 2), np.nan))
+        self.sync()
+        return self
+
+    def sync(self):
+        """
+        Adds rows and columns for ports missing from the matrix and refreshes port coordinates;
+        a port that moved gets its row and column reset to NaN. Returns the number added.
+        """
+        conn = self._connection()
+        rows = conn.execute('SELECT id, latitude, longitude FROM ports WHERE latitude IS NOT NULL AND longitude IS NOT NULL ORDER BY id').fetchall()
+        conn.commit()
+        new = [row for row in rows if row[0] not in self.index]
+        if new:
+            old_size = len(self.port_ids)
+            size = old_size + len(new)
+            distances = np.full((size, size), np.nan, dtype=np.float32)
+            distances[:old_size, :old_size] = self.distances
+            np.fill_diagonal(distances, 0.0)
+            self.distances = distances
+            self.port_ids = np.concatenate([self.port_ids, np.array([row[0] for row in new], dtype=np.int64)])
+            self.coords = np.concatenate([self.coords, np.full((len(new), 2), np.nan)])
+            for i, row in enumerate(new, start=old_size):
+                self.index[row[0]] = i
+        for port_id, lat, lon in rows:
+            i = self.index[port_id]
+            previous = self.coords[i]
+            if not np.isnan(previous).any() and (previous[0] != lat or previous[1] != lon):
+                self.distances[i, :] = np.nan
+                self.distances[:, i] = np.nan
+                self.distances[i, i] = 0.0
+            self.coords[i] = (lat, lon)
+        return len(new)
+
+    def ensure(self, pairs):
+        """Computes the missing cells among (i, j) index pairs. Returns the number computed."""
+        pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+        if not len(pairs):
+            return 0
+        # Sea distances are treated as symmetric; each unordered pair is routed once
+        pairs = np.unique(np.sort(pairs, axis=1), axis=0)
+        pairs = pairs[np.isnan(self.distances[pairs[:, 0], pairs[:, 1]])]
+        for i, j in pairs:
+            length = self._route_length(i, j)
+            self.distances[i, j] = self.distances[j, i] = length
+        self.computed += len(pairs)
+        return len(pairs)
+
+    def fill(self, progress_every=1000):
+        """Computes every missing cell. Returns the number computed."""
+        upper = np.argwhere(np.triu(np.isnan(self.distances), k=1))
+        started = time.time()
+        for start in range(0, len(upper), progress_every):
+            self.ensure(upper[start:start + progress_every])
+            if len(upper) > progress_every:
+                event(log, INFO, 'sea_distances_progress', routed=min(start + progress_every, len(upper)), pairs=len(upper),
+                      seconds=round(time.time() - started))
+        return len(upper)
+
+    def _route_length(self, i, j):
+        start, end = self.coords[i], self.coords[j]
+        if np.isnan(start).any() or np.isnan(end).any():
+            return np.nan
+        try:
+            _, length = self.route_cache.get(normalize_point(start.tolist()), normalize_point(end.tolist()))
+        except Exception as e:
+            # A failure says nothing about the pair: the cell stays unknown and is tried again
+            event(log, WARNING, 'sea_distance_failed', port_from=int(self.port_ids[i]), port_to=int(self.port_ids[j]), error=e)
+            return np.nan
+        # No sea connection (inland ports)
+        return np.inf if length is None else length
+
+    def save(self):
+        conn = self._connection()
+        try:
+            conn.execute('''INSERT INTO sea_distance_matrix (id, port_ids, distances, coordinates, updated_at) VALUES (1, ?, ?, ?, ?)
+                            ON CONFLICT(id) DO UPDATE SET port_ids = excluded.port_ids, distances = excluded.distances,
+                                coordinates = excluded.coordinates, updated_at = excluded.updated_at''',
+                         (self.port_ids.tobytes(), self.distances.astype(np.float32).tobytes(),
+                          self.coords.astype(float).tobytes(), time.time()))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    def indexes(self, port_ids):
+        """Matrix indexes of port ids; -1 for ports that are not in the matrix."""
+        return np.array([self.index.get(port_id, -1) for port_id in port_ids], dtype=np.int64)
+
+    def stats(self):
+        size = len(self.port_ids)
+        known = int(np.isfinite(self.distances).sum()) - size
+        return {'ports': size, 'pairs_known': known // 2, 'pairs_total': size * (size - 1) // 2,
+                'bytes': self.distances.nbytes + self.port_ids.nbytes}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Update the port-to-port sea distance matrix')
+    parser.add_argument('--fill', action='store_true', help='route every missing port pair (one searoute call per uncached pair)')
+    args = parser.parse_args()
+    logs.configure()
+    matrix = SeaDistanceMatrix().load()
+    if args.fill:
+        matrix.fill()
+    matrix.save()
+    stats = matrix.stats()
+    print(f"[INFO] Sea distance matrix: {stats['ports']} ports, {stats['pairs_known']}/{stats['pairs_total']} pairs known, "
+          f"{stats['bytes'] / 1e6:.1f} MB")
@@ -1,12 +1,67 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g
 from werkzeug.exceptions import HTTPException
-import sqlite3
+from collections import Counter
+from dataclasses import replace
 import json
 import random
-from geopy.geocoders import Nominatim
+import os
+import threading
 import time
+from gazetteer import locode_for
+from geocoding import geocode, geocode_failed, normalize_place_name
+from land_mask import get_land_classifier
+from inbox import ShipmentInbox, InboxWorkerPool
+from json_stream import MalformedLine, iter_batch
+from payload_parser import parse_shipment_payload, PayloadError, shipment_key, stored_shipments, content_hash
+from live_map import MapQuery, get_live_map_data
+from positions import PositionStore, RESOLUTIONS, parse_timestamp
+from migrations import ensure_schema
+from logs import get_logger, event, INFO, WARNING
+import db
+import logs
+import metrics
+import spatial
 
 app = Flask(__name__)
+# ASYNC_INGEST=1 makes the webhook enqueue payloads and return 202; workers do the enrichment
+app.config['ASYNC_INGEST'] = os.environ.get('ASYNC_INGEST', '0') == '1'
+app.config['INGEST_WORKERS'] = int(os.environ.get('INGEST_WORKERS', '4'))
+# A vessel reported on land within this many km of a port is placed at the port; 0 turns snapping off
+app.config['SNAP_TO_PORT_KM'] = float(os.environ.get('SNAP_TO_PORT_KM', '10'))
+inbox = None
+worker_pool = None
+inbox_lock = threading.Lock()
+# Per-item errors listed in a position batch response; the rest are only counted
+MAX_REPORTED_ERRORS = 100
+log = get_logger('server')
+# Werkzeug serves each request on a new thread; requests borrow their connections from here
+request_connections = db.ConnectionPool()
+REQUEST_SECONDS = metrics.timer('http_request_seconds', 'Request handling time by endpoint and status', ('endpoint', 'status'))
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.before_request
+def checkout_connections():
+    request_connections.checkout()
+
+
+@app.teardown_appcontext
+def checkin_connections(exc):
+    request_connections.checkin()
+
+
+@app.after_request
+def record_request_time(response):
+    started = g.get('request_started')
+    if started is not None:
+        REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=request.endpoint or 'unmatched',
+                                status=response.status_code)
+    return response
+
 
 # Global error handler
 @app.errorhandler(Exception)
@@ -15,20 +70,70 @@ def handle_exception(e):
         return jsonify({'error': e.description}), e.code
     # Non-HTTP exceptions
     return jsonify({'error': str(e)}), 500
-geolocator = Nominatim(user_agent="vessel_tracking_app_v1", timeout=10)
+
+def connect_db():
+    ensure_schema()
+    return db.get_connection()
 
 def get_coordinates(port_name):
-    try:
-        time.sleep(1)
-        location = geolocator.geocode(port_name)
-        if location:
-            return location.latitude, location.longitude
-    except Exception as e:
-        print(f"Geocoding error for {port_name}: {e}")
+    coords = geocode(port_name)
+    if coords:
+        return coords
     return None, None
 
+def prefetch_port_coordinates(cursor, port_names):
+    """Geocodes every distinct name that is not yet in the ports table, so later lookups hit the cache."""
+    names = {normalize_place_name(name): name for name in port_names}
+    known = set()
+    keys = list(names)
+    for i in range(0, len(keys), 500):
+        chunk = keys[i:i + 500]
+        cursor.execute(f'SELECT name_key FROM ports WHERE name_key IN ({",".join("?" * len(chunk))})', chunk)
+        known.update(row[0] for row in cursor.fetchall())
+    for key in names.keys() - known:
+        get_coordinates(names[key])
+
+def positions_on_land(records):
+    """Indexes of the records whose reported vessel position is on land, from one batched mask lookup."""
+    located = [i for i, record in enumerate(records) if record.vessel_position]
+    mask = get_land_classifier().classify([records[i].vessel_position for i in located])
+    return {i for i, on_land in zip(located, mask) if on_land}
+
+
+def flag_position_on_land(body, record):
+    event(log, WARNING, 'position_on_land', vessel=record.vessel_name, position=list(record.vessel_position))
+    return dict(body, warning='Reported vessel position is on land')
+
+
+def snap_to_ports(conn, records, on_land):
+    """
+    {index: port} for the on-land positions among records that lie within SNAP_TO_PORT_KM of a port,
+    found through the ports R*Tree: a vessel reported just inland of a port is berthed there.
+    """
+    radius = app.config['SNAP_TO_PORT_KM']
+    if not radius:
+        return {}
+    snapped = {}
+    for i in on_land:
+        lat, lon = records[i].vessel_position
+        ports = spatial.nearest(conn, 'ports', lat, lon, 1, radius)
+        if ports:
+            snapped[i] = ports[0]
+    return snapped
+
+
+def snap_position(record, port):
+    event(log, INFO, 'position_snapped', vessel=record.vessel_name, position=list(record.vessel_position),
+          port=port['name'], distance_km=round(port['distance_km'], 2))
+    return replace(record, vessel_position=(port['latitude'], port['longitude']))
+
+
 def get_or_create_port(cursor, port_name):
-    cursor.execute('SELECT id, latitude, longitude FROM ports WHERE name = ?', (port_name,))
+    name_key = normalize_place_name(port_name)
+    # An alias of a gazetteer port finds the existing row through its LOCODE; guessed matches never merge rows
+    locode = locode_for(port_name)
+    cursor.execute('SELECT id, latitude, longitude FROM ports WHERE name_key = ? OR locode = ? ORDER BY name_key = ? DESC LIMIT 1',
+                   (name_key, locode, name_key))
     port = cursor.fetchone()
     
     if port:
@@ -36,138 +141,381 @@ def get_or_create_port(cursor, port_name):
     
     lat, lon = get_coordinates(port_name)
     if lat and lon:
-        cursor.execute('INSERT INTO ports (name, latitude, longitude) VALUES (?, ?, ?)', (port_name, lat, lon))
-        return cursor.lastrowid, lat, lon
+        # A concurrent writer may have added the port while we geocoded; keep its row
+        cursor.execute('''INSERT INTO ports (name, name_key, locode, latitude, longitude) VALUES (?, ?, ?, ?, ?)
+                          ON CONFLICT(name_key) DO UPDATE SET name_key = excluded.name_key
+                          ON CONFLICT(locode) WHERE locode IS NOT NULL DO UPDATE SET locode = excluded.locode
+                          RETURNING id, latitude, longitude''',
+                       (port_name, name_key, locode, lat, lon))
+        return cursor.fetchone()
     
     return None, None, None
 
 
+def get_or_create_vessel(cursor, vessel_name, lat, lon):
+    """Returns the vessel id; lat/lon only set the position of a newly created vessel."""
+    cursor.execute('''INSERT INTO vessels (name, name_key, current_latitude, current_longitude) VALUES (?, ?, ?, ?)
+                      ON CONFLICT(name_key) DO UPDATE SET name_key = excluded.name_key
+                      RETURNING id''',
+                   (vessel_name, normalize_place_name(vessel_name), lat, lon))
+    return cursor.fetchone()[0]
+
+
 def get_or_create_route(cursor, origin_port_id, dest_port_id, origin_lat, origin_lon, dest_lat, dest_lon, origin_name, dest_name):
-    cursor.execute('SELECT id FROM routes WHERE origin_port_id = ? AND destination_port_id = ?', 
-                   (origin_port_id, dest_port_id))
-    route = cursor.fetchone()
-    if route:
-        return route[0]
-
-    cursor.execute('SELECT id FROM service_lines WHERE name = ?', ('Unassigned',))
-    service_line = cursor.fetchone()
-    if not service_line:
-        cursor.execute('INSERT INTO service_lines (name, region_from, region_to) VALUES (?, ?, ?)', 
-                       ('Unassigned', 'Unknown', 'Unknown'))
-        service_line_id = cursor.lastrowid
-    else:
-        service_line_id = service_line[0]
+    cursor.execute('''INSERT INTO service_lines (name, name_key, region_from, region_to) VALUES (?, ?, ?, ?)
+                      ON CONFLICT(name_key) DO UPDATE SET name_key = excluded.name_key
+                      RETURNING id''',
+                   ('Unassigned', normalize_place_name('Unassigned'), 'Unknown', 'Unknown'))
+    service_line_id = cursor.fetchone()[0]
 
     route_name = f'{origin_name}-{dest_name} Route'
     color = f'#{random.randint(0, 0xFFFFFF):06x}'
     cursor.execute('''INSERT INTO routes (service_line_id, name, color, origin_port_id, destination_port_id) 
-                      VALUES (?, ?, ?, ?, ?)''',
+                      VALUES (?, ?, ?, ?, ?)
+                      ON CONFLICT(origin_port_id, destination_port_id) DO UPDATE SET origin_port_id = excluded.origin_port_id
+                      RETURNING id''',
                    (service_line_id, route_name, color, origin_port_id, dest_port_id))
-    return cursor.lastrowid
+    return cursor.fetchone()[0]
 
-@app.route('/webhook/shipment', methods=['POST'])
-def receive_shipment():
+def parse_shipment(payload):
+    """Returns (ShipmentRecord, error)."""
     try:
-        payload = request.json
-        shipment = None
-        included = []
-        if isinstance(payload, list):
-            for entry in payload:
-                if isinstance(entry, dict) and 'included' in entry:
-                    included.extend(entry['included'])
-        # Always extract shipment and included
-        included = []
-        if isinstance(payload, dict):
-            included = payload.get('included', [])
-        shipment = None
-        for item in included:
-            if item['type'] == 'shipment':
-                shipment = item
-                break
-        if not shipment:
-            return jsonify({'error': 'No shipment data found'}), 400
-        attrs = shipment['attributes']
-        origin_name = attrs.get('port_of_lading_name')
-        dest_name = attrs.get('port_of_discharge_name')
-        vessel_name = attrs.get('pod_vessel_name')
-        departure_date = attrs.get('pol_atd_at')
-        arrival_date = attrs.get('pod_eta_at')
-        if not all([origin_name, dest_name, vessel_name]):
-            return jsonify({'error': 'Missing required fields'}), 400
-        conn = sqlite3.connect('vessel_tracking.db')
-        cursor = conn.cursor()
-        # Compose full legs: origin + transshipments (from events) + port of discharge + final destination
-        port_lookup = {p['id']: p['attributes']['name'] for p in included if p['type'] == 'port' and 'attributes' in p and 'name' in p['attributes']}
-        container = next((item for item in included if item['type'] == 'container'), None)
-        legs = []
-        if container and 'relationships' in container and 'transport_events' in container['relationships']:
-            event_ids = [e['id'] for e in container['relationships']['transport_events']['data'] if 'id' in e]
-            events = [item for item in included if item['type'] == 'transport_event' and item['id'] in event_ids]
-            def get_event_time(ev):
-                return ev.get('attributes', {}).get('timestamp') or ''
-            events.sort(key=get_event_time)
-            for ev in events:
-                port_id = None
-                if 'relationships' in ev and 'location' in ev['relationships'] and ev['relationships']['location']['data']:
-                    port_id = ev['relationships']['location']['data']['id']
-                if port_id and port_id in port_lookup:
-                    legs.append(port_lookup[port_id])
-        # Add any additional ports from included that are not origin or destination and not already in legs
-        for p in included:
-            if p['type'] == 'port' and 'attributes' in p and 'name' in p['attributes']:
-                pname = p['attributes']['name']
-                if pname not in legs and pname not in (origin_name, dest_name):
-                    legs.append(pname)
-        full_legs = []
-        if origin_name:
-            full_legs.append(origin_name)
-        for port in legs:
-            if port not in (origin_name, dest_name) and port not in full_legs:
-                full_legs.append(port)
-        if dest_name and dest_name not in full_legs:
-            full_legs.append(dest_name)
-        destination_name = attrs.get('destination_name')
-        if destination_name and destination_name not in full_legs:
-            full_legs.append(destination_name)
-
-        # Use the last port in full_legs as the true destination for the route
-        true_dest_name = full_legs[-1] if full_legs else dest_name
-        origin_port_id, origin_lat, origin_lon = get_or_create_port(cursor, origin_name)
-        dest_port_id, dest_lat, dest_lon = get_or_create_port(cursor, true_dest_name)
-        if not origin_port_id or not dest_port_id:
-            conn.close()
-            return jsonify({'error': 'Could not geocode ports'}), 400
-        cursor.execute('SELECT id FROM vessels WHERE name = ?', (vessel_name,))
-        vessel = cursor.fetchone()
-        # Find vessel object in included
-        vessel_obj = next((item for item in included if item['type'] == 'vessel' and 'attributes' in item and item['attributes'].get('name') == vessel_name), None)
-        vessel_lat = None
-        vessel_lon = None
-        if vessel_obj:
-            vessel_lat = vessel_obj['attributes'].get('latitude')
-            vessel_lon = vessel_obj['attributes'].get('longitude')
+        return parse_shipment_payload(payload), None
+    except PayloadError as e:
+        return None, str(e)
+
+
+def unchanged_shipments(cursor, records):
+    """Indexes of the records whose shipment is already stored with the same content hash."""
+    stored = stored_shipments(cursor, records)
+    claims = Counter(voyage_id for voyage_id, _ in stored.values())
+    # A shipment posted more than once is left to store_voyage, which applies the posts in order
+    return {i for i, (voyage_id, payload_hash) in stored.items()
+            if claims[voyage_id] == 1 and payload_hash == content_hash(records[i])}
+
+
+def unchanged_body(record):
+    return {'message': 'Voyage unchanged', 'legs': record.legs, 'unchanged': True}
+
+
+def store_voyage(cursor, record, ports=None, vessels=None, routes=None):
+    """
+    Get-or-creates the ports, vessel and route of a parsed record and inserts the voyage,
+    or updates it in place when the shipment is already stored (see payload_parser.stored_shipments).
+    The optional dicts memoize ids across calls so a batch looks each entity up only once.
+    Returns (response_dict, http_status).
+    """
+    ports = {} if ports is None else ports
+    vessels = {} if vessels is None else vessels
+    routes = {} if routes is None else routes
+    key = shipment_key(record)
+    payload_hash = content_hash(record)
+    voyage_id = None
+    stored = stored_shipments(cursor, [record]).get(0)
+    if stored:
+        voyage_id, stored_hash = stored
+        if stored_hash == payload_hash:
+            return unchanged_body(record), 200
+    origin_name = record.origin
+    true_dest_name = record.destination
+    vessel_name = record.vessel_name
+    for name in (origin_name, true_dest_name):
+        if name not in ports or ports[name][0] is None:
+            ports[name] = get_or_create_port(cursor, name)
+    origin_port_id, origin_lat, origin_lon = ports[origin_name]
+    dest_port_id, dest_lat, dest_lon = ports[true_dest_name]
+    if not origin_port_id or not dest_port_id:
+        missing = [name for name, port_id in ((origin_name, origin_port_id), (true_dest_name, dest_port_id)) if not port_id]
+        # Nominatim errors aren't cached: a retry may succeed, unlike a port Nominatim doesn't know
+        if any(geocode_failed(name) for name in missing):
+            return {'error': 'Geocoding is unavailable, try again later'}, 503
+        return {'error': 'Could not geocode ports'}, 400
+    vessel_id = vessels.get(vessel_name)
+    if vessel_id is None:
         # Set vessel's initial location to the vessel's coordinates if available, else origin port's coordinates
-        if not vessel:
-            if vessel_lat is not None and vessel_lon is not None:
-                cursor.execute('INSERT INTO vessels (name, current_latitude, current_longitude) VALUES (?, ?, ?)', 
-                               (vessel_name, vessel_lat, vessel_lon))
-            else:
-                cursor.execute('INSERT INTO vessels (name, current_latitude, current_longitude) VALUES (?, ?, ?)', 
-                               (vessel_name, origin_lat if origin_lat is not None else 0.0, origin_lon if origin_lon is not None else 0.0))
-            vessel_id = cursor.lastrowid
+        if record.vessel_position:
+            vessel_lat, vessel_lon = record.vessel_position
         else:
-            vessel_id = vessel[0]
+            vessel_lat = origin_lat if origin_lat is not None else 0.0
+            vessel_lon = origin_lon if origin_lon is not None else 0.0
+        vessel_id = get_or_create_vessel(cursor, vessel_name, vessel_lat, vessel_lon)
+        vessels[vessel_name] = vessel_id
+    route_id = routes.get((origin_port_id, dest_port_id))
+    if route_id is None:
         route_id = get_or_create_route(cursor, origin_port_id, dest_port_id, 
                                         origin_lat, origin_lon, dest_lat, dest_lon,
                                         origin_name, true_dest_name)
-        # Store the full_legs as before
-        cursor.execute('''INSERT INTO voyages (route_id, vessel_id, departure_date, arrival_date, status, legs) 
-                          VALUES (?, ?, ?, ?, ?, ?)''',
-                       (route_id, vessel_id, departure_date, arrival_date, 'in_transit', json.dumps(full_legs)))
+        routes[(origin_port_id, dest_port_id)] = route_id
+    if voyage_id is not None:
+        # A voyage imported by container alone takes the shipment id of the first post that has one
+        cursor.execute('''UPDATE voyages SET route_id = ?, vessel_id = ?, departure_date = ?, arrival_date = ?, legs = ?,
+                          payload_hash = ?, shipment_key = COALESCE(?, shipment_key), container_id = COALESCE(?, container_id)
+                          WHERE id = ?''',
+                       (route_id, vessel_id, record.departure_date, record.arrival_date, json.dumps(record.legs),
+                        payload_hash, key if record.shipment_id is not None else None, record.container_id, voyage_id))
+        cursor.execute('DELETE FROM voyage_legs WHERE voyage_id = ?', (voyage_id,))
+        store_voyage_legs(cursor, voyage_id, record, ports)
+        return {'message': 'Voyage updated successfully', 'legs': record.legs}, 200
+    # Store the full_legs as before
+    cursor.execute('''INSERT INTO voyages (route_id, vessel_id, departure_date, arrival_date, status, legs, shipment_key, container_id,
+                                           payload_hash)
+                      VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                   (route_id, vessel_id, record.departure_date, record.arrival_date, 'in_transit', json.dumps(record.legs),
+                    key, record.container_id, payload_hash))
+    store_voyage_legs(cursor, cursor.lastrowid, record, ports)
+    return {'message': 'Voyage created successfully', 'legs': record.legs}, 201
+
+
+def store_voyage_legs(cursor, voyage_id, record, ports):
+    """Resolves every leg to a port id once and stores the sequence in voyage_legs; ungeocodable legs are left out."""
+    rows = []
+    for seq, name in enumerate(record.legs):
+        if name not in ports or ports[name][0] is None:
+            ports[name] = get_or_create_port(cursor, name)
+        port_id = ports[name][0]
+        if port_id:
+            rows.append((voyage_id, seq, port_id, record.leg_times.get(name)))
+    cursor.executemany('INSERT INTO voyage_legs (voyage_id, seq, port_id, event_time) VALUES (?, ?, ?, ?)', rows)
+
+
+def ingest_shipment(payload):
+    """Geocodes ports, upserts ports/vessel/route and inserts the voyage. Returns (response_dict, http_status)."""
+    record, error = parse_shipment(payload)
+    if error:
+        return {'error': error}, 400
+    conn = connect_db()
+    try:
+        # An unchanged repost costs one indexed lookup: no port lookups, geocoding or writes
+        if unchanged_shipments(conn.cursor(), [record]):
+            conn.rollback()
+            return unchanged_body(record), 200
+        # Geocode before the write transaction starts so it never holds the write lock over the network
+        prefetch_port_coordinates(conn.cursor(), record.legs)
+        on_land = positions_on_land([record])
+        snapped = snap_to_ports(conn, [record], on_land).get(0)
+        if snapped:
+            record = snap_position(record, snapped)
+        body, status = store_voyage(conn.cursor(), record)
+    except Exception:
+        conn.rollback()
+        raise
+    if status < 400:
+        conn.commit()
+        if snapped:
+            body = dict(body, snapped_to=snapped['name'])
+        elif on_land:
+            body = flag_position_on_land(body, record)
+    else:
+        conn.rollback()
+    return body, status
+
+
+def ingest_batch(payloads):
+    """
+    Stores an iterable of webhook payloads in a single transaction.
+    Payloads are parsed as they stream in; unknown ports are geocoded once per batch,
+    before the write transaction starts. Returns a list of per-item results.
+    """
+    results = []
+    records = []
+    for index, payload in enumerate(payloads):
+        if isinstance(payload, MalformedLine):
+            results.append({'index': index, 'status': 400, 'error': f'Invalid JSON: {payload.error}'})
+            continue
+        try:
+            record, error = parse_shipment(payload)
+        except Exception as e:
+            record, error = None, f'Malformed payload: {e}'
+        if error:
+            results.append({'index': index, 'status': 400, 'error': error})
+        else:
+            records.append((index, record))
+    conn = connect_db()
+    try:
+        cursor = conn.cursor()
+        unchanged = unchanged_shipments(cursor, [record for _, record in records])
+        if unchanged:
+            results.extend({'index': index, 'status': 200, **unchanged_body(record)}
+                           for position, (index, record) in enumerate(records) if position in unchanged)
+            records = [item for position, item in enumerate(records) if position not in unchanged]
+        # Warm the geocoding cache so no network call happens inside the transaction
+        prefetch_port_coordinates(cursor, [name for _, r in records for name in r.legs])
+        on_land = positions_on_land([record for _, record in records])
+        snapped = snap_to_ports(conn, [record for _, record in records], on_land)
+        for position, port in snapped.items():
+            index, record = records[position]
+            records[position] = (index, snap_position(record, port))
+        ports, vessels, routes = {}, {}, {}
+        cursor.execute('BEGIN')
+        for position, (index, record) in enumerate(records):
+            cursor.execute('SAVEPOINT batch_item')
+            try:
+                body, status = store_voyage(cursor, record, ports, vessels, routes)
+            except Exception as e:
+                body, status = {'error': f'Internal error: {str(e)}'}, 500
+            if status < 400:
+                cursor.execute('RELEASE SAVEPOINT batch_item')
+                if position in snapped:
+                    body = dict(body, snapped_to=snapped[position]['name'])
+                elif position in on_land:
+                    body = flag_position_on_land(body, record)
+            else:
+                cursor.execute('ROLLBACK TO SAVEPOINT batch_item')
+                cursor.execute('RELEASE SAVEPOINT batch_item')
+                # Ids memoized by the rolled-back item may no longer exist
+                ports.clear()
+                vessels.clear()
+                routes.clear()
+            results.append({'index': index, 'status': status, **body})
         conn.commit()
-        conn.close()
-        return jsonify({'message': 'Voyage created successfully', 'legs': full_legs}), 201
+    except Exception:
+        conn.rollback()
+        raise
+    results.sort(key=lambda r: r['index'])
+    return results
+
+
+def get_inbox():
+    """The shared inbox; its workers only run when ASYNC_INGEST is on, so reading job status never starts them."""
+    global inbox, worker_pool
+    with inbox_lock:
+        if inbox is None:
+            inbox = ShipmentInbox()
+        if worker_pool is None and app.config['ASYNC_INGEST']:
+            worker_pool = InboxWorkerPool(inbox, ingest_shipment, workers=app.config['INGEST_WORKERS'])
+            worker_pool.start()
+    return inbox
+
+
+@app.route('/webhook/shipment', methods=['POST'])
+def receive_shipment():
+    try:
+        payload = request.json
+        if not app.config['ASYNC_INGEST']:
+            body, status = ingest_shipment(payload)
+            return jsonify(body), status
+        record, error = parse_shipment(payload)
+        if error:
+            return jsonify({'error': error}), 400
+        conn = connect_db()
+        unchanged = unchanged_shipments(conn.cursor(), [record])
+        conn.rollback()
+        if unchanged:
+            return jsonify(unchanged_body(record)), 200
+        job_id = get_inbox().enqueue(payload)
+        worker_pool.notify()
+        return jsonify({'job_id': job_id, 'status': 'queued', 'status_url': f'/webhook/jobs/{job_id}'}), 202
     except Exception as e:
         return jsonify({'error': f'Internal error: {str(e)}'}), 500
+
+
+@app.route('/webhook/shipments:batch', methods=['POST'])
+def receive_shipment_batch():
+    try:
+        results = ingest_batch(iter_batch(request.stream))
+    except ValueError as e:
+        return jsonify({'error': f'Invalid batch body: {str(e)}'}), 400
+    created = sum(1 for r in results if r['status'] == 201)
+    unchanged = sum(1 for r in results if r.get('unchanged'))
+    failed = sum(1 for r in results if r['status'] >= 400)
+    return jsonify({'created': created, 'updated': len(results) - created - unchanged - failed, 'unchanged': unchanged,
+                    'failed': failed, 'results': results}), 200
+
+
+@app.route('/webhook/positions:batch', methods=['POST'])
+def receive_position_batch():
+    """
+    AIS-style position reports as a JSON array or JSONL (see positions.parse_position_report).
+    Reports are committed in chunks as the body streams in; invalid ones are skipped and listed.
+    """
+    try:
+        stored, duplicates, errors = PositionStore().ingest_stream(iter_batch(request.stream))
+    except ValueError as e:
+        return jsonify({'error': f'Invalid batch body: {str(e)}'}), 400
+    return jsonify({'stored': stored, 'duplicates': duplicates, 'rejected': len(errors),
+                    'errors': errors[:MAX_REPORTED_ERRORS]}), 200
+
+
+@app.route('/api/vessels/<name>/track', methods=['GET'])
+def get_vessel_track(name):
+    """
+    A vessel's track as a GeoJSON LineString. resolution is raw, 1m, 1h (default) or 1d;
+    since/until take ISO 8601 times or epoch seconds.
+    """
+    resolution = request.args.get('resolution', '1h')
+    if resolution != 'raw' and resolution not in RESOLUTIONS:
+        return jsonify({'error': f"resolution must be one of raw, {', '.join(RESOLUTIONS)}"}), 400
+    try:
+        since = _time_arg('since')
+        until = _time_arg('until')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    store = PositionStore()
+    vessel_id = store.vessel_id(name)
+    if vessel_id is None:
+        return jsonify({'error': 'Vessel not found'}), 404
+    rows = store.track(vessel_id, resolution, since, until)
+    return jsonify({
+        'type': 'Feature',
+        'geometry': {'type': 'LineString', 'coordinates': [[lon, lat] for _, lat, lon, _, _ in rows]},
+        'properties': {'vessel': name, 'resolution': resolution, 'times': [row[0] for row in rows],
+                       'speeds': [row[3] for row in rows], 'courses': [row[4] for row in rows]},
+    }), 200
+
+
+def _time_arg(name):
+    value = request.args.get(name)
+    if value is None:
+        return None
+    return parse_timestamp(int(value) if value.lstrip('-').isdigit() else value)
+
+
+@app.route('/webhook/jobs/<job_id>', methods=['GET'])
+def get_job_status(job_id):
+    job = get_inbox().get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job), 200
+
+
+@app.route('/api/map.geojson', methods=['GET'])
+def get_map_geojson():
+    """
+    Voyage legs, ports and vessels as GeoJSON. Optional filters: bbox=min_lon,min_lat,max_lon,max_lat,
+    route, status and vessel (comma separated names) and layers (legs,ports,vessels,wakes).
+    """
+    try:
+        query = MapQuery.from_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    map_data = get_live_map_data()
+    revision = map_data.revision()
+    compress = 'gzip' in request.accept_encodings
+    # gzip and identity bodies differ, so they must not share a strong ETag
+    etag = map_data.etag(revision, query) + ('-gz' if compress else '')
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = app.response_class(map_data.response_body(revision, query, compress), mimetype='application/geo+json')
+        if compress:
+            response.headers['Content-Encoding'] = 'gzip'
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+@app.route('/map', methods=['GET'])
+def live_map():
+    return app.send_static_file('live_map.html')
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return app.response_class(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
+    logs.configure()
+    if app.config['ASYNC_INGEST']:
+        get_inbox()
     app.run(debug=True, host='0.0.0.0', port=5002)
\ No newline at end of file
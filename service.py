@@ -1,75 +1,213 @@
-import sqlite3
-import json
+import db
+import spatial
+from geocoding import normalize_place_name
+from logs import get_logger, event, WARNING
+from migrations import ensure_schema
 from models import Vessel, Port, ShippingRoute, Voyage
 
+# Rows fetched from SQLite per round trip while streaming
+FETCH_SIZE = 500
+log = get_logger('service')
+
+
 class VesselTrackingService:
-    def __init__(self, db_path='vessel_tracking.db'):
+    def __init__(self, db_path=None):
         self.db_path = db_path
-    
-    def get_voyages(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
+
+    def get_voyages(self, **filters):
+        """All voyages matching the filters (see iter_voyages), as a list."""
+        return list(self.iter_voyages(**filters))
+
+    def get_voyage_page(self, limit=100, after_id=None, **filters):
+        """
+        One page of voyages ordered by id, plus the cursor for the next page (None on the last page).
+        Pass the returned cursor back as after_id; unlike OFFSET this costs the same on every page.
+        """
+        voyages = list(self.iter_voyages(after_id=after_id, limit=limit, **filters))
+        next_cursor = voyages[-1].id if len(voyages) == limit else None
+        return voyages, next_cursor
+
+    def _spatial_connection(self):
+        ensure_schema(self.db_path)
+        return db.get_connection(self.db_path)
+
+    def ports_in_bbox(self, south, west, north, east):
+        """Ports inside a box as dicts (id, name, latitude, longitude); west > east crosses the antimeridian."""
+        return spatial.in_bbox(self._spatial_connection(), 'ports', south, west, north, east)
+
+    def vessels_in_bbox(self, south, west, north, east):
+        """Vessels whose current position is inside a box, like ports_in_bbox."""
+        return spatial.in_bbox(self._spatial_connection(), 'vessels', south, west, north, east)
+
+    def positions_in_bbox(self, south, west, north, east, since=None, until=None):
+        """Position reports (vessel_id, ts, latitude, longitude) inside a box, optionally within a time window."""
+        return spatial.positions_in_bbox(self._spatial_connection(), south, west, north, east, since, until)
+
+    def ports_within(self, lat, lon, radius_km):
+        """Ports within radius_km of a point, nearest first, with their distance_km."""
+        return spatial.within(self._spatial_connection(), 'ports', lat, lon, radius_km)
+
+    def vessels_within(self, lat, lon, radius_km):
+        return spatial.within(self._spatial_connection(), 'vessels', lat, lon, radius_km)
+
+    def nearest_ports(self, lat, lon, k=1, max_km=None):
+        """The k ports closest to a point, nearest first; none further than max_km if given."""
+        return spatial.nearest(self._spatial_connection(), 'ports', lat, lon, k, max_km)
+
+    def nearest_vessels(self, lat, lon, k=1, max_km=None):
+        return spatial.nearest(self._spatial_connection(), 'vessels', lat, lon, k, max_km)
+
+    def nearest_port(self, lat, lon, max_km):
+        """The closest port within max_km of a point as a dict, or None."""
+        ports = self.nearest_ports(lat, lon, 1, max_km)
+        return ports[0] if ports else None
+
+    def iter_voyages(self, status=None, route=None, vessel=None, port=None, departed_from=None, departed_to=None,
+                     after_id=None, limit=None):
+        """
+        Yields voyages ordered by id as rows are fetched, so memory stays flat however many match.
+        status, route and vessel take a name or a list of names; port matches the origin, the
+        destination or any stored leg; departed_from/departed_to bound departure_date (ISO strings).
+        Each port, route and vessel is built once per call and shared by its voyages (an identity map by id).
+        Transshipment ports come resolved from voyage_legs in the same query; a voyage whose legs
+        are not all in voyage_legs falls back to the port names stored in voyages.legs.
+        """
+        where, params = self._filter_clause(status, route, vessel, port, departed_from, departed_to, after_id)
+        sql = f'''
             SELECT v.id, v.departure_date, v.arrival_date, v.status, v.legs,
                    r.name, r.color,
                    op.name, op.latitude, op.longitude, op.status,
                    dp.name, dp.latitude, dp.longitude, dp.status,
-                   ve.name, ve.current_latitude, ve.current_longitude, ve.status
+                   ve.name, ve.current_latitude, ve.current_longitude, ve.status,
+                   r.id, op.id, dp.id, ve.id,
+                   CASE WHEN json_valid(v.legs) THEN json_array_length(v.legs) END,
+                   vl.seq, lp.id, lp.name, lp.latitude, lp.longitude, lp.status
             FROM voyages v
             JOIN routes r ON v.route_id = r.id
             JOIN ports op ON r.origin_port_id = op.id
             JOIN ports dp ON r.destination_port_id = dp.id
             JOIN vessels ve ON v.vessel_id = ve.id
-        ''')
-        voyages = []
-        for row in cursor.fetchall():
-            fk_errors = []
-            # Check origin port
-            if row[7] is None or row[8] is None or row[9] is None:
-                fk_errors.append("origin_port")
-            # Check destination port
-            if row[11] is None or row[12] is None or row[13] is None:
-                fk_errors.append("destination_port")
-            # Check route
-            if row[5] is None or row[6] is None:
-                fk_errors.append("route")
-            # Check vessel
-            if row[15] is None or row[16] is None or row[17] is None:
-                fk_errors.append("vessel")
-            if fk_errors:
-                print(f"Skipping voyage due to missing or invalid foreign key(s): {', '.join(fk_errors)}")
-                continue
-            try:
-                origin_port = Port(row[7], [row[8], row[9]], row[10])
-                destination_port = Port(row[11], [row[12], row[13]], row[14])
-                route = ShippingRoute(
+            LEFT JOIN voyage_legs vl ON vl.voyage_id = v.id
+            LEFT JOIN ports lp ON vl.port_id = lp.id
+            {where}
+            ORDER BY v.id, vl.seq
+        '''
+        ensure_schema(self.db_path)
+        cursor = db.get_connection(self.db_path).cursor()
+        cursor.execute(sql, params)
+        ports, routes, vessels = {}, {}, {}
+        # One row per leg: rows are grouped back into voyages, and limit counts voyages, not rows
+        produced = 0
+        current, legs = None, []
+        while limit is None or produced < limit:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            for row in rows:
+                if current is None or row[0] != current[0]:
+                    if current is not None:
+                        voyage = self._build_voyage(current, legs, ports, routes, vessels)
+                        if voyage is not None:
+                            yield voyage
+                            produced += 1
+                            if limit is not None and produced >= limit:
+                                return
+                    current, legs = row, []
+                if row[24] is not None:
+                    legs.append(row[24:])
+        if current is not None and (limit is None or produced < limit):
+            voyage = self._build_voyage(current, legs, ports, routes, vessels)
+            if voyage is not None:
+                yield voyage
+
+    def _filter_clause(self, status, route, vessel, port, departed_from, departed_to, after_id):
+        clauses = []
+        params = []
+
+        def any_of(column, values):
+            values = [values] if isinstance(values, str) else list(values)
+            clauses.append(f'{column} IN ({",".join("?" * len(values))})')
+            params.extend(values)
+
+        if status:
+            any_of('v.status', status)
+        if route:
+            any_of('r.name', route)
+        if vessel:
+            any_of('ve.name_key', [normalize_place_name(v) for v in ([vessel] if isinstance(vessel, str) else vessel)])
+        if port:
+            port_key = normalize_place_name(port)
+            clauses.append('''(op.name_key = ? OR dp.name_key = ? OR v.id IN (
+                               SELECT voyage_id FROM voyage_legs
+                               WHERE port_id = (SELECT id FROM ports WHERE name_key = ?)))''')
+            params.extend([port_key, port_key, port_key])
+        if departed_from:
+            clauses.append('v.departure_date >= ?')
+            params.append(departed_from)
+        if departed_to:
+            clauses.append('v.departure_date <= ?')
+            params.append(departed_to)
+        if after_id is not None:
+            clauses.append('v.id > ?')
+            params.append(after_id)
+        return ('WHERE ' + ' AND '.join(clauses) if clauses else ''), params
+
+    def _build_voyage(self, row, legs, ports, routes, vessels):
+        fk_errors = []
+        # Check origin port
+        if row[7] is None or row[8] is None or row[9] is None:
+            fk_errors.append("origin_port")
+        # Check destination port
+        if row[11] is None or row[12] is None or row[13] is None:
+            fk_errors.append("destination_port")
+        # Check route
+        if row[5] is None or row[6] is None:
+            fk_errors.append("route")
+        # Check vessel
+        if row[15] is None or row[16] is None or row[17] is None:
+            fk_errors.append("vessel")
+        if fk_errors:
+            event(log, WARNING, 'voyage_skipped', missing=','.join(fk_errors))
+            return None
+        try:
+            route_id, origin_id, destination_id, vessel_id = row[19:23]
+            origin_port = ports.get(origin_id)
+            if origin_port is None:
+                origin_port = ports[origin_id] = Port(row[7], (row[8], row[9]), row[10])
+            destination_port = ports.get(destination_id)
+            if destination_port is None:
+                destination_port = ports[destination_id] = Port(row[11], (row[12], row[13]), row[14])
+            route = routes.get(route_id)
+            if route is None:
+                route = routes[route_id] = ShippingRoute(
                     name=row[5],
                     color=row[6],
                     origin_port=origin_port,
                     destination_port=destination_port
                 )
-                vessel = Vessel(row[15], [row[16], row[17]], row[18])
-            except Exception as e:
-                print(f"Skipping voyage due to error constructing objects: {e}")
-                continue
-            # Parse legs JSON and exclude origin/destination for transshipment_ports
-            legs = []
-            try:
-                legs = json.loads(row[4]) if row[4] else []
-            except Exception as e:
-                print(f"Error parsing legs for voyage: {e}")
-                legs = []
-            transshipment_ports = []
-            if legs and len(legs) > 2:
-                transshipment_ports = legs[1:-1]
-            voyage = Voyage(
-                route=route,
-                vessel=vessel,
-                departure_date=row[1],
-                arrival_date=row[2],
-                status=row[3],
-                transshipment_ports=transshipment_ports
-            )
-            voyages.append(voyage)
-        conn.close()
-        return voyages
+            vessel = vessels.get(vessel_id)
+            if vessel is None:
+                vessel = vessels[vessel_id] = Vessel(row[15], (row[16], row[17]), row[18])
+            transshipment_ports = None
+            leg_count = row[23]
+            if leg_count is not None and len(legs) == leg_count:
+                transshipment_ports = []
+                for _, port_id, name, lat, lon, status in legs[1:-1]:
+                    port = ports.get(port_id)
+                    if port is None:
+                        port = ports[port_id] = Port(name, (lat, lon), status)
+                    transshipment_ports.append(port)
+        except Exception as e:
+            event(log, WARNING, 'voyage_skipped', error=e)
+            return None
+        # Legs JSON (names) is decoded on first access; origin/destination are excluded from transshipment_ports
+        return Voyage(
+            route=route,
+            vessel=vessel,
+            departure_date=row[1],
+            arrival_date=row[2],
+            status=row[3],
+            transshipment_ports=transshipment_ports,
+            id=row[0],
+            legs_json=row[4]
+        )
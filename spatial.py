@@ -0,0 +1,179 @@
+"""
+Spatial queries on the SQLite R*Tree indexes of ports, vessels and vessel position reports.
+Boxes are (south, west, north, east) in degrees. A box whose west edge lies east of its
+east edge crosses the antimeridian and is searched as two boxes; longitudes outside
+[-180, 180] are wrapped. Radius searches read the circle's bounding box from the R*Tree
+and keep the points within the radius by haversine distance; nearest() widens the radius
+until it has found k points, so it never scans a table.
+Ports and vessels are kept in their indexes by triggers (see migrations._spatial_index);
+position reports are indexed by the box a vessel covered per TRACK_BOX_SECONDS, updated
+by PositionStore.ingest.
+"""
+import math
+import numpy as np
+from geodesy import EARTH_RADIUS_KM, haversine_km
+
+# Layer -> (SELECT over the R*Tree joined to its table, result field names, latitude and longitude columns)
+LAYERS = {
+    'ports': ('SELECT t.id, t.name, t.latitude, t.longitude FROM ports_rtree r JOIN ports t ON t.id = r.id',
+              ('id', 'name', 'latitude', 'longitude'), 't.latitude', 't.longitude'),
+    'vessels': ('SELECT t.id, t.name, t.current_latitude, t.current_longitude FROM vessels_rtree r JOIN vessels t ON t.id = r.id',
+                ('id', 'name', 'latitude', 'longitude'), 't.current_latitude', 't.current_longitude'),
+}
+# Position reports are indexed by one box per vessel and bucket of this many seconds; the box id packs (vessel_id, bucket)
+TRACK_BOX_SECONDS = 3600
+_TRACK_BOX_SELECT = f'''SELECT t.vessel_id, t.ts, t.latitude, t.longitude FROM vessel_track_boxes r
+                        JOIN vessel_positions t ON t.vessel_id = r.id >> 32
+                            AND t.ts >= (r.id & 4294967295) * {TRACK_BOX_SECONDS}
+                            AND t.ts < ((r.id & 4294967295) + 1) * {TRACK_BOX_SECONDS}'''
+# Half the earth's circumference: a circle this wide covers the whole globe
+MAX_RADIUS_KM = math.pi * EARTH_RADIUS_KM
+# First radius nearest() tries, and the factor it grows by while too few points are found
+NEAREST_START_KM = 50.0
+NEAREST_GROWTH = 4.0
+
+
+def wrap_longitude(lon):
+    """Longitude in [-180, 180); 180 itself becomes -180."""
+    return (float(lon) + 180.0) % 360.0 - 180.0
+
+
+def longitude_ranges(west, east):
+    """[(min_lon, max_lon), ...] covering west..east eastwards, split at the antimeridian."""
+    if east - west >= 360.0:
+        return [(-180.0, 180.0)]
+    west, east = wrap_longitude(west), wrap_longitude(east)
+    # An east edge of exactly 180 wraps to -180
+    if east == -180.0 and west > -180.0:
+        east = 180.0
+    if west <= east:
+        return [(west, east)]
+    return [(west, 180.0), (-180.0, east)]
+
+
+def _check_latitudes(*lats):
+    for lat in lats:
+        if not -90.0 <= lat <= 90.0:
+            raise ValueError(f'latitude {lat} is outside [-90, 90]')
+
+
+def circle_bbox(lat, lon, radius_km):
+    """
+    (south, west, north, east) around a circle on the sphere; west > east when it crosses
+    the antimeridian, and the full longitude range when it reaches a pole.
+    """
+    _check_latitudes(lat)
+    angle = min(radius_km, MAX_RADIUS_KM) / EARTH_RADIUS_KM
+    dlat = math.degrees(angle)
+    south, north = lat - dlat, lat + dlat
+    if south <= -90.0 or north >= 90.0:
+        return max(south, -90.0), -180.0, min(north, 90.0), 180.0
+    # Widest longitude offset on the circle, reached where a meridian touches it
+    ratio = math.sin(angle) / math.cos(math.radians(lat))
+    if ratio >= 1.0:
+        return south, -180.0, north, 180.0
+    dlon = math.degrees(math.asin(ratio))
+    return south, wrap_longitude(lon - dlon), north, wrap_longitude(lon + dlon)
+
+
+def _query_box(conn, select, lat, lon, south, west, north, east, extra='', extra_params=()):
+    _check_latitudes(south, north)
+    if south > north:
+        raise ValueError('south is greater than north')
+    rows = []
+    for min_lon, max_lon in longitude_ranges(west, east):
+        # The R*Tree narrows the search; its float32 boxes are rounded outwards, so the exact coordinates decide
+        sql = (f'{select} WHERE r.max_lat >= ? AND r.min_lat <= ? AND r.max_lon >= ? AND r.min_lon <= ?'
+               f' AND {lat} BETWEEN ? AND ? AND {lon} BETWEEN ? AND ?{extra}')
+        rows.extend(conn.execute(sql, [south, north, min_lon, max_lon, south, north, min_lon, max_lon, *extra_params]).fetchall())
+    # A point on the antimeridian (lon -180 and 180) can match both halves
+    return list(dict.fromkeys(rows))
+
+
+def in_bbox(conn, layer, south, west, north, east):
+    """Points of a layer ('ports' or 'vessels') inside a box, as dicts."""
+    select, fields, lat, lon = LAYERS[layer]
+    return [dict(zip(fields, row)) for row in _query_box(conn, select, lat, lon, south, west, north, east)]
+
+
+def within(conn, layer, lat, lon, radius_km):
+    """Points of a layer within radius_km of (lat, lon), nearest first, each with its distance_km."""
+    south, west, north, east = circle_bbox(lat, lon, radius_km)
+    points = in_bbox(conn, layer, south, west, north, east)
+    if not points:
+        return []
+    distances = haversine_km(np.full((len(points), 2), (lat, lon)),
+                             [(point['latitude'], point['longitude']) for point in points])
+    inside = [(float(distance), point) for distance, point in zip(distances, points) if distance <= radius_km]
+    inside.sort(key=lambda item: item[0])
+    return [dict(point, distance_km=distance) for distance, point in inside]
+
+
+def nearest(conn, layer, lat, lon, k=1, max_km=None):
+    """The k points of a layer closest to (lat, lon), nearest first, optionally no further than max_km."""
+    limit = min(max_km, MAX_RADIUS_KM) if max_km is not None else MAX_RADIUS_KM
+    radius = min(NEAREST_START_KM, limit)
+    while True:
+        # Every point within the radius is found, so once there are k of them they are the k nearest
+        points = within(conn, layer, lat, lon, radius)
+        if len(points) >= k or radius >= limit:
+            return points[:k]
+        radius = min(radius * NEAREST_GROWTH, limit)
+
+
+def positions_in_bbox(conn, south, west, north, east, since=None, until=None):
+    """
+    Position reports inside a box as dicts (vessel_id, ts, latitude, longitude), ordered by
+    vessel and time; since/until (epoch seconds) bound the report time.
+    """
+    extra, params = '', []
+    # Track boxes overlapping the window narrow the search, the report times decide
+    if since is not None:
+        extra += ' AND r.max_ts >= ? AND t.ts >= ?'
+        params += [since, since]
+    if until is not None:
+        extra += ' AND r.min_ts <= ? AND t.ts <= ?'
+        params += [until, until]
+    rows = _query_box(conn, _TRACK_BOX_SELECT, 't.latitude', 't.longitude', south, west, north, east, extra, params)
+    rows.sort()
+    return [dict(zip(('vessel_id', 'ts', 'latitude', 'longitude'), row)) for row in rows]
+
+
+def _extend_box(box, other):
+    """box and other are [min_lat, max_lat, min_lon, max_lon, min_ts, max_ts]; box grows to cover other."""
+    for i in (0, 2, 4):
+        box[i] = min(box[i], other[i])
+        box[i + 1] = max(box[i + 1], other[i + 1])
+
+
+def update_track_boxes(cursor, rows):
+    """
+    Grows the vessel_track_boxes entries to cover (vessel_id, ts, latitude, longitude, ...) rows,
+    with one R*Tree write per vessel and bucket instead of one per report. A box spanning more
+    than half the globe in longitude has crossed the antimeridian and covers every longitude.
+    Returns the number of boxes written.
+    """
+    boxes = {}
+    for vessel_id, ts, lat, lon, *_ in rows:
+        box_id = (vessel_id << 32) + ts // TRACK_BOX_SECONDS
+        if box_id in boxes:
+            _extend_box(boxes[box_id], (lat, lat, lon, lon, ts, ts))
+        else:
+            boxes[box_id] = [lat, lat, lon, lon, ts, ts]
+    box_ids = list(boxes)
+    for start in range(0, len(box_ids), 500):
+        chunk = box_ids[start:start + 500]
+        cursor.execute('SELECT id, min_lat, max_lat, min_lon, max_lon, min_ts, max_ts FROM vessel_track_boxes '
+                       f'WHERE id IN ({",".join("?" * len(chunk))})', chunk)
+        for row in cursor.fetchall():
+            box = boxes[row[0]]
+            _extend_box(box, row[1:])
+            # Reports inside a stored box (a resend, a vessel at berth) leave it as it is
+            if box == list(row[1:]):
+                del boxes[row[0]]
+    for box in boxes.values():
+        if box[3] - box[2] > 180.0:
+            box[2], box[3] = -180.0, 180.0
+    cursor.executemany('INSERT OR REPLACE INTO vessel_track_boxes (id, min_lat, max_lat, min_lon, max_lon, min_ts, max_ts) '
+                       'VALUES (?, ?, ?, ?, ?, ?, ?)', [(box_id, *box) for box_id, box in boxes.items()])
+    return len(boxes)